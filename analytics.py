@@ -0,0 +1,123 @@
+import array           # Typed column buffers, written to disk as raw little-endian values.
+import json            # Encodes the block headers.
+import struct          # Frames the blocks.
+import sys             # Byte order of the column buffers.
+import threading       # Runs the writer thread and guards the column buffers.
+import time            # Timestamps the rounds and paces the writer.
+
+# ------------------------- Round Analytics ------------------------- #
+# Facts about every finished round (topic, players, votes, how fast people voted, who was eliminated,
+# who won) are collected for tuning DISCUSSION_TIME, VOTING_DURATION and the topic list offline
+# (see round_stats.py). Recording a round appends one value to each column under a small lock; a
+# writer thread appends the collected rows to the file as one block every FLUSH_INTERVAL seconds.
+#
+# File format: MAGIC, then blocks of
+#   4-byte little-endian header length, JSON header, column data
+# The header is {"rows": N, "topics": [...], "columns": [[name, typecode, byte length], ...]}; each column
+# is N raw little-endian values of its array typecode, in header order. Topics are stored as indexes
+# into the block's "topics" list. A reader loads a whole column with a single frombuffer call per block.
+
+MAGIC = b"BLENDIN-ROUNDS-1\n"
+FLUSH_INTERVAL = 5.0       # Seconds between writes.
+
+ELIMINATED_NONE, ELIMINATED_CREWMATE, ELIMINATED_IMPOSTOR = 0, 1, 2
+OUTCOME_NEXT_ROUND, OUTCOME_CREWMATES, OUTCOME_IMPOSTOR = 0, 1, 2
+
+# Column name -> array typecode. Times are seconds; first_vote and last_vote count from the start of
+# voting and are NaN when nobody voted.
+COLUMNS = (
+    ("time", "d"),             # Wall-clock time the round ended.
+    ("round", "H"),            # Round number within its game, from 1.
+    ("players", "H"),          # Players when voting closed.
+    ("votes", "H"),            # Votes cast.
+    ("first_vote", "f"),
+    ("last_vote", "f"),
+    ("voting_seconds", "f"),   # How long voting stayed open (less than voting_time if everyone voted).
+    ("eliminated", "b"),       # ELIMINATED_* constant.
+    ("outcome", "b"),          # OUTCOME_* constant.
+    ("topic", "H"),            # Index into the block's topic list.
+    ("discussion_time", "f"),  # Settings the round was played with.
+    ("voting_time", "f"),
+)
+
+lock = threading.Lock()    # Guards the column buffers and the topic index.
+columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+topics = {}                # Topic -> its index in the current block.
+writer = None              # The writer thread, or None when analytics are off.
+path = None
+
+def record_round(**values):
+    """
+    Adds one finished round; 'values' has an entry for every column (the topic as text).
+    A no-op when analytics are off.
+    """
+    if writer is None:
+        return
+    with lock:
+        values["topic"] = topics.setdefault(values["topic"], len(topics))
+        for name, _typecode in COLUMNS:
+            columns[name].append(values[name])
+
+def flush():
+    """
+    Appends the rounds recorded since the last flush to the file as one block.
+    """
+    global columns, topics
+    with lock:
+        block, block_topics = columns, topics
+        if not len(block["time"]):
+            return
+        columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+        topics = {}
+    data = []
+    for name, _typecode in COLUMNS:
+        column = block[name]
+        if sys.byteorder != "little":
+            column.byteswap()
+        data.append(column.tobytes())
+    header = json.dumps({"rows": len(block["time"]),
+                         "topics": sorted(block_topics, key=block_topics.get),
+                         "columns": [[name, typecode, len(chunk)] for (name, typecode), chunk in zip(COLUMNS, data)]},
+                        separators=(",", ":")).encode()
+    with open(path, "ab") as f:
+        f.write(struct.pack("<I", len(header)) + header + b"".join(data))
+
+def read_blocks(file_path):
+    """
+    Yields (header, {column name: raw bytes}) for every block of a rounds file.
+    """
+    with open(file_path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{file_path} is not a rounds file")
+        while True:
+            prefix = f.read(4)
+            if len(prefix) < 4:
+                return
+            header = json.loads(f.read(struct.unpack("<I", prefix)[0]))
+            data = {}
+            for name, _typecode, length in header["columns"]:
+                data[name] = f.read(length)
+                if len(data[name]) < length:
+                    return  # A block cut short by a crash.
+            yield header, data
+
+def _run():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError as e:
+            print(f"[ANALYTICS] Write failed: {e}")
+
+def start(file_path):
+    """
+    Starts recording rounds to 'file_path' (appending if it already holds rounds).
+    """
+    global writer, path
+    path = file_path
+    with open(path, "ab") as f:
+        if f.tell() == 0:
+            f.write(MAGIC)
+    writer = threading.Thread(target=_run, daemon=True)
+    writer.start()
+    print(f"[ANALYTICS] Recording rounds to {path}")
@@ -0,0 +1,184 @@
+"""
+Measures how long message handlers wait for the game session locks under a chat-heavy load.
+
+The server runs in a child process (threaded mode) with every lock created by game_session.py
+replaced by a timing wrapper. Each wait is charged to the handler that was running on the waiting
+thread: the message type, 'disconnect', or 'timer' for phase transitions. Bots spread over several
+sessions ready up and are matched into games; once a round's discussion opens, two thirds of them
+join its chat rooms and the rest stay in the game's lobby. All of them chat at a fixed rate, and
+some keep disconnecting and rejoining (and readying up again).
+
+Usage: python benchmarks/bench_contention.py [--bots N] [--sessions N] [--rate MSGS_PER_S] [--seconds S]
+                                             [--server-dir PATH]
+--server-dir benchmarks another checkout of the server (e.g. a git worktree of an older commit),
+so lock waits can be compared before and after a change.
+"""
+import argparse        # Parses the benchmark options.
+import asyncio         # Drives all bots from one event loop in the parent process.
+import json            # Encodes bot messages and carries the child's results.
+import os              # Used to locate the repository.
+import random          # Spreads bot timing and picks which bots rejoin.
+import subprocess      # Starts the instrumented server process.
+import sys             # Used to extend the module search path in the child.
+import threading       # Provides the real lock types and per-thread handler names (child only).
+import time            # Provides perf_counter for measuring waits.
+import types           # Builds the patched 'threading' module seen by game_session (child only).
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ------------------------- Instrumented Server (child process) ------------------------- #
+current = threading.local()  # current.handler: name of the handler running on this thread.
+stats = {}                   # Handler name -> [acquisitions, contended acquisitions, total wait, max wait].
+stats_lock = threading.Lock()
+
+class TimedLock:
+    """
+    Wraps a Lock or RLock and charges the time spent waiting for it to the current handler.
+    """
+    def __init__(self, factory):
+        self.lock = factory()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            self._record(0.0)
+            return True
+        start = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        self._record(time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _record(self, wait):
+        handler = getattr(current, "handler", "timer")
+        with stats_lock:
+            entry = stats.setdefault(handler, [0, 0, 0.0, 0.0])
+            entry[0] += 1
+            if wait:
+                entry[1] += 1
+                entry[2] += wait
+                entry[3] = max(entry[3], wait)
+
+def labelled(handler_name, function):
+    def run(*args):
+        previous = getattr(current, "handler", None)
+        current.handler = handler_name(args)
+        try:
+            return function(*args)
+        finally:
+            current.handler = previous
+    return run
+
+def serve(server_dir, port):
+    sys.path.insert(0, server_dir)
+    os.chdir(server_dir)
+    import game_session
+    import server
+    patched = types.SimpleNamespace(**vars(threading))
+    patched.Lock = lambda: TimedLock(threading.Lock)
+    patched.RLock = lambda: TimedLock(threading.RLock)
+    game_session.threading = patched
+    server.handle_message = labelled(lambda args: args[1].get("type", "?"), server.handle_message)
+    server.handle_disconnect = labelled(lambda args: "disconnect", server.handle_disconnect)
+    sys.stdout = open(os.devnull, "w")  # The server's own logging is not part of the measurement.
+    game_session.MATCH_WAIT = 0.5  # Bots that rejoin are matched into small games instead of waiting.
+    threading.Thread(target=server.run_server, args=("127.0.0.1", port), daemon=True).start()
+    sys.stdin.readline()  # The parent asks for the results once the load is over.
+    with stats_lock:
+        report = json.dumps(stats)
+    sys.__stdout__.write(report + "\n")
+    sys.__stdout__.flush()
+    os._exit(0)
+
+# ------------------------- Bots (parent process) ------------------------- #
+def frame(message_type, **fields):
+    fields["type"] = message_type
+    return (json.dumps(fields) + "\n").encode()
+
+async def listen(reader, writer, slot):
+    """
+    Reads the server's messages: readies up whenever the bot is (back) in the lobby and, when a
+    round's discussion opens, joins one of its chat rooms (two thirds of the bots; the rest chat
+    in the game's lobby).
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        text = message.get("message") or ""
+        if message.get("type") == "LOBBY_JOINED":
+            writer.write(frame("READY"))
+        elif message.get("type") == "PING":
+            writer.write(frame("PONG"))  # Server heartbeat.
+        elif text.startswith("Choose a room number") and slot % 3 != 2:
+            # "Choose a room number (1 to N) ...": rooms only exist while the discussion runs.
+            rooms = int(text.split("(1 to ", 1)[1].split(")", 1)[0])
+            writer.write(frame("JOIN", room_id=random.randint(1, rooms)))
+
+async def bot(port, index, args, deadline):
+    session_id = f"bench{index % args.sessions}"
+    slot = index // args.sessions
+    rounds = 0
+    while time.monotonic() < deadline:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 20)
+        listener = asyncio.ensure_future(listen(reader, writer, slot))
+        writer.write(frame("JOIN_ROOM", player_name=f"bot{index}-{rounds}", session_id=session_id))
+        rejoin_at = time.monotonic() + random.uniform(0.5, 1.5) * args.churn if random.random() < 0.2 else deadline
+        while time.monotonic() < min(deadline, rejoin_at):
+            writer.write(frame("CHAT", message=f"message from bot {index}", room_id="current"))
+            await writer.drain()
+            await asyncio.sleep(random.expovariate(args.rate))
+        writer.close()
+        listener.cancel()
+        rounds += 1
+
+async def run_load(port, args):
+    deadline = time.monotonic() + args.seconds
+    await asyncio.gather(*(bot(port, i, args, deadline) for i in range(args.bots)), return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Lock wait time per handler under a chat-heavy load")
+    parser.add_argument("--bots", type=int, default=300, help="connected bots (default: 300)")
+    parser.add_argument("--sessions", type=int, default=2, help="game sessions the bots are spread over (default: 2)")
+    parser.add_argument("--rate", type=float, default=5, help="chat messages per second per bot (default: 5)")
+    parser.add_argument("--churn", type=float, default=1, help="mean seconds before a rejoining bot reconnects (default: 1)")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the run (default: 10)")
+    parser.add_argument("--port", type=int, default=5600, help="port for the benchmark server (default: 5600)")
+    parser.add_argument("--server-dir", default=REPO_DIR, help="checkout of the server to benchmark (default: this one)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(os.path.abspath(args.server_dir), args.port)
+        return
+
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port),
+                              "--server-dir", args.server_dir], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    time.sleep(1)
+    asyncio.run(run_load(args.port, args))
+    child.stdin.write("report\n")
+    child.stdin.flush()
+    results = json.loads(child.stdout.readline())
+    child.wait()
+
+    print(f"{args.bots} bots in {args.sessions} sessions, {args.rate:g} chats/s each, {args.seconds:g}s "
+          f"({os.path.relpath(args.server_dir)})")
+    print(f"{'handler':<12} {'acquires':>9} {'contended':>10} {'wait ms':>9} {'mean us':>8} {'max ms':>8}")
+    total_wait = 0.0
+    for handler, (acquires, contended, wait, max_wait) in sorted(results.items(), key=lambda item: -item[1][2]):
+        total_wait += wait
+        print(f"{handler:<12} {acquires:>9} {contended:>10} {wait * 1e3:>9.1f} "
+              f"{wait / max(acquires, 1) * 1e6:>8.2f} {max_wait * 1e3:>8.2f}")
+    print(f"total lock wait: {total_wait * 1e3:.1f} ms")
+
+if __name__ == "__main__":
+    main()
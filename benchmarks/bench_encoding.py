@@ -0,0 +1,73 @@
+"""
+Compares the newline-delimited JSON wire format with the negotiated binary format
+on the high-volume message types (CHAT and INFO): bytes on the wire, encode time
+and parse time (splitting a received burst into frames and decoding them).
+
+Usage: python benchmarks/bench_encoding.py [--messages N] [--length CHARS]
+"""
+import argparse        # Parses the benchmark options.
+import os              # Used to make the repository modules importable.
+import sys             # Used to extend the module search path.
+import time            # Provides perf_counter for timing.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import create_message, decode_frame, WIRE_JSON, WIRE_BINARY
+from framing import FrameReader
+
+RECV_CHUNK = 4096  # The received burst is fed to the parser in chunks of this size, like socket reads.
+
+def sample_messages(count, length):
+    """
+    Builds a mix of CHAT messages (client -> server) and the INFO messages they fan out as.
+    """
+    text = ("lorem ipsum dolor sit amet " * (length // 27 + 1))[:length]
+    messages = []
+    for i in range(count):
+        if i % 2:
+            messages.append(("CHAT", {"message": text, "room_id": "current"}))
+        else:
+            messages.append(("INFO", {"message": f"player{i % 8}: {text}"}))
+    return messages
+
+def bench(wire_format, messages):
+    start = time.perf_counter()
+    frames = [create_message(message_type, **fields).encode(wire_format) for message_type, fields in messages]
+    encode_time = time.perf_counter() - start
+
+    burst = b"".join(frames)
+    chunks = [burst[i:i + RECV_CHUNK] for i in range(0, len(burst), RECV_CHUNK)]
+    start = time.perf_counter()
+    decoded = 0
+    reader = FrameReader()
+    for chunk in chunks:
+        reader.feed(chunk)
+        while True:
+            frame = reader.next_frame(wire_format)
+            if frame is None:
+                break
+            if decode_frame(frame, wire_format):
+                decoded += 1
+    parse_time = time.perf_counter() - start
+    assert decoded == len(messages)
+    return len(burst), encode_time, parse_time
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON vs binary wire format benchmark")
+    parser.add_argument("--messages", type=int, default=20000, help="messages per run (default: 20000)")
+    parser.add_argument("--length", type=int, default=40, help="chat text length in characters (default: 40)")
+    args = parser.parse_args()
+
+    messages = sample_messages(args.messages, args.length)
+    print(f"{args.messages} CHAT/INFO messages, {args.length}-character chat text")
+    print(f"{'format':<8} {'bytes/msg':>10} {'encode us/msg':>14} {'parse us/msg':>13}")
+    results = {}
+    for wire_format in (WIRE_JSON, WIRE_BINARY):
+        size, encode_time, parse_time = bench(wire_format, messages)
+        results[wire_format] = size
+        print(f"{wire_format:<8} {size / len(messages):>10.1f} {encode_time / len(messages) * 1e6:>14.2f} "
+              f"{parse_time / len(messages) * 1e6:>13.2f}")
+    print(f"binary uses {results[WIRE_BINARY] / results[WIRE_JSON]:.0%} of the JSON bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""
+Headless load test: thousands of bot players speaking the real protocol against a server.
+
+Each bot connects, joins one of the games (--players-per-game bots each), readies up, hops between
+chat rooms while a round is running, chats and pings at the configured rates and votes when asked.
+When a game ends the bots ready up again; bots that get voted out reconnect under a new name.
+The bots run on asyncio event loops, optionally spread over several processes (--processes).
+
+Measured after the warm-up:
+  chat fan-out - time from a CHAT being sent until each recipient receives it (every chat carries
+                 its send time; all processes share the system's monotonic clock)
+  ping         - PING to PONG round trip
+  throughput   - messages sent and received per second by all bots together
+  server RSS   - peak resident memory of the server and its worker processes (Linux /proc)
+
+Usage: python benchmarks/loadtest.py [--bots N] [--processes N] [--chat-rate R] [--seconds S] ...
+By default a server is started from this checkout with short rounds; pass --attach to load a
+server that is already running on --host/--port instead (--server-pid to still report its memory).
+
+--save-baseline NAME writes the results to benchmarks/baselines/NAME.json, and --compare NAME
+prints them next to a saved baseline and exits with status 1 if any metric got worse by more than
+--tolerance, so regressions in the server show up as numbers. Baselines are only comparable
+between runs on the same machine with the same options.
+"""
+import argparse        # Parses the load test options.
+import asyncio         # Runs the bots of one process on a single event loop.
+import json            # Reads and writes baseline files.
+import math            # Computes the logarithmic histogram buckets.
+import multiprocessing # Spreads the bots over several processes.
+import os              # Locates the repository and reads process information from /proc.
+import platform        # Describes the machine a baseline was recorded on.
+import random          # Spreads bot timing and picks rooms and vote targets.
+import signal          # Stops the server the test started.
+import socket          # Waits for the started server to accept connections.
+import subprocess      # Starts the server under test.
+import sys             # Extends the module search path and finds the Python interpreter.
+import time            # Provides the monotonic clock used for every measurement.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(REPO_DIR, "benchmarks", "baselines")
+sys.path.insert(0, REPO_DIR)
+
+from protocol import create_message, decode_frame, InvalidMessage, FRAME_HEADER, WIRE_JSON, WIRE_BINARY
+
+CHAT_MARK = "@t="  # Chat text written by a bot: CHAT_MARK followed by the send time in ns.
+
+# ------------------------- Statistics ------------------------- #
+class Histogram:
+    """
+    Latency histogram with logarithmic buckets about 1% wide starting at 1 microsecond.
+    Keeping counts instead of samples bounds the memory per process, and histograms from
+    several processes merge by adding their counts.
+    """
+    GROWTH = math.log(1.01)
+
+    def __init__(self, counts=None):
+        self.counts = counts or {}  # Bucket index -> number of samples.
+
+    def add(self, seconds):
+        bucket = int(math.log(max(seconds * 1e6, 1.0)) / self.GROWTH)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def percentile(self, fraction):
+        """
+        Returns the latency in milliseconds below which 'fraction' of the samples fall (None if empty).
+        """
+        remaining = fraction * self.total()
+        for bucket in sorted(self.counts):
+            remaining -= self.counts[bucket]
+            if remaining <= 0:
+                return math.exp((bucket + 0.5) * self.GROWTH) / 1e3  # Middle of the bucket, in ms.
+        return None
+
+class BotStats:
+    """
+    Counters shared by the bots of one process; only events after the warm-up are counted.
+    """
+    def __init__(self):
+        self.chat = Histogram()
+        self.ping = Histogram()
+        self.sent = 0
+        self.received = 0
+        self.disconnects = 0   # Connections the server closed (e.g. voted out), followed by a reconnect.
+        self.errors = 0        # Failed connects and invalid messages.
+
+    def merge(self, other):
+        self.chat.merge(other.chat)
+        self.ping.merge(other.ping)
+        self.sent += other.sent
+        self.received += other.received
+        self.disconnects += other.disconnects
+        self.errors += other.errors
+
+# ------------------------- Bots ------------------------- #
+class Bot:
+    """
+    One simulated player. Its connection is re-established under a new name whenever the
+    server closes it, until the test is over.
+    """
+    def __init__(self, index, args, stats, measure_from, ready_at):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.measure_from = measure_from   # Monotonic ns after which events are counted.
+        self.ready_at = ready_at           # Monotonic seconds: the first READY waits until every bot joined.
+        self.session_id = f"load{args.run_id}-{index // args.players_per_game}"
+        self.generation = 0
+        self.name = None
+        self.writer = None
+        self.wire_format = WIRE_JSON
+        self.players = []                  # Player names of our lobby or game, from ROSTER and ROSTER_UPDATE.
+        self.roster_version = None
+        self.max_rooms = 0                 # Rooms on offer in the running round, 0 between rounds.
+        self.pings = []                    # Send times of PINGs waiting for their PONG, oldest first.
+
+    def counting(self):
+        return time.monotonic_ns() >= self.measure_from
+
+    def send(self, message_type, **fields):
+        self.writer.write(create_message(message_type, **fields).encode(self.wire_format))
+        if self.counting():
+            self.stats.sent += 1
+
+    async def run(self):
+        while True:
+            try:
+                await self.play()
+                self.stats.disconnects += self.counting()
+            except asyncio.IncompleteReadError:
+                self.stats.disconnects += self.counting()
+            except OSError:
+                self.stats.errors += self.counting()
+                await asyncio.sleep(random.uniform(0.5, 1.5))
+            finally:
+                if self.writer is not None:
+                    self.writer.close()
+                    self.writer = None
+            self.generation += 1
+
+    async def play(self):
+        """
+        Plays on one connection until the server closes it.
+        """
+        reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        self.wire_format = WIRE_JSON
+        self.players, self.max_rooms, self.pings = [], 0, []
+        if self.args.encoding == WIRE_BINARY:
+            self.send("HELLO", encoding=WIRE_BINARY)
+            reply = decode_frame(await reader.readline())
+            self.wire_format = (reply.get("encoding") or WIRE_JSON) if reply else WIRE_JSON
+        self.name = f"bot{self.index}-{self.generation}"
+        self.send("JOIN_ROOM", player_name=self.name, session_id=self.session_id)
+        actions = asyncio.ensure_future(self.act())
+        try:
+            while True:
+                if self.wire_format == WIRE_BINARY:
+                    (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                    frame = await reader.readexactly(length)
+                else:
+                    frame = await reader.readline()
+                    if not frame:
+                        return
+                try:
+                    message = decode_frame(frame, self.wire_format)
+                except InvalidMessage:
+                    self.stats.errors += self.counting()
+                    continue
+                if message:
+                    self.on_message(message)
+        finally:
+            actions.cancel()
+
+    def on_message(self, message):
+        now = time.monotonic_ns()
+        if now >= self.measure_from:
+            self.stats.received += 1
+        message_type = message["type"]
+        if message_type == "INFO":
+            text = message["message"] or ""
+            mark = text.find(CHAT_MARK)
+            if mark >= 0:
+                sent = int(text[mark + len(CHAT_MARK):])
+                if sent >= self.measure_from:
+                    self.stats.chat.add((now - sent) / 1e9)
+            elif text.startswith("Choose a room number"):
+                # "Choose a room number (1 to N) ...": join one right away.
+                self.max_rooms = int(text.split("(1 to ", 1)[1].split(")", 1)[0])
+                self.send("JOIN", room_id=random.randint(1, self.max_rooms))
+            elif text.startswith("Please vote"):
+                self.max_rooms = 0
+                candidates = [player for player in self.players if player != self.name]
+                if candidates:
+                    asyncio.get_running_loop().call_later(random.uniform(0, self.args.vote_delay), self.vote,
+                                                          self.writer, random.choice(candidates))
+        elif message_type == "PING":
+            self.send("PONG")  # Server heartbeat.
+        elif message_type == "PONG":
+            if self.pings:
+                sent = self.pings.pop(0)
+                if sent >= self.measure_from:
+                    self.stats.ping.add((now - sent) / 1e9)
+        elif message_type == "ROSTER":
+            self.players = message["players"] or []
+            self.roster_version = message["version"]
+        elif message_type == "ROSTER_UPDATE":
+            if self.roster_version is not None and message["version"] == self.roster_version + 1:
+                gone = set(message["removed"] or ())
+                self.players = [player for player in self.players if player not in gone] + (message["added"] or [])
+                self.roster_version = message["version"]
+            elif self.roster_version is None or message["version"] > self.roster_version:
+                self.send("ROSTER_SYNC")  # Missed an update: get the whole list again.
+        elif message_type == "GAME_STARTED" and message["version"] != self.roster_version:
+            self.send("ROSTER_SYNC")
+        elif message_type == "LOBBY_JOINED" and self.generation == 0:
+            # Wait for the rest of the bots before the very first READY so games start full.
+            delay = max(0.0, self.ready_at - time.monotonic())
+            asyncio.get_running_loop().call_later(delay, self.ready, self.writer)
+        elif message_type in ("LOBBY_JOINED", "END_GAME"):
+            self.max_rooms = 0
+            asyncio.get_running_loop().call_later(random.uniform(0.5, 1.5), self.ready, self.writer)
+
+    def ready(self, writer):
+        if writer is self.writer:  # Skip it if the connection was replaced in the meantime.
+            self.send("READY")
+
+    def vote(self, writer, target):
+        if writer is self.writer:
+            self.send("VOTE", target=target)
+
+    async def act(self):
+        """
+        Chats, pings and hops between rooms, each at its own average rate (exponential gaps).
+        """
+        args = self.args
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        next_chat = now + random.expovariate(args.chat_rate) if args.chat_rate else math.inf
+        next_ping = now + random.expovariate(args.ping_rate) if args.ping_rate else math.inf
+        next_hop = now + random.expovariate(args.hop_rate) if args.hop_rate else math.inf
+        while True:
+            await asyncio.sleep(max(0.0, min(next_chat, next_ping, next_hop) - loop.time()))
+            now = loop.time()
+            if now >= next_chat:
+                self.send("CHAT", message=f"{CHAT_MARK}{time.monotonic_ns()}", room_id="current")
+                next_chat = now + random.expovariate(args.chat_rate)
+            if now >= next_ping:
+                self.pings.append(time.monotonic_ns())
+                self.send("PING")
+                next_ping = now + random.expovariate(args.ping_rate)
+            if now >= next_hop:
+                if self.max_rooms:
+                    self.send("JOIN", room_id=random.randint(1, self.max_rooms))
+                next_hop = now + random.expovariate(args.hop_rate)
+            await self.writer.drain()
+
+async def run_bots(indices, args, measure_from, ready_at, deadline):
+    """
+    Runs the given bots on this process's event loop until the deadline (monotonic seconds).
+    """
+    stats = BotStats()
+    bots = []
+    ramp = args.ramp / max(len(indices), 1)
+    for index in indices:
+        bots.append(asyncio.ensure_future(Bot(index, args, stats, measure_from, ready_at).run()))
+        await asyncio.sleep(ramp)  # Spread the connects so the listen backlog does not overflow.
+    await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+    for bot in bots:
+        bot.cancel()
+    await asyncio.gather(*bots, return_exceptions=True)
+    return stats
+
+def bot_process(indices, args, measure_from, ready_at, deadline, results):
+    raise_file_limit()
+    results.put(asyncio.run(run_bots(indices, args, measure_from, ready_at, deadline)))
+
+def raise_file_limit():
+    """
+    Lets this process (and the server it starts) open as many sockets as the hard limit allows.
+    """
+    try:
+        import resource
+        _soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+# ------------------------- Server ------------------------- #
+def start_server(args):
+    """
+    Starts server.py from this checkout with short rounds and waits until it accepts connections.
+    """
+    command = [sys.executable, os.path.join(REPO_DIR, "server.py"), "--host", args.host, "--port", str(args.port),
+               "--mode", args.mode, "--workers", str(args.workers),
+               "--discussion-time", str(args.discussion_time), "--voting-time", str(args.voting_time)]
+    server = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL)
+    give_up = time.monotonic() + 10
+    while time.monotonic() < give_up:
+        try:
+            socket.create_connection((args.host, args.port), timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.1)
+    stop_server(server, args.workers)
+    sys.exit(f"The server did not start listening on {args.host}:{args.port}.")
+
+def stop_server(server, workers=1):
+    # A multi-process launcher stops its workers when interrupted; a single server can just be terminated.
+    server.send_signal(signal.SIGINT if workers > 1 else signal.SIGTERM)
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+def process_tree_rss(pid):
+    """
+    Returns the resident memory in bytes of a process and all its descendants, or None if unknown.
+    """
+    children = {}
+    try:
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        parent = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+                children.setdefault(parent, []).append(int(entry))
+    except OSError:
+        return None
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total or None
+
+# ------------------------- Results ------------------------- #
+# Metric name -> True if higher is better.
+METRICS = {
+    "chat_p50_ms": False, "chat_p99_ms": False, "chat_p999_ms": False,
+    "ping_p50_ms": False, "ping_p99_ms": False, "ping_p999_ms": False,
+    "received_per_s": True, "sent_per_s": True,
+    "server_rss_mb": False, "errors": False,
+}
+
+def summarize(stats, seconds, peak_rss):
+    results = {}
+    for name, histogram in (("chat", stats.chat), ("ping", stats.ping)):
+        results[f"{name}_samples"] = histogram.total()
+        for label, fraction in (("p50", 0.5), ("p99", 0.99), ("p999", 0.999)):
+            value = histogram.percentile(fraction)
+            results[f"{name}_{label}_ms"] = round(value, 3) if value is not None else None
+    results["received_per_s"] = round(stats.received / seconds, 1)
+    results["sent_per_s"] = round(stats.sent / seconds, 1)
+    results["server_rss_mb"] = round(peak_rss / 2**20, 1) if peak_rss else None
+    results["disconnects"] = stats.disconnects
+    results["errors"] = stats.errors
+    return results
+
+def print_results(results):
+    print(f"{'':<14} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'samples':>9}")
+    for name, label in (("chat", "chat fan-out"), ("ping", "ping/pong")):
+        cells = [results[f"{name}_{p}_ms"] for p in ("p50", "p99", "p999")]
+        print(f"{label:<14} " + " ".join(f"{cell:>9.2f}" if cell is not None else f"{'-':>9}" for cell in cells)
+              + f" {results[f'{name}_samples']:>9}")
+    print(f"messages/s: {results['received_per_s']:g} received, {results['sent_per_s']:g} sent")
+    rss = results["server_rss_mb"]
+    print(f"server RSS: {f'{rss:g} MB peak' if rss is not None else 'unknown'}")
+    print(f"disconnects: {results['disconnects']}, errors: {results['errors']}")
+
+def compare(results, baseline, tolerance):
+    """
+    Prints every metric next to its baseline value. Returns the metrics that got worse by more than 'tolerance'.
+    """
+    regressions = []
+    print(f"\n{'metric':<16} {'baseline':>10} {'now':>10} {'change':>8}")
+    for metric, higher_is_better in METRICS.items():
+        before, now = baseline["results"].get(metric), results.get(metric)
+        if before is None or now is None:
+            print(f"{metric:<16} {str(before):>10} {str(now):>10} {'':>8}")
+            continue
+        change = (now - before) / before if before else (0.0 if now == before else math.inf)
+        worse = -change if higher_is_better else change
+        flag = "  worse" if worse > tolerance else ""
+        if flag:
+            regressions.append(metric)
+        print(f"{metric:<16} {before:>10g} {now:>10g} {change:>+8.0%}{flag}")
+    return regressions
+
+def config_of(args):
+    keys = ("bots", "processes", "players_per_game", "chat_rate", "ping_rate", "hop_rate", "seconds", "warmup",
+            "encoding", "mode", "workers", "discussion_time", "voting_time")
+    return {key: getattr(args, key) for key in keys}
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+# ------------------------- Main ------------------------- #
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless load test with protocol-speaking bots")
+    parser.add_argument("--bots", type=int, default=1000, help="bot players (default: 1000)")
+    parser.add_argument("--processes", type=int, default=1, help="processes the bots are spread over (default: 1)")
+    parser.add_argument("--players-per-game", type=int, default=8, help="bots in each game session (default: 8)")
+    parser.add_argument("--chat-rate", type=float, default=0.5, help="chat messages per second per bot (default: 0.5)")
+    parser.add_argument("--ping-rate", type=float, default=0.2, help="pings per second per bot (default: 0.2)")
+    parser.add_argument("--hop-rate", type=float, default=0.2,
+                        help="room changes per second per bot while a round runs (default: 0.2)")
+    parser.add_argument("--vote-delay", type=float, default=1, help="longest wait before voting, in seconds (default: 1)")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which the bots connect (default: 5)")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds after the ramp before measuring (default: 3)")
+    parser.add_argument("--seconds", type=float, default=20, help="length of the measurement (default: 20)")
+    parser.add_argument("--encoding", choices=[WIRE_JSON, WIRE_BINARY], default=WIRE_JSON,
+                        help="wire format the bots negotiate (default: json)")
+    parser.add_argument("--host", default="127.0.0.1", help="server address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=5601, help="server port (default: 5601)")
+    parser.add_argument("--attach", action="store_true", help="use the server already running on --host/--port")
+    parser.add_argument("--server-pid", type=int, help="process id of an attached server, to report its memory")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded",
+                        help="mode of the started server (default: threaded)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of the started server (default: 1)")
+    parser.add_argument("--discussion-time", type=float, default=5,
+                        help="discussion seconds per round on the started server (default: 5)")
+    parser.add_argument("--voting-time", type=float, default=3,
+                        help="voting seconds on the started server (default: 3)")
+    parser.add_argument("--save-baseline", metavar="NAME", help="save the results as benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="compare the results with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="relative change counted as a regression by --compare (default: 0.5)")
+    args = parser.parse_args(argv)
+    args.run_id = os.getpid()  # Keeps game ids apart from earlier runs against the same server.
+    return args
+
+def main():
+    args = parse_args()
+    raise_file_limit()
+    baseline = None
+    if args.compare:
+        with open(baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+    server = None if args.attach else start_server(args)
+    server_pid = args.server_pid if args.attach else server.pid
+
+    start = time.monotonic()
+    ready_at = start + args.ramp + 0.5
+    measure_from = ready_at + args.warmup
+    deadline = measure_from + args.seconds
+    measure_from_ns = int(measure_from * 1e9)  # time.monotonic_ns() uses the same clock.
+    groups = [list(range(args.bots))[i::args.processes] for i in range(args.processes)]
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=bot_process, args=(group, args, measure_from_ns, ready_at, deadline, queue),
+                                       daemon=True) for group in groups]
+    for worker in workers:
+        worker.start()
+
+    peak_rss = 0
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        if server_pid and time.monotonic() >= ready_at:
+            peak_rss = max(peak_rss, process_tree_rss(server_pid) or 0)
+    stats = BotStats()
+    for _ in workers:
+        stats.merge(queue.get())
+    for worker in workers:
+        worker.join()
+    if server is not None:
+        stop_server(server, args.workers)
+
+    results = summarize(stats, args.seconds, peak_rss)
+    games = math.ceil(args.bots / args.players_per_game)
+    print(f"{args.bots} bots in {games} games over {args.processes} process(es), {args.encoding}; "
+          f"{args.chat_rate:g} chats/s, {args.ping_rate:g} pings/s, {args.hop_rate:g} hops/s per bot; {args.seconds:g}s measured")
+    if server is not None:
+        print(f"server: {args.mode} mode, {args.workers} worker(s), rounds of {args.discussion_time:g}s + {args.voting_time:g}s")
+    print_results(results)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path(args.save_baseline), "w") as f:
+            json.dump({"recorded": time.strftime("%Y-%m-%d %H:%M:%S"), "machine": platform.platform(),
+                       "python": platform.python_version(), "cpus": os.cpu_count(),
+                       "config": config_of(args), "results": results}, f, indent=2)
+            f.write("\n")
+        print(f"\nSaved baseline {os.path.relpath(baseline_path(args.save_baseline))}")
+    if baseline is not None:
+        if baseline.get("config") != config_of(args):
+            print(f"\nNote: baseline '{args.compare}' was recorded with different options: {baseline.get('config')}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import sys                      # Provides access to some variables used or maintained by the interpreter.
 import socket                   # Provides a low-level network interface for communication between processes.
 import threading                # Allows the program to run multiple threads concurrently.
+import time                     # Spaces out reconnection attempts.
 import json                     # Enables encoding and decoding of JSON data for message exchange.
+from collections import deque   # Holds received text until the display is next updated.
 from PyQt5.QtWidgets import (   # Importing various PyQt5 widgets for GUI creation.
     QApplication,              # Manages the GUI application's control flow and main settings.
     QWidget,                   # Base class for all user interface objects.
@@ -14,40 +16,18 @@ from PyQt5.QtWidgets import (   # Importing various PyQt5 widgets for GUI creati
     QMessageBox,               # Displays modal dialog boxes for messages or errors.
     QInputDialog               # Provides dialog boxes to prompt user input.
 )
-from PyQt5.QtCore import pyqtSignal, QObject   # Importing core components; pyqtSignal is used for custom signals and QObject is the base class of all Qt objects.
+from PyQt5.QtCore import QTimer   # Periodically draws the text received since the last update.
+from PyQt5.QtGui import QTextCursor  # Appends a whole batch of lines to the chat display in one edit.
 
-# Load the message protocol from a JSON file.
-# This file defines the structure and required fields for each message type used in the game.
-with open("message_protocol.json", "r") as f:
-    MESSAGE_TYPES = json.load(f)
+from protocol import create_message, decode_frame, InvalidMessage, WIRE_JSON, WIRE_BINARY  # Shared message helpers.
+from framing import FrameReader  # Shared incremental frame parser (same as the server's).
 
-def create_message(message_type, **kwargs):
-    """
-    Creates a JSON message for the specified message type.
-    It uses the MESSAGE_TYPES to know the expected fields, fills them
-    using keyword arguments, converts the dictionary to a JSON string,
-    and appends a newline as a delimiter for framing.
-    """
-    message = {"type": message_type}  # Initialize message with its type.
-    # Populate each expected field with the provided keyword values.
-    for field in MESSAGE_TYPES[message_type]["fields"]:
-        message[field] = kwargs.get(field)
-    # Convert the message dict to a JSON string, add a newline, and encode to bytes.
-    return (json.dumps(message) + "\n").encode()
-
-def parse_message(data):
-    """
-    Decodes a received bytes object to a JSON object.
-    Returns the parsed JSON, or None if decoding fails.
-    """
-    try:
-        return json.loads(data.decode())
-    except Exception:
-        return None
-
-class Communicator(QObject):
-    # Define a custom signal to handle incoming messages (as strings) from the server.
-    message_received = pyqtSignal(str)
+PREFERRED_WIRE_FORMAT = WIRE_BINARY  # Wire format requested from the server with HELLO when connecting.
+NEGOTIATION_TIMEOUT = 3              # Seconds to wait for the server's HELLO reply before staying on JSON.
+DISPLAY_INTERVAL_MS = 50             # The chat display is updated at most this often (20 times a second).
+MAX_SCROLLBACK_LINES = 2000          # Older lines are dropped from the chat display beyond this many.
+RECONNECT_ATTEMPTS = 10              # Tries to get back into the game after the connection drops...
+RECONNECT_DELAY = 1                  # ...this many seconds apart (the server holds the seat for longer).
 
 class GameClient(QWidget):
     def __init__(self):
@@ -83,12 +63,27 @@ class GameClient(QWidget):
         self.setWindowTitle("Blend In")  # Set the window title.
 
         self.sock = None  # This will hold the client's socket connection.
-        self.comm = Communicator()  # Create a Communicator object for handling signals.
-        self.comm.message_received.connect(self.display_message)  # Connect the signal to the display_message method.
+        self.server_address = None  # (IP, port) of the server, used again to reconnect.
+        self.player_name = None
+        self.session_id = None
+        self.resume_token = None  # Sent by the server with LOBBY_JOINED; RESUME with it keeps our seat.
+        self.roster = []  # Players of our lobby or game, kept up to date from ROSTER and ROSTER_UPDATE messages.
+        self.roster_version = None  # Version of 'roster'; None until the server sent the whole list.
+        self.wire_format = WIRE_JSON  # Encoding agreed with the server (see negotiate_wire_format).
+        self.reader = FrameReader()  # Received bytes, split into complete frames as they arrive.
+        # Text waiting to be drawn. The receiving thread and the GUI both add to it and the display timer
+        # empties it; a burst longer than the scrollback only keeps the lines that would still be shown.
+        self.pending_lines = deque(maxlen=MAX_SCROLLBACK_LINES)
 
         # Set up the main chat display area and input field.
         self.chat_display = QTextEdit()
         self.chat_display.setReadOnly(True)  # Users cannot edit this area; it's for displaying messages.
+        self.chat_display.document().setMaximumBlockCount(MAX_SCROLLBACK_LINES)  # Bounded memory and layout cost.
+
+        # Draw whatever arrived since the last tick in one go, instead of re-laying out the chat per message.
+        self.display_timer = QTimer(self)
+        self.display_timer.timeout.connect(self.flush_display)
+        self.display_timer.start(DISPLAY_INTERVAL_MS)
 
         self.input_line = QLineEdit()
         self.input_line.returnPressed.connect(self.send_input)  # Send input when the user presses Enter.
@@ -124,7 +119,7 @@ class GameClient(QWidget):
 
     def init_connection(self):
         """
-        Asks the user to enter the server IP address and their name, then initializes a socket connection.
+        Asks the user to enter the server IP address, their name and the game to join, then initializes a socket connection.
         Sends a JOIN_ROOM message to register the client on the server and starts a thread to handle incoming messages.
         """
         ip_address, ok = QInputDialog.getText(self, "Connect to Server", "Enter server IP:")
@@ -132,10 +127,9 @@ class GameClient(QWidget):
             QMessageBox.critical(self, "Connection Error", "No IP provided.")
             sys.exit(1)
         
-        # Create a TCP socket.
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Connect to the server using the provided IP and fixed port 5555.
-        self.sock.connect((ip_address, 5555))
+        self.server_address = (ip_address, 5555)
+        self.open_socket()
 
         # Ask for the player's name.
         name, ok = QInputDialog.getText(self, "Enter Name", "Your name:")
@@ -143,56 +137,200 @@ class GameClient(QWidget):
             QMessageBox.critical(self, "Name Error", "No name provided.")
             sys.exit(1)
 
-        # Send a JOIN_ROOM message with the player's name to the server.
-        self.sock.send(create_message("JOIN_ROOM", player_name=name))
+        # Ask which game to join; leaving it blank joins the server's default game.
+        session_id, ok = QInputDialog.getText(self, "Choose Game", "Game ID (leave blank for the default game):")
+        if not ok:
+            sys.exit(1)
+
+        # Agree on the wire format, then send a JOIN_ROOM message with the player's name and chosen game.
+        self.player_name = name
+        self.session_id = session_id.strip() or None
+        self.negotiate_wire_format()
+        self.send_message("JOIN_ROOM", player_name=name, session_id=self.session_id)
         # Start a background thread to listen for server messages.
         threading.Thread(target=self.handle_server_messages, daemon=True).start()
 
+    def open_socket(self):
+        """
+        Creates a TCP socket connected to the server, starting over with an empty frame reader and JSON.
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect(self.server_address)
+        self.reader = FrameReader()
+        self.wire_format = WIRE_JSON
+
+    def reconnect(self):
+        """
+        Called on the receiving thread when the connection drops: connects again and sends RESUME with
+        our token, so we keep our seat in the game and only receive what changed while we were away.
+        Returns True once the new connection is up, False if there is nothing to resume or no server.
+        """
+        if not self.resume_token:
+            return False
+        self.display_message("[Connection lost, reconnecting...]")
+        for _ in range(RECONNECT_ATTEMPTS):
+            time.sleep(RECONNECT_DELAY)
+            try:
+                self.open_socket()
+                self.negotiate_wire_format()
+                self.sock.sendall(create_message("RESUME", token=self.resume_token,
+                                                 session_id=self.session_id).encode(self.wire_format))
+                return True
+            except OSError:
+                continue
+        return False
+
+    def negotiate_wire_format(self):
+        """
+        Asks the server for the preferred wire format with a HELLO message and waits for its answer.
+        Servers that do not know HELLO answer with something else, in which case the client stays on JSON.
+        """
+        if PREFERRED_WIRE_FORMAT == WIRE_JSON:
+            return
+        self.send_message("HELLO", encoding=PREFERRED_WIRE_FORMAT)
+        self.sock.settimeout(NEGOTIATION_TIMEOUT)
+        try:
+            while True:
+                frame = self.reader.next_frame(WIRE_JSON)
+                if frame is not None:
+                    try:
+                        reply = decode_frame(frame, WIRE_JSON)
+                    except InvalidMessage:
+                        reply = None
+                    if reply and reply.get("type") == "HELLO":
+                        # Only the HELLO reply is consumed; anything after it is already in the new format.
+                        self.wire_format = reply.get("encoding") or WIRE_JSON
+                    return
+                if not self.reader.recv_into(self.sock):
+                    return
+        except socket.timeout:
+            pass
+        finally:
+            self.sock.settimeout(None)
+
+    def send_message(self, message_type, **fields):
+        """
+        Encodes a message in the negotiated wire format and sends it to the server.
+        """
+        try:
+            self.sock.sendall(create_message(message_type, **fields).encode(self.wire_format))
+        except OSError:
+            self.display_message("[Not connected to the server]")
+
     def handle_server_messages(self):
         """
         Continuously listens for messages from the server.
-        Processes data by splitting it on newline delimiters (as defined by our message framing), 
-        decodes the JSON messages, and acts on the message type accordingly.
+        Received data is split into frames by the FrameReader (newline-delimited JSON, or length-prefixed
+        binary frames once negotiated), then each message is decoded and acted on according to its type.
         """
-        buffer = ""
         while True:
             try:
-                data = self.sock.recv(1024)  # Receive data from the server.
-                if not data:
-                    self.comm.message_received.emit("[Disconnected from server]")
-                    break
-                buffer += data.decode()  # Append received data to the buffer.
+                # Process each complete message received so far.
+                while True:
+                    frame = self.reader.next_frame(self.wire_format)
+                    if frame is None:
+                        break
+                    try:
+                        msg = decode_frame(frame, self.wire_format)  # Convert the frame to a message.
+                    except InvalidMessage:
+                        continue  # Skip message types this client does not know about.
+                    if not msg:
+                        continue
+                    msg_type = msg.get("type")  # Determine the type of message.
+                    # Answer the server's heartbeat so it knows this connection is still alive.
+                    if msg_type == "PING":
+                        self.send_message("PONG")
+                        continue
+                    # Keep the resume token from LOBBY_JOINED (the welcome text is displayed below).
+                    if msg_type == "LOBBY_JOINED" and msg.get("token"):
+                        self.resume_token = msg.get("token")
+                    # Process ASSIGN_ROLE messages to update the player's role.
+                    if msg_type == "ASSIGN_ROLE":
+                        role = msg.get("role")
+                        topic = msg.get("topic")
+                        if role == "impostor":
+                            self.display_message("You are the impostor!")
+                        elif role == "crewmate":
+                            self.display_message(f"You are a crewmate. Topic: {topic}")
+                    # Process ROSTER messages: the whole player list, on joining or when ours fell behind.
+                    elif msg_type == "ROSTER":
+                        self.roster = list(msg.get("players") or [])
+                        self.roster_version = msg.get("version")
+                        self.display_message(f"Players here: {', '.join(self.roster)}")
+                    # Process ROSTER_UPDATE messages: players who joined or left since the previous version.
+                    elif msg_type == "ROSTER_UPDATE":
+                        self.update_roster(msg)
+                    # Process GAME_STARTED messages: the game's players are the ones in our roster.
+                    elif msg_type == "GAME_STARTED":
+                        if msg.get("version") != self.roster_version:
+                            self.send_message("ROSTER_SYNC")  # Our copy is out of date; the server resends it.
+                        self.display_message(f"The game has started with: {', '.join(self.roster)}")
+                    # Process VOTE_RESULT messages to display elimination details.
+                    elif msg_type == "VOTE_RESULT":
+                        voted_out = msg.get("voted_out")
+                        self.display_message(f"{voted_out} has been eliminated.")
+                        if voted_out == self.player_name:
+                            self.resume_token = None  # The server closes our connection; there is no seat to go back to.
+                    # Process JOIN_LOBBY messages to notify the client.
+                    elif msg_type == "JOIN_LOBBY":
+                        self.display_message("You have been moved back to the lobby.")
+                    # Process RESUMED messages: we are back in our seat after a dropped connection.
+                    elif msg_type == "RESUMED":
+                        self.roster = list(msg.get("players") or [])
+                        self.roster_version = msg.get("version")
+                        where = "the lobby" if msg.get("room_id") in (None, "lobby") else f"room {msg.get('room_id')}"
+                        self.display_message(f"[Reconnected as {msg.get('player_name')}: {msg.get('phase')} phase, in {where}; "
+                                             f"{msg.get('missed') or 0} missed messages follow]")
+                        if msg.get("role") == "impostor":
+                            self.display_message("You are the impostor!")
+                        elif msg.get("role") == "crewmate":
+                            self.display_message(f"You are a crewmate. Topic: {msg.get('topic')}")
+                    # Process HISTORY messages: the recent chat of the room or lobby just joined.
+                    elif msg_type == "HISTORY":
+                        where = "the lobby" if msg.get("room_id") == "lobby" else f"room {msg.get('room_id')}"
+                        self.display_message(f"--- Recent messages in {where} ---")
+                        for line in msg.get("messages") or []:
+                            self.display_message(line)
+                    # For other message types, display the 'message' field or entire message.
+                    else:
+                        display_text = msg.get("message") or json.dumps(msg)
+                        self.display_message(display_text)
 
-                # Process each complete JSON message in the buffer.
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    if line.strip():
-                        msg = parse_message(line.encode())  # Convert message from JSON.
-                        if msg:
-                            msg_type = msg.get("type")  # Determine the type of message.
-                            # Process ASSIGN_ROLE messages to update the player's role.
-                            if msg_type == "ASSIGN_ROLE":
-                                role = msg.get("role")
-                                topic = msg.get("topic")
-                                if role == "impostor":
-                                    self.comm.message_received.emit("You are the impostor!")
-                                elif role == "crewmate":
-                                    self.comm.message_received.emit(f"You are a crewmate. Topic: {topic}")
-                            # Process VOTE_RESULT messages to display elimination details.
-                            elif msg_type == "VOTE_RESULT":
-                                voted_out = msg.get("voted_out")
-                                self.comm.message_received.emit(f"{voted_out} has been eliminated.")
-                            # Process JOIN_LOBBY messages to notify the client.
-                            elif msg_type == "JOIN_LOBBY":
-                                self.comm.message_received.emit("You have been moved back to the lobby.")
-                            # For other message types, display the 'message' field or entire message.
-                            else:
-                                display_text = msg.get("message") or json.dumps(msg)
-                                self.comm.message_received.emit(display_text)
+                # Receive the next chunk from the server straight into the reader's buffer.
+                if not self.reader.recv_into(self.sock):
+                    raise ConnectionResetError("closed by the server")
+            except OSError:
+                # The connection dropped: get our seat back on a new one if we can.
+                if self.reconnect():
+                    continue
+                self.display_message("[Disconnected from server]")
+                break
             except Exception as e:
-                self.comm.message_received.emit(f"[Error receiving message: {e}]")
+                self.display_message(f"[Error receiving message: {e}]")
                 break
 
+    def update_roster(self, msg):
+        """
+        Applies a ROSTER_UPDATE to our copy of the player list and shows who joined or left.
+        An update that does not follow our version (we missed one, or have no list yet) asks
+        the server for the whole list instead.
+        """
+        added = msg.get("added") or []
+        removed = msg.get("removed") or []
+        for name in added:
+            self.display_message(f"{name} joined.")
+        for name in removed:
+            self.display_message(f"{name} left.")
+        version = msg.get("version")
+        if self.roster_version is not None and version <= self.roster_version:
+            return  # Already part of our copy.
+        if self.roster_version is None or version != self.roster_version + 1:
+            self.send_message("ROSTER_SYNC")
+            return
+        gone = set(removed)
+        self.roster = [name for name in self.roster if name not in gone] + [name for name in added if name not in self.roster]
+        self.roster_version = version
+
     def send_input(self):
         """
         Reads the text input from the QLineEdit, determines the command type (chat, join, vote, etc.),
@@ -204,23 +342,27 @@ class GameClient(QWidget):
 
         # Command for sending chat messages.
         if text.startswith("chat "):
-            self.sock.send(create_message("CHAT", message=text[5:], room_id="current"))
+            self.send_message("CHAT", message=text[5:], room_id="current")
+        # Command for joining any open room (the server picks one).
+        elif text in ("join", "join any"):
+            self.send_message("JOIN")
         # Command for joining a specific room.
         elif text.startswith("join "):
             value = text.split(" ", 1)[1]
             if value.isdigit():
-                self.sock.send(create_message("JOIN", room_id=int(value)))
+                self.send_message("JOIN", room_id=int(value))
             else:
                 self.display_message("Invalid room number. Use: join <room_number>")
         # Command for voting.
         elif text.startswith("vote "):
             target = text.split(" ", 1)[1]
-            self.sock.send(create_message("VOTE", target=target))
+            self.send_message("VOTE", target=target)
         # Ping command for checking connectivity.
         elif text == "ping":
-            self.sock.send(create_message("PING"))
+            self.send_message("PING")
         # Exit command to disconnect and close the application.
         elif text == "exit":
+            self.resume_token = None  # Leaving on purpose: do not reconnect.
             self.sock.close()
             self.close()
         else:
@@ -234,7 +376,7 @@ class GameClient(QWidget):
         Sends a predefined command to the server. Currently supports marking the client as READY.
         """
         if cmd == "READY":
-            self.sock.send(create_message("READY"))
+            self.send_message("READY")
             self.display_message("You are now marked as ready.")
 
     def show_help(self):
@@ -245,6 +387,7 @@ class GameClient(QWidget):
             "Available commands:\n"
             "  chat <message>     - Send a chat message to your room\n"
             "  join <room_num>    - Join a specific room\n"
+            "  join               - Join any open room\n"
             "  vote <player_name> - Vote for a player\n"
             "  ready              - Mark yourself as ready\n"
             "  ping               - Ping the server\n"
@@ -254,9 +397,34 @@ class GameClient(QWidget):
 
     def display_message(self, text):
         """
-        Appends a new message or status update to the chat display area.
+        Queues a message or status update for the chat display. Safe to call from any thread;
+        the text shows up on the next display_timer tick.
         """
-        self.chat_display.append(text)
+        self.pending_lines.append(text)
+
+    def flush_display(self):
+        """
+        Runs on the GUI thread every DISPLAY_INTERVAL_MS: appends all queued lines to the chat display
+        as a single edit, so a burst of messages costs one layout pass. Keeps the view scrolled to the
+        bottom unless the user scrolled up to read older messages.
+        """
+        if not self.pending_lines:
+            return
+        lines = []
+        while self.pending_lines:
+            lines.append(self.pending_lines.popleft())
+        scrollbar = self.chat_display.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum()
+        document = self.chat_display.document()
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        if not document.isEmpty():
+            cursor.insertBlock()  # Start after the last line, like QTextEdit.append.
+        cursor.insertText("\n".join(lines))  # Every line becomes its own paragraph, shown as plain text.
+        cursor.endEditBlock()
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
 
 # ------------------------------ Main Application Entry Point ------------------------------ #
 if __name__ == "__main__":
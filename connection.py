@@ -0,0 +1,488 @@
+import asyncio         # Used by the asyncio writer to wait for a writable socket.
+import collections     # Provides deque, used for the bounded outbound frame queues.
+import os              # Used to look up how many buffers one vectored send may carry.
+import socket          # Provides shutdown constants for tearing down a connection.
+import threading       # Enables the per-connection writer threads and queue locking.
+import time            # Provides time-related functions (e.g., sleep between send retries).
+
+import metrics
+from protocol import Message, WIRE_JSON
+
+# ------------------------- Outbound Queue Settings ------------------------- #
+# Every connection owns a bounded queue of encoded frames drained by its own writer,
+# so a broadcast only appends to queues and never waits on a slow peer's network.
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect", "coalesce")
+MAX_QUEUED_FRAMES = 1024             # Frames a connection may have waiting before the policy kicks in.
+MAX_COALESCED_BYTES = 1024 * 1024    # Upper bound on buffered bytes under the 'coalesce' policy.
+slow_consumer_policy = "drop_oldest" # What to do when a queue is full (one of SLOW_CONSUMER_POLICIES).
+
+def configure_outbound(max_frames=None, policy=None):
+    """
+    Changes the outbound queue size and the slow consumer policy for connections created afterwards:
+      drop_oldest - discard the oldest queued frame to make room for the new one
+      disconnect  - drop the connection of a peer that cannot keep up
+      coalesce    - merge everything queued into one buffer (bounded by MAX_COALESCED_BYTES,
+                    beyond which the peer is disconnected)
+    """
+    global MAX_QUEUED_FRAMES, slow_consumer_policy
+    if max_frames is not None:
+        MAX_QUEUED_FRAMES = max(1, max_frames)
+    if policy is not None:
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"unknown slow consumer policy: {policy}")
+        slow_consumer_policy = policy
+
+# ------------------------- Write Coalescing ------------------------- #
+# A phase transition queues several frames for each player back to back (roles, the player list,
+# instructions). Deliveries cork their recipients so that the whole burst is queued before any writer
+# wakes up, and each connection's writer waits until COALESCE_WINDOW has passed since its previous
+# write, so frames arriving in a burst share one sendmsg() and usually one packet. A connection that
+# has been quiet for longer than the window (the usual case for chat) is written at once, so the
+# window only delays connections that are already receiving a burst.
+
+COALESCE_WINDOW = 0.002    # Seconds a writer waits after its previous write before writing again (0 turns it off).
+CORK_DELIVERIES = True     # Cork the recipients of a multi-message delivery until all of it is queued.
+TCP_NODELAY = True         # Disable Nagle's algorithm: the writers already batch, so the kernel need not wait.
+
+def configure_writes(window=None, cork=None, nodelay=None):
+    """
+    Changes the write coalescing settings for connections created (and deliveries made) afterwards.
+    """
+    global COALESCE_WINDOW, CORK_DELIVERIES, TCP_NODELAY
+    if window is not None:
+        COALESCE_WINDOW = max(0.0, window)
+    if cork is not None:
+        CORK_DELIVERIES = cork
+    if nodelay is not None:
+        TCP_NODELAY = nodelay
+
+def cork_all(connections):
+    """
+    Corks every connection in 'connections' (see Connection.cork) if CORK_DELIVERIES is on.
+    Returns the corked connections, for uncork_all().
+    """
+    if not CORK_DELIVERIES:
+        return ()
+    corked = [conn for conn in connections if isinstance(conn, Connection)]  # Held seats need no corking.
+    for conn in corked:
+        conn.cork()
+    return corked
+
+def uncork_all(corked):
+    for conn in corked:
+        conn.uncork()
+
+# ------------------------- Vectored Sends ------------------------- #
+# Writers hand the kernel the list of queued frames with one sendmsg() call (writev), so frames
+# shared by many connections are never copied into a per-connection buffer first.
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")  # Most buffers a single sendmsg() accepts.
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+if IOV_MAX <= 0:
+    IOV_MAX = 1024
+
+def send_frames(sock, views):
+    """
+    Sends one sendmsg() worth of the memoryviews in 'views' and removes what was written from the
+    front of the list (a partly written frame is replaced by its unsent tail).
+    Returns the number of bytes sent.
+    """
+    sent = sock.sendmsg(views[:IOV_MAX])
+    metrics.count(metrics.SOCKET_WRITES)
+    remaining = sent
+    done = 0
+    while done < len(views) and remaining >= len(views[done]):
+        remaining -= len(views[done])
+        done += 1
+    del views[:done]
+    if remaining:
+        views[0] = views[0][remaining:]
+    metrics.count(metrics.BYTES_SENT, None, sent)
+    return sent
+
+def send_with_retry(client, frames, retries=3):
+    """
+    Sends a list of frames to the provided blocking client socket (used by the threaded writers).
+    If a send fails, it retries up to 'retries' times with a small delay in between, resuming after
+    the bytes that already went out so nothing is sent twice.
+    Returns True on a successful send and False if all retries fail.
+    """
+    views = [memoryview(frame) for frame in frames]
+    failures = 0
+    while views:
+        try:
+            send_frames(client, views)
+        except Exception:
+            failures += 1
+            # If not the last attempt, wait briefly before retrying.
+            if failures >= retries:
+                metrics.count(metrics.SEND_FAILURES)
+                return False
+            metrics.count(metrics.SEND_RETRIES)
+            time.sleep(0.1)
+    return True
+
+def fan_out(message, recipients, exclude=None):
+    """
+    Queues one message for every connection in 'recipients' except 'exclude'.
+    The Message is encoded once per wire format and every queue holds a reference to that same
+    frame, so the cost per recipient does not depend on the size of the message.
+    Returns the connections that could not take the message (closed or dropped as slow consumers).
+    """
+    failed = []
+    for conn in recipients:
+        if conn is not exclude and not conn.send(message):
+            failed.append(conn)
+    return failed
+
+class Connection:
+    """
+    A client connection with a bounded outbound queue.
+    send() only queues the frame and returns immediately; a writer owned by the subclass
+    (a thread or an event loop task) drains the queue to the socket.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.frames = collections.deque()  # Encoded frames waiting to be written.
+        self.queued_bytes = 0
+        self.dropped_frames = 0            # Frames discarded by the drop_oldest policy.
+        self.max_frames = MAX_QUEUED_FRAMES
+        self.policy = slow_consumer_policy
+        self.lock = threading.Condition()  # Guards the queue; the threaded writer also waits on it.
+        self.closed = False                # No more frames are accepted once set.
+        self.wire_format = WIRE_JSON       # Encoding used on this connection (negotiated with HELLO).
+        self.last_seen = time.monotonic()  # When data last arrived from the client (see heartbeat.py).
+        self.pinged_at = 0.0               # When the heartbeat last sent this client a PING.
+        self.buckets = {}                  # Message type -> flood.TokenBucket (guarded by the lock).
+        self.corked = 0                    # Deliveries in progress holding the writer back (see cork()).
+        self.coalesce_window = COALESCE_WINDOW
+        self.last_write = 0.0              # When the writer last wrote (monotonic), for the coalescing window.
+        if TCP_NODELAY:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError:
+                pass  # Not a TCP socket.
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, message):
+        """
+        Queues a Message (encoded in this connection's wire format) or an already encoded frame
+        for this client. Returns False if the connection is closed or was dropped because the
+        client could not keep up.
+        """
+        frame = message.encode(self.wire_format) if isinstance(message, Message) else message
+        wake = False
+        with self.lock:
+            if self.closed:
+                return False
+            if len(self.frames) >= self.max_frames and not self._make_room(frame):
+                overflowed = True
+            else:
+                overflowed = False
+                self.frames.append(frame)
+                self.queued_bytes += len(frame)
+                wake = not self.corked and self._frames_queued()
+        if overflowed:
+            print(f"[SLOW CONSUMER] Disconnecting {self.describe()} ({self.queued_bytes} bytes queued).")
+            self.abort()
+            return False
+        metrics.count(metrics.MESSAGES_SENT, message.type if isinstance(message, Message) else "raw")
+        if wake:
+            self._wake_writer()
+        return True
+
+    def _make_room(self, frame):
+        """
+        Applies the slow consumer policy to a full queue (called with the lock held).
+        Returns False if the connection must be dropped instead.
+        """
+        if self.policy == "drop_oldest":
+            self.queued_bytes -= len(self.frames.popleft())
+            self.dropped_frames += 1
+            return True
+        if self.policy == "coalesce" and self.queued_bytes + len(frame) <= MAX_COALESCED_BYTES:
+            merged = b"".join(self.frames)
+            self.frames.clear()
+            self.frames.append(merged)
+            return True
+        return False
+
+    def cork(self):
+        """
+        Holds the writer back while a delivery queues several frames for this client; they are
+        written together after the matching uncork(). Corks nest.
+        """
+        with self.lock:
+            self.corked += 1
+
+    def uncork(self):
+        with self.lock:
+            self.corked -= 1
+            wake = not self.corked and bool(self.frames) and not self.closed and self._frames_queued()
+        if wake:
+            self._wake_writer()
+
+    def take_frames(self):
+        """
+        Removes and returns everything queued so far (called by the writer); nothing while corked,
+        unless the connection is closing.
+        """
+        with self.lock:
+            if self.corked and not self.closed:
+                return []
+            frames = list(self.frames)
+            self.frames.clear()
+            self.queued_bytes = 0
+        if frames:
+            metrics.observe(metrics.FRAMES_PER_WRITE, None, len(frames))
+        return frames
+
+    def write_delay(self):
+        """
+        Seconds the writer should still wait for more frames before writing (0 if the connection
+        has been quiet for the whole coalescing window).
+        """
+        return self.last_write + self.coalesce_window - time.monotonic()
+
+    def describe(self):
+        try:
+            return str(self.sock.getpeername())
+        except OSError:
+            return "closed connection"
+
+    def _frames_queued(self):
+        """
+        Hook called with the lock held after a frame was queued. Returns True if _wake_writer()
+        has to be called once the lock is released.
+        """
+        raise NotImplementedError
+
+    def _wake_writer(self):
+        """
+        Starts the writer after frames were queued (called without the lock held).
+        """
+
+    def close(self):
+        """
+        Stops accepting frames, lets the writer flush what is already queued, then closes the socket.
+        """
+        raise NotImplementedError
+
+    def abort(self):
+        """
+        Closes the connection immediately, discarding anything still queued.
+        """
+        raise NotImplementedError
+
+    def release(self):
+        """
+        Stops the writer and closes this process's copy of the socket without shutting the
+        connection down (used after the connection was handed to another worker).
+        """
+        raise NotImplementedError
+
+class ThreadedConnection(Connection):
+    """
+    Connection drained by a dedicated writer thread doing blocking sends,
+    so only this client's writer ever waits on its TCP window.
+    """
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.shutdown_on_close = True
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def _frames_queued(self):
+        self.lock.notify()
+        return False
+
+    def _write_loop(self):
+        while True:
+            with self.lock:
+                while (not self.frames or self.corked) and not self.closed:
+                    self.lock.wait()
+                if not self.frames:
+                    break  # Closed and fully flushed.
+                delay = self.write_delay()
+                while delay > 0 and not self.closed:
+                    self.lock.wait(delay)  # Frames of the same burst join this write meanwhile.
+                    delay = self.write_delay()
+            frames = self.take_frames()
+            if not frames:
+                continue  # Corked again meanwhile.
+            if not send_with_retry(self.sock, frames):
+                with self.lock:
+                    self.closed = True
+                break
+            self.last_write = time.monotonic()
+        self._close_socket()
+
+    def _close_socket(self):
+        try:
+            if self.shutdown_on_close:
+                # Wakes up the reader thread blocked in recv() as well.
+                self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify()
+
+    def abort(self):
+        with self.lock:
+            self.closed = True
+            self.frames.clear()
+            self.queued_bytes = 0
+            self.lock.notify()
+        try:
+            # Unblocks a writer stuck in sendall() on a peer that stopped reading.
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def release(self):
+        with self.lock:
+            self.shutdown_on_close = False
+            self.closed = True
+            self.lock.notify()
+
+class AsyncConnection(Connection):
+    """
+    Connection on a non-blocking socket owned by an asyncio event loop.
+    The writer is a loop task started when frames arrive and draining them with non-blocking
+    sendmsg() calls, waiting for the socket to become writable whenever the kernel buffer is full;
+    frames queued from other threads (e.g. the scheduler thread running phase timers) wake it via
+    call_soon_threadsafe, after the queue lock is released.
+    Closing only shuts the socket down: the descriptor itself is closed once both the reader
+    coroutine and the flush task are done with it, so neither is left waiting on a dead descriptor.
+    """
+    def __init__(self, sock, loop):
+        super().__init__(sock)
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.flushing = False       # True while a flush task is draining the queue.
+        self.flush_task = None      # The flush task; the loop itself only keeps a weak reference to it.
+        self.reading = True         # True until the reader coroutine calls reader_finished().
+        self.shutdown_on_close = True
+
+    def _frames_queued(self):
+        if self.flushing:
+            return False
+        self.flushing = True
+        return True
+
+    def _wake_writer(self):
+        if threading.get_ident() == self.loop_thread:
+            self._start_flush()
+        else:
+            self.loop.call_soon_threadsafe(self._start_flush)
+
+    def _start_flush(self):
+        # Runs on the loop. 'flushing' was set when the frames were queued, so no other flush task
+        # is draining the queue; one that is still finishing restarts the flush itself.
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = self.loop.create_task(self._flush())
+            self.flush_task.add_done_callback(self._flush_done)
+
+    def _flush_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[ERROR] Flush failed: {task.exception()!r}")
+
+    async def _flush(self):
+        try:
+            while True:
+                delay = self.write_delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)  # Frames of the same burst join this write meanwhile.
+                frames = self.take_frames()
+                if not frames:
+                    break
+                await self._send_all(frames)
+                self.last_write = time.monotonic()
+        except OSError:
+            with self.lock:
+                self.closed = True
+        finally:
+            with self.lock:
+                self.flushing = False
+                # Frames may have arrived after the last take_frames().
+                restart = bool(self.frames) and not self.closed and not self.corked and self._frames_queued()
+                finished = self.closed
+            if restart:
+                self.loop.call_soon(self._start_flush)  # Runs once this task is done.
+            if finished:
+                self._shutdown()
+                self._close_if_unused()
+
+    async def _send_all(self, frames):
+        views = [memoryview(frame) for frame in frames]
+        while views:
+            try:
+                send_frames(self.sock, views)
+            except (BlockingIOError, InterruptedError):
+                await self._writable()
+            # Other connections' flush tasks get a turn between chunks.
+            await asyncio.sleep(0)
+
+    async def _writable(self):
+        """
+        Waits until the socket can take more data (or has failed, which the next send reports).
+        """
+        ready = self.loop.create_future()
+        fd = self.sock.fileno()
+        self.loop.add_writer(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            self.loop.remove_writer(fd)
+
+    def _shutdown(self):
+        # Wakes both the reader and a flush task blocked on the socket.
+        if self.shutdown_on_close:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _close_if_unused(self):
+        with self.lock:
+            unused = not self.reading and not self.flushing
+        if unused and self.sock.fileno() != -1:
+            self.sock.close()
+
+    def reader_finished(self):
+        """
+        Called by the reader coroutine when it stops reading; closes the descriptor if the writer is idle.
+        """
+        with self.lock:
+            self.reading = False
+            self.closed = True
+        self._close_if_unused()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            # A running flush task shuts the socket down once it has written what was queued.
+            idle = not self.flushing
+        if idle:
+            self._shutdown()
+
+    def abort(self):
+        with self.lock:
+            self.closed = True
+            self.frames.clear()
+            self.queued_bytes = 0
+        self._shutdown()
+
+    def release(self):
+        with self.lock:
+            self.shutdown_on_close = False
+            self.closed = True
@@ -0,0 +1,158 @@
+import time            # Refills the token buckets and times the merged chat delivery.
+
+import metrics
+from protocol import create_message
+from scheduler import scheduler
+
+# ------------------------- Flood Control Settings ------------------------- #
+# Every connection gets one token bucket per message type: a message takes a token, and tokens come
+# back at 'rate' per second up to 'burst'. A client typing normally never runs out, while a client
+# spamming CHAT cannot make the server fan out more than 'rate' lines per second on its behalf, so
+# the cost of a broadcast to everyone else stays bounded however fast one client sends.
+
+FLOOD_POLICIES = ("drop", "merge")
+# Message type -> (tokens per second, burst size); a rate of 0 means unlimited.
+RATE_LIMITS = {
+    "CHAT": (5.0, 10),
+    "JOIN": (2.0, 5),
+    "READY": (2.0, 5),
+    "VOTE": (2.0, 5),
+    "PING": (5.0, 10),
+}
+DEFAULT_LIMIT = (20.0, 40)   # Every type not listed in RATE_LIMITS.
+flood_policy = "drop"        # What happens to CHAT lines over the limit (other types are always dropped).
+MAX_MERGED_LINES = 20        # Lines one merged CHAT may carry; later ones are dropped.
+MAX_MERGED_CHARS = 2000      # Same, in characters.
+
+def configure_limits(limits=None, policy=None):
+    """
+    Changes the limits for connections created afterwards. 'limits' maps a message type
+    (or '*' for DEFAULT_LIMIT) to (rate, burst). The policy for CHAT lines over the limit is:
+      drop  - discard them
+      merge - hold them and send them as one CHAT line as soon as the sender has a token again
+    """
+    global DEFAULT_LIMIT, flood_policy
+    for message_type, limit in (limits or {}).items():
+        if message_type == "*":
+            DEFAULT_LIMIT = limit
+        else:
+            RATE_LIMITS[message_type] = limit
+    if policy is not None:
+        if policy not in FLOOD_POLICIES:
+            raise ValueError(f"unknown flood policy: {policy}")
+        flood_policy = policy
+
+def parse_limit(text):
+    """
+    Parses a TYPE=RATE[/BURST] option (the burst defaults to twice the rate) into (type, (rate, burst)).
+    """
+    message_type, _, value = text.partition("=")
+    rate, _, burst = value.partition("/")
+    try:
+        rate = float(rate)
+        burst = int(burst) if burst else max(1, int(rate * 2))
+    except ValueError:
+        raise ValueError(f"expected TYPE=RATE[/BURST], got {text!r}")
+    if not message_type or rate < 0 or burst < 1:
+        raise ValueError(f"expected TYPE=RATE[/BURST], got {text!r}")
+    return message_type.upper() if message_type != "*" else "*", (rate, burst)
+
+class TokenBucket:
+    """
+    Holds up to 'burst' tokens, refilled continuously at 'rate' tokens per second.
+    """
+    __slots__ = ("rate", "burst", "tokens", "updated", "warned", "held", "held_chars")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.warned = False     # The sender was told about the limit and has not calmed down since.
+        self.held = None        # CHAT lines waiting to be merged (merge policy), or None.
+        self.held_chars = 0
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= self.burst:
+            self.warned = False
+
+    def take(self, now):
+        """
+        Takes a token if one is available. Returns False if the sender is over the limit.
+        """
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def next_token(self):
+        # Seconds until take() succeeds again.
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+def allow(conn, message, handler):
+    """
+    Charges 'message' to its sender's bucket. Returns True if it may be handled now; otherwise it is
+    dropped or (CHAT under the merge policy) held, and later passed to handler(conn, merged) as one
+    CHAT line. The sender is told once, the first time it hits the limit after being within it.
+    """
+    message_type = message["type"]
+    limit = RATE_LIMITS.get(message_type, DEFAULT_LIMIT)
+    if not limit[0]:
+        return True
+    now = time.monotonic()
+    with conn.lock:
+        bucket = conn.buckets.get(message_type)
+        if bucket is None:
+            bucket = conn.buckets[message_type] = TokenBucket(*limit)
+        if bucket.held is None and bucket.take(now):
+            return True
+        warn = not bucket.warned
+        bucket.warned = True
+        schedule = False
+        if message_type == "CHAT" and flood_policy == "merge":
+            merged = _hold(bucket, message["message"])
+            schedule = merged and len(bucket.held) == 1
+        else:
+            merged = False
+    if merged:
+        metrics.count(metrics.FLOOD_MERGED, message_type)
+    else:
+        metrics.count(metrics.FLOOD_DROPPED, message_type)
+    if schedule:
+        scheduler.call_later(bucket.next_token(), _release_held, conn, bucket, handler)
+    if warn:
+        action = "merged into one" if message_type == "CHAT" and flood_policy == "merge" else "dropped"
+        conn.send(create_message("INFO", message=f"You are sending {message_type} messages too fast; "
+                                                 f"extra ones are {action} (limit {limit[0]:g} per second)."))
+    return False
+
+def _hold(bucket, text):
+    # Keeps a CHAT line for merging (called with conn.lock held). Returns False if it had to be dropped.
+    if bucket.held is None:
+        bucket.held = []
+        bucket.held_chars = 0
+    if len(bucket.held) >= MAX_MERGED_LINES or bucket.held_chars + len(text) > MAX_MERGED_CHARS:
+        return False
+    bucket.held.append(text)
+    bucket.held_chars += len(text)
+    return True
+
+def _release_held(conn, bucket, handler):
+    """
+    Scheduler callback: sends the held CHAT lines as one once a token is back.
+    """
+    with conn.lock:
+        if conn.closed:
+            return
+        if not bucket.take(time.monotonic()):
+            retry = bucket.next_token()
+            lines = None
+        else:
+            lines, bucket.held = bucket.held, None
+    if lines is None:
+        scheduler.call_later(retry, _release_held, conn, bucket, handler)
+        return
+    handler(conn, {"type": "CHAT", "message": " / ".join(lines), "room_id": "current"})
@@ -0,0 +1,115 @@
+from protocol import FRAME_HEADER, MAX_FRAME_SIZE, ProtocolError, WIRE_BINARY
+
+INITIAL_BUFFER_SIZE = 4096   # Starting capacity of a reader's buffer (idle connections stay this small).
+MIN_RECV_SPACE = 4096        # Free space guaranteed before each receive.
+SHRINK_ABOVE = 256 * 1024    # An emptied buffer larger than this is replaced by a small one.
+
+class FrameReader:
+    """
+    Incremental frame parser shared by the server and the client.
+    Received bytes go straight into one bytearray (recv_into), and complete frames are handed
+    out as memoryview slices of it, so draining a burst costs time linear in its size:
+    nothing is re-copied per message and a JSON line is only searched for its newline once.
+    Text is decoded per complete frame, so a multibyte character split across two
+    receives is never decoded in halves.
+
+    Frames returned by next_frame() are only valid until the next receive.
+    """
+    def __init__(self, initial=b""):
+        self.buffer = bytearray(max(INITIAL_BUFFER_SIZE, len(initial) + MIN_RECV_SPACE))
+        self.buffer[:len(initial)] = initial
+        self.start = 0        # Offset of the first byte not handed out as a frame yet.
+        self.end = len(initial)  # Offset just past the last received byte.
+        self.scan = 0         # Offset where the search for the next newline resumes.
+        self.frame_start = 0  # Offset where the most recently returned frame (with its header) begins.
+
+    def next_frame(self, wire_format):
+        """
+        Returns the next complete frame as a memoryview (a JSON line without its newline, or a
+        binary payload without its length prefix), or None if more data has to be received first.
+        """
+        if wire_format == WIRE_BINARY:
+            available = self.end - self.start
+            if available < FRAME_HEADER.size:
+                return None
+            (length,) = FRAME_HEADER.unpack_from(self.buffer, self.start)
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+            if available < FRAME_HEADER.size + length:
+                return None
+            first = self.start + FRAME_HEADER.size
+            return self._take(first, first + length, first + length)
+        newline = self.buffer.find(b"\n", max(self.scan, self.start), self.end)
+        if newline < 0:
+            self.scan = self.end
+            if self.end - self.start > MAX_FRAME_SIZE:
+                raise ProtocolError(f"line longer than {MAX_FRAME_SIZE} bytes")
+            return None
+        return self._take(self.start, newline, newline + 1)
+
+    def _take(self, first, last, next_start):
+        self.frame_start = self.start
+        self.start = self.scan = next_start
+        return memoryview(self.buffer)[first:last]
+
+    def pending(self):
+        """
+        Returns a copy of the bytes from the start of the most recently returned frame onwards
+        (used to hand a connection and its unprocessed input to another worker).
+        """
+        return bytes(self.buffer[self.frame_start:self.end])
+
+    def _reserve(self, needed=MIN_RECV_SPACE):
+        """
+        Makes sure at least 'needed' bytes are free at the end of the buffer.
+        Consumed bytes are dropped by moving the unconsumed tail to the front (at most once per
+        receive); the buffer only grows when a single frame does not fit.
+        """
+        if self.start == self.end:
+            # Everything was consumed: rewind for free instead of copying.
+            self.start = self.end = self.scan = self.frame_start = 0
+            if len(self.buffer) > SHRINK_ABOVE:
+                self.buffer = bytearray(INITIAL_BUFFER_SIZE)
+        if len(self.buffer) - self.end >= needed:
+            return
+        unconsumed = self.end - self.start
+        if self.start >= len(self.buffer) // 2 and len(self.buffer) - unconsumed >= needed:
+            # Compacting only once half the buffer is consumed keeps the copying linear overall.
+            # Same-size slice assignment: safe even while earlier frames still reference the buffer.
+            self.buffer[:unconsumed] = self.buffer[self.start:self.end]
+        else:
+            # Frames handed out earlier may still reference the old buffer, so grow into a new one.
+            grown = bytearray(max(2 * len(self.buffer), unconsumed + needed))
+            grown[:unconsumed] = self.buffer[self.start:self.end]
+            self.buffer = grown
+        self.scan -= self.start
+        self.frame_start = max(0, self.frame_start - self.start)
+        self.start, self.end = 0, unconsumed
+
+    def recv_into(self, sock):
+        """
+        Receives directly into the buffer from a blocking socket. Returns the number of bytes read (0 at EOF).
+        """
+        self._reserve()
+        with memoryview(self.buffer) as view:
+            count = sock.recv_into(view[self.end:])
+        self.end += count
+        return count
+
+    async def sock_recv_into(self, loop, sock):
+        """
+        Asyncio counterpart of recv_into for a non-blocking socket owned by 'loop'.
+        """
+        self._reserve()
+        with memoryview(self.buffer) as view:
+            count = await loop.sock_recv_into(sock, view[self.end:])
+        self.end += count
+        return count
+
+    def feed(self, data):
+        """
+        Appends bytes that were received by other means.
+        """
+        self._reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
@@ -0,0 +1,1363 @@
+import threading       # Provides the locks guarding session and room state.
+import random          # Used for random selections (e.g., choosing the impostor or a chat topic).
+import math            # Used to perform mathematical operations (e.g., calculating the number of rooms).
+import secrets         # Generates the resume tokens.
+import time            # Measures broadcast fan-out and phase durations for the metrics.
+from collections import deque  # Fixed-size chat history of each room.
+
+import analytics
+import journal
+import metrics
+from protocol import create_message
+from connection import fan_out, cork_all, uncork_all
+from scheduler import scheduler
+
+DEFAULT_SESSION_ID = "default"  # Session used by clients that do not ask for a specific game.
+DISCUSSION_TIME = 30            # Discussion time in seconds for each chat room phase.
+VOTING_DURATION = 20            # Voting phase duration in seconds.
+ROUND_BREAK = 2                 # Pause in seconds between a round's result and the next round.
+HISTORY_SIZE = 50               # Recent chat lines each room and the lobby replay to players who join them.
+ROOM_CAPACITY = 2               # Players per chat room; each round opens just enough rooms for everyone.
+AUTO_ASSIGN_ROOMS = False       # Put every player in an open room when the discussion starts.
+RESUME_GRACE = 30               # Seconds a disconnected player's seat is held for them to resume (0 disables).
+MISSED_LIMIT = 200              # Messages kept for a held seat; older ones are dropped (RESUMED carries the state).
+MATCH_MIN_PLAYERS = 3           # Smallest game the matchmaker forms.
+MATCH_MAX_PLAYERS = 8           # Largest game; this many queued players start one right away.
+MATCH_WAIT = 15                 # Seconds the longest-waiting player waits before a smaller game starts anyway.
+RECOVERY_GRACE = 60             # Seconds the seats of sessions recovered from the journal are held for their players.
+
+# Game phases. The session a client joins is a lobby with a matchmaking queue: players who are
+# ready are grouped into games, each a GameSession of its own (see GameSession.matchmake). A game
+# starts in LOBBY and each round goes ROLES -> ROOMS -> VOTING -> RESULT; RESULT either starts the
+# next round or ends the game (back to LOBBY), which sends its players back to the lobby they came
+# from. Timed phases end through the shared scheduler, or earlier on game events.
+LOBBY, ROLES, ROOMS, VOTING, RESULT = "LOBBY", "ROLES", "ROOMS", "VOTING", "RESULT"
+
+# List of possible discussion topics to assign to normal players.
+topicList = [
+    "food", "cars", "anime", "movies", "school", "trains", "shervin", "IEEE",
+    "the state of vancouver's economy in chinese", "clothing", "canada", "computer parts", "games", "art"
+]
+
+# ------------------------------- Locking -------------------------------- #
+# State is partitioned so that unrelated work never waits on the same lock:
+#   - sessions_lock guards the session registry (joining and leaving a game only),
+#   - each GameSession's data_lock guards its roster, phase and votes,
+#   - each Room's lock guards that room's (or the lobby's) member set.
+# Locks are only taken in that order, and only for in-memory updates: messages and connection
+# closes decided under a lock are collected in an Outbox and carried out after it is released.
+# A game's data_lock may be held while taking the data_lock of the lobby it was formed from,
+# never the other way around.
+
+class Room:
+    """
+    The members of one chat room or of a session's lobby, with their own lock, so chat in a room
+    only ever waits on that room and never on other rooms or on the game state. Members are only
+    added or removed while the session's data_lock is held as well.
+    The room also remembers its last HISTORY_SIZE chat lines (older ones fall off the ring buffer),
+    so a player joining mid-discussion can catch up.
+    """
+    __slots__ = ("room_id", "members", "lock", "history")
+
+    def __init__(self, room_id, history=()):
+        self.room_id = room_id    # "lobby" or the room number.
+        self.members = set()      # Connections in this room.
+        self.lock = threading.Lock()
+        self.history = deque(history, maxlen=HISTORY_SIZE)  # Recent chat lines, oldest first.
+
+    def add(self, conn):
+        """
+        Adds a member; returns the chat history it has not seen, taken together with joining
+        so every line is either in the history or sent to the new member, never both or neither.
+        """
+        with self.lock:
+            self.members.add(conn)
+            return list(self.history)
+
+    def replace(self, old, new):
+        """
+        Puts connection 'new' in the place of member 'old'.
+        """
+        with self.lock:
+            self.members.discard(old)
+            self.members.add(new)
+
+    def post(self, line):
+        """
+        Records a chat line in the history; returns the members to send it to.
+        """
+        with self.lock:
+            self.history.append(line)
+            return list(self.members)
+
+    def discard(self, conn):
+        """
+        Removes a member; returns the number of members left.
+        """
+        with self.lock:
+            self.members.discard(conn)
+            return len(self.members)
+
+    def recent_chat(self):
+        """
+        Returns a copy of the chat history.
+        """
+        with self.lock:
+            return list(self.history)
+
+class RoomPool:
+    """
+    The chat rooms of one round, numbered 1 to 'count' and created up front, each for up to 'capacity'
+    players, so clients cannot make the server allocate rooms by joining arbitrary numbers.
+    A free-slot index keeps the rooms with space in one list per number of free places, each with a
+    position map for O(1) removal: finding a room by number, finding any open room and updating the
+    index when a player enters or leaves are all O(1). Changed with the session's data_lock held.
+    """
+    __slots__ = ("capacity", "rooms", "open_rooms", "positions")
+
+    def __init__(self, count, capacity):
+        self.capacity = capacity
+        self.rooms = [Room(room_id) for room_id in range(1, count + 1)]
+        self.open_rooms = [[] for _ in range(capacity + 1)]  # Free places -> rooms with that many (index 0 unused).
+        self.positions = {}                                    # Room -> its index in its open_rooms list.
+        for room in reversed(self.rooms):  # Reversed so that any_open() hands out room 1 first.
+            self._index(room, capacity)
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def get(self, room_id):
+        """
+        Returns room number 'room_id', or None if this round has no such room.
+        """
+        if 1 <= room_id <= len(self.rooms):
+            return self.rooms[room_id - 1]
+        return None
+
+    def any_open(self):
+        """
+        Returns an open room, preferring the fullest so players who are alone get company first,
+        or None if every room is full.
+        """
+        for free in range(1, self.capacity + 1):
+            if self.open_rooms[free]:
+                return self.open_rooms[free][-1]
+        return None
+
+    def is_full(self, room):
+        return len(room.members) >= self.capacity
+
+    def _index(self, room, free):
+        if free > 0:
+            bucket = self.open_rooms[free]
+            self.positions[room] = len(bucket)
+            bucket.append(room)
+
+    def _unindex(self, room, free):
+        if free > 0:
+            bucket = self.open_rooms[free]
+            index = self.positions.pop(room)
+            last = bucket.pop()
+            if last is not room:
+                bucket[index] = last  # Swap the last room into the gap.
+                self.positions[last] = index
+
+    def changed(self, room, before):
+        """
+        Updates the free-slot index after 'room' went from 'before' members to its current number.
+        """
+        self._unindex(room, self.capacity - before)
+        self._index(room, self.capacity - len(room.members))
+
+class Outbox:
+    """
+    Messages and connection closes decided while a session lock is held.
+    GameSession.deliver() carries them out, in order, once the lock is released.
+    """
+    __slots__ = ("sends", "closes")
+
+    def __init__(self):
+        self.sends = []   # (recipients, message, connection to leave out) tuples.
+        self.closes = []  # Connections to close after the messages are queued.
+
+    def send(self, recipients, message, exclude=None):
+        self.sends.append((recipients, message, exclude))
+
+    def close(self, conn):
+        self.closes.append(conn)
+
+class HeldSeat:
+    """
+    Takes the place of a disconnected player's connection while their seat is held for a resume
+    (see GameSession.remove_client). The session treats it like any other client: it stays in its
+    room, counts for readiness and votes and may be the impostor. Messages sent to it are kept,
+    up to MISSED_LIMIT, and replayed when the player comes back.
+    """
+    __slots__ = ("player_name", "missed", "timer", "resumed")
+
+    def __init__(self, player_name):
+        self.player_name = player_name
+        self.missed = deque(maxlen=MISSED_LIMIT)  # Messages the player has not received yet, oldest first.
+        self.timer = None                         # Scheduler timer giving the seat up after RESUME_GRACE.
+        self.resumed = False                      # Set once the player resumed (the timer then does nothing).
+
+    def send(self, message):
+        self.missed.append(message)
+        return True
+
+    def close(self):
+        pass
+
+class GameSession:
+    """
+    One independent game: its own roster, lobby, chat rooms, votes and phase timer.
+    A server process can host any number of these side by side; connections are
+    routed to a session by the session_id they send in JOIN_ROOM. Those sessions are lobbies
+    that match ready players into games; a game is a session too, with 'parent' set to its lobby.
+    """
+    def __init__(self, session_id, parent=None):
+        self.session_id = session_id
+        self.parent = parent  # For a game formed by the matchmaker: the lobby session its players came from.
+
+        self.clients = {}           # Dictionary mapping a socket to its associated player_name.
+        self.players_by_name = {}   # Reverse index of 'clients': player_name -> socket (names are unique per session).
+        self.resume_tokens = {}     # Resume token -> player_name, handed out with LOBBY_JOINED.
+        self.player_tokens = {}     # Reverse index of 'resume_tokens': player_name -> token.
+        self.ready_clients = set()  # Set of sockets that have indicated they are ready to play.
+        self.roster_version = 0     # Bumped by every change to the player list (see _roster_changed).
+
+        self.lobby = Room("lobby")  # Players waiting in the lobby (and everyone during voting).
+        self.room_pool = None       # The chat rooms of the current round (a RoomPool), None outside the discussion.
+        self.client_rooms = {}      # Dictionary mapping a socket to the Room it is in (the lobby or a chat room).
+
+        self.impostor_for_game = None  # The socket chosen to be the impostor.
+        self.topic = None              # The crewmates' discussion topic of the current round.
+        self.phase = LOBBY             # The current game phase (see the phase constants above).
+        self.phase_started = time.monotonic()  # When the current phase began (for the phase duration metrics).
+        self.nested_entry_seconds = 0.0        # Time spent in entry actions nested in the running one (see _advance).
+        self.phase_timer = None        # Scheduler timer ending the current phase, if it is timed.
+        self.votes = {}                # Dictionary mapping a voter (player_name) to the vote target (player_name).
+        self.vote_counts = {}          # Dictionary mapping a vote target (player_name) to its votes so far.
+        self.game_running = False      # Boolean flag indicating if the game is currently running.
+        self.round = 0                 # Rounds started in the current game.
+        self.voting_started = None     # When the current vote opened, and when its first and last votes came in
+        self.first_vote_at = None      # (for the round analytics).
+        self.last_vote_at = None
+
+        # Guards this session's roster, phase and votes only, so games never wait on each other.
+        # Never held while sending (see Outbox), and not needed to chat. Waits for it are measured.
+        self.data_lock = metrics.TimedLock(metrics.DATA_LOCK_WAIT_SECONDS, threading.Lock())
+
+        # Matchmaking (lobby sessions only). Queue entries of players who left the queue are skipped lazily.
+        self.queue = deque()     # (time queued, player_name) of queued players, oldest first.
+        self.queued = {}         # player_name -> time queued, for the players really in the queue.
+        self.away = {}           # player_name -> the game the player is in; their name and resume token stay reserved.
+        self.games_formed = 0
+        self.match_timer = None  # Scheduler timer running matchmake() when the oldest player has waited long enough.
+        self.match_deadline = None
+
+        # Connections routed to this session, plus held seats and running games formed from it
+        # (maintained by the registry under sessions_lock).
+        self.member_count = 0
+
+    # --------------------------- Broadcasting Functions --------------------------- #
+    def deliver(self, outbox):
+        """
+        Carries out an Outbox filled while the lock was held (called without any lock held).
+        Each send only appends a shared, once-encoded frame to the recipients' outbound queues.
+        Clients whose connection is gone (closed, or dropped by the slow consumer policy) are
+        removed from the session. The recipients of several messages are corked meanwhile, so each
+        of them gets the whole burst (e.g. a phase transition) in one write.
+        """
+        failed_clients = []
+        corked = ()
+        if len(outbox.sends) > 1:
+            corked = cork_all({conn for recipients, _message, _exclude in outbox.sends for conn in recipients})
+        try:
+            for recipients, message, exclude in outbox.sends:
+                start = time.perf_counter()
+                failed_clients.extend(fan_out(message, recipients, exclude))
+                metrics.observe(metrics.FANOUT_SECONDS, "outbox", time.perf_counter() - start)
+        finally:
+            uncork_all(corked)
+        for conn in outbox.closes:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        if failed_clients:
+            self.drop_clients(set(failed_clients))
+
+    def drop_clients(self, failed_clients):
+        """
+        Closes the given connections and removes their players from the session the same way as
+        any other departure, so losing e.g. the impostor or a voter moves the game on.
+        """
+        for client in failed_clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+        out = Outbox()
+        with self.data_lock:
+            for client in failed_clients:
+                self._player_gone(client, out)
+        self.deliver(out)
+
+    def broadcast(self, message, exclude=None):
+        """
+        Broadcasts a message to every client in this session, except the 'exclude' connection.
+        The message is encoded once and each send only appends that shared frame to the recipient's
+        outbound queue, so the cost depends on the number of recipients and not on how fast they read
+        or how long the message is. If a client's connection is gone (closed, or dropped
+        by the slow consumer policy), that client is removed from the session and its socket is closed.
+        """
+        start = time.perf_counter()
+        with self.data_lock:
+            client_snapshot = list(self.clients.keys())
+        # Attempt to send the message to each client not equal to 'exclude'
+        failed_clients = fan_out(message, client_snapshot, exclude)
+        metrics.observe(metrics.FANOUT_SECONDS, "broadcast", time.perf_counter() - start)
+        if failed_clients:
+            self.drop_clients(failed_clients)
+
+    def room_broadcast(self, line, room, sender):
+        """
+        Sends a chat line to all clients in a Room (a chat room or the lobby), excluding the sender,
+        and adds it to the room's history. Only the room's own lock is taken, to copy its members.
+        If sending fails for any client, that client is closed and removed from the session.
+        """
+        start = time.perf_counter()
+        failed_clients = fan_out(create_message("INFO", message=line), room.post(line), sender)
+        metrics.observe(metrics.FANOUT_SECONDS, "lobby_broadcast" if room.room_id == "lobby" else "room_broadcast",
+                        time.perf_counter() - start)
+        if failed_clients:
+            self.drop_clients(failed_clients)
+
+    # --------------------------- Membership Functions --------------------------- #
+    # The roster is kept in several structures (clients, players_by_name, client_rooms and the
+    # Room member sets); these helpers change them together, with data_lock held,
+    # so every lookup and removal stays O(1) however many players there are.
+
+    def _leave_room(self, conn):
+        """
+        Takes a client out of the lobby or chat room it is in (it is then in neither).
+        """
+        room = self.client_rooms.pop(conn, None)
+        if room is None:
+            return
+        before = len(room.members)
+        room.discard(conn)
+        if self.room_pool is not None and room.room_id != "lobby" and self.room_pool.get(room.room_id) is room:
+            self.room_pool.changed(room, before)
+
+    def _move(self, conn, room):
+        """
+        Moves a client into 'room' (the lobby or a chat room).
+        Returns the room's recent chat for the client to catch up on (empty if it was already there).
+        """
+        if self.client_rooms.get(conn) is room:
+            return []
+        if not isinstance(conn, HeldSeat) and connection_sessions.get(conn) is not self:
+            return []  # The connection is leaving (or was moved to another session); it goes in no room.
+        self._leave_room(conn)
+        before = len(room.members)
+        history = room.add(conn)
+        self.client_rooms[conn] = room
+        if room.room_id != "lobby" and self.room_pool is not None:
+            self.room_pool.changed(room, before)
+        journal.record("room", self.session_id, player=self.clients.get(conn), room=room.room_id)
+        return history
+
+    # The player list is versioned: a client gets the whole list (ROSTER) when it joins a session,
+    # then one ROSTER_UPDATE per change carrying the new version, so it can keep its own copy and
+    # nothing sent each round grows with the number of players. A client that sees a version gap
+    # (e.g. two updates crossing on their way) asks for the whole list again with ROSTER_SYNC.
+
+    def roster_message(self):
+        """
+        The whole player list at its current version (called with the lock held).
+        """
+        return create_message("ROSTER", version=self.roster_version, players=list(self.clients.values()))
+
+    def _roster_changed(self, added=(), removed=()):
+        """
+        Bumps the roster version after players were added or removed (called with the lock held).
+        Returns the ROSTER_UPDATE telling the other clients.
+        """
+        self.roster_version += 1
+        return create_message("ROSTER_UPDATE", version=self.roster_version, added=list(added), removed=list(removed))
+
+    def send_history(self, conn, room_id, history):
+        """
+        Replays a room's recent chat to a client that just joined it, as one HISTORY message,
+        so catching up costs a single queued frame however long the history is.
+        """
+        if history:
+            conn.send(create_message("HISTORY", room_id=room_id, messages=history))
+
+    def _forget(self, conn):
+        """
+        Removes a client from the session entirely. Returns its player name, or None if it was not a member.
+        """
+        player_name = self.clients.pop(conn, None)
+        if player_name is None:
+            return None
+        del self.players_by_name[player_name]
+        token = self.player_tokens.pop(player_name, None)
+        if token is not None:
+            del self.resume_tokens[token]
+        self.ready_clients.discard(conn)
+        self._unqueue(player_name)
+        self._leave_room(conn)
+        # A departed player's ballot no longer counts, so "everyone has voted" means everyone still here.
+        target = self.votes.pop(player_name, None)
+        if target is not None:
+            # Take it off the running tally too, as the journal's "leave" replay does.
+            self.vote_counts[target] -= 1
+            if not self.vote_counts[target]:
+                del self.vote_counts[target]
+        journal.record("leave", self.session_id, player=player_name)
+        if self.parent is not None:
+            self.parent.release_name(player_name, self)
+        return player_name
+
+    def _replace(self, old, new):
+        """
+        Hands the seat of connection 'old' (a client or a HeldSeat) to 'new': name, readiness,
+        room and impostor role all carry over.
+        """
+        player_name = self.clients.pop(old)
+        self.clients[new] = player_name
+        self.players_by_name[player_name] = new
+        if old in self.ready_clients:
+            self.ready_clients.discard(old)
+            self.ready_clients.add(new)
+        room = self.client_rooms.pop(old, None)
+        if room is not None:
+            room.replace(old, new)
+            self.client_rooms[new] = room
+        if self.impostor_for_game is old:
+            self.impostor_for_game = new
+
+    # --------------------------- Client Handler Functions --------------------------- #
+    def add_client(self, conn, player_name):
+        """
+        Registers a new client in this session's lobby and greets them.
+        Player names are unique within a session: returns False (and tells the client) if the name is taken.
+        """
+        history = []
+        update = None
+        with self.data_lock:
+            taken = conn not in self.clients and (player_name in self.players_by_name or player_name in self.away)
+            if conn not in self.clients and not taken:
+                self.clients[conn] = player_name  # Associate connection with player name.
+                self.players_by_name[player_name] = conn
+                token = secrets.token_urlsafe(16)  # Lets the player resume after losing the connection.
+                self.resume_tokens[token] = player_name
+                self.player_tokens[player_name] = token
+                journal.record("join", self.session_id, player=player_name, token=token)
+                history = self._move(conn, self.lobby)  # Add client to lobby.
+                update = self._roster_changed(added=(player_name,))
+            player_name = self.clients.get(conn, player_name)
+            token = self.player_tokens.get(player_name)
+            roster = self.roster_message()
+        if taken:
+            conn.send(create_message("INFO", message=f"The name {player_name} is already taken in this game. Choose another one."))
+            return False
+        # Send a welcome message to the client, with the player list to keep up to date from now on.
+        conn.send(create_message("LOBBY_JOINED",
+                                 message=f"Welcome to the lobby, {player_name}!", token=token))
+        conn.send(roster)
+        self.send_history(conn, "lobby", history)
+        # Notify all other clients that a new player has joined.
+        if update is not None:
+            self.broadcast(update, exclude=conn)
+        return True
+
+    def handle_message(self, conn, message):
+        """
+        Performs the action for a single decoded message sent by a client of this session,
+        using the handler HANDLERS lists for its type.
+        """
+        handler = self.HANDLERS.get(message["type"])
+        if handler is None:
+            conn.send(create_message("INFO", message=f"{message['type']} messages are not accepted from players."))
+            return
+        if conn not in self.clients:
+            current = connection_sessions.get(conn)
+            if current is not None and current is not self:
+                # The player was just moved between a lobby and a game; the message is for the new one.
+                current.handle_message(conn, message)
+                return
+            # E.g. an eliminated player whose connection is still closing.
+            conn.send(create_message("INFO", message="You are no longer in this game."))
+            return
+        handler(self, conn, message)
+
+    def handle_join_lobby(self, conn, message):
+        """
+        Moves a client out of its chat room and back into the lobby.
+        """
+        history = []
+        with self.data_lock:
+            if conn in self.clients:
+                history = self._move(conn, self.lobby)
+        conn.send(create_message("LOBBY_JOINED", message="You have rejoined the lobby."))
+        self.send_history(conn, "lobby", history)
+
+    def handle_ready(self, conn, message):
+        """
+        Puts a client in the lobby's matchmaking queue, then lets the matchmaker look for a game.
+        """
+        out = Outbox()
+        with self.data_lock:
+            if self.game_running or self.parent is not None:
+                out.send((conn,), create_message("INFO", message="The game is already running."))
+            elif conn in self.clients:
+                player_name = self.clients[conn]
+                if player_name not in self.queued:
+                    self.ready_clients.add(conn)  # Mark this client as ready.
+                    self._enqueue(player_name)
+                # Inform all clients that this player is ready.
+                out.send(list(self.clients), create_message(
+                    "INFO", message=f"{player_name} is ready ({len(self.queued)} waiting for a game of "
+                                    f"{MATCH_MIN_PLAYERS} to {MATCH_MAX_PLAYERS} players)."))
+        self.deliver(out)
+        self.matchmake()
+
+    def handle_join(self, conn, message):
+        """
+        Moves a client into a chat room of the current round: the one numbered room_id (the protocol
+        guarantees an integer), or any open room if room_id is left out.
+        """
+        room_id = message["room_id"]
+        history = []
+        error = None
+        with self.data_lock:
+            pool = self.room_pool
+            if pool is None:
+                error = "Chat rooms are only open during the discussion."
+            elif room_id is None:
+                current = self.client_rooms.get(conn)
+                # Staying put is fine when already in a room; otherwise take the best open one.
+                room = current if current is not None and current.room_id != "lobby" else pool.any_open()
+                if room is None:
+                    error = "Every room is full."
+            else:
+                room = pool.get(room_id)
+                if room is None:
+                    error = f"There is no room {room_id}. Choose a room from 1 to {len(pool)}."
+                elif conn not in room.members and pool.is_full(room):
+                    error = "Room is full. Choose another."
+            if error is None and conn in self.clients:
+                room_id = room.room_id
+                history = self._move(conn, room)  # Leave the lobby (or the previous room).
+        if error is not None:
+            conn.send(create_message("INFO", message=error))
+        else:
+            conn.send(create_message("INFO", message=f"Joined room {room_id}"))
+            self.send_history(conn, room_id, history)
+
+    def handle_chat(self, conn, message):
+        """
+        Sends a chat message to the sender's room or to the lobby.
+        This is the hot path, so it takes no session lock: it reads which room the sender is in
+        (a single dictionary lookup, atomic in CPython) and then only touches that room's lock.
+        """
+        room = self.client_rooms.get(conn)
+        content = message["message"]
+        sender = self.clients.get(conn, "Unknown")
+        if room is not None:
+            # Broadcast to everyone in the lobby or the room except the sender.
+            self.room_broadcast(f"{sender}: {content}", room, conn)
+        else:
+            # Inform client if they are in an invalid room.
+            conn.send(create_message("INFO", message="You're not in a valid room."))
+
+    def handle_vote(self, conn, message):
+        """
+        Records a client's vote for a player; the vote ends early once every player has voted.
+        """
+        out = Outbox()
+        with self.data_lock:
+            voter = self.clients.get(conn)
+            target = message["target"]
+            if self.phase != VOTING:
+                out.send((conn,), create_message("INFO", message="Voting is not open right now."))
+            # Check if the client has already voted.
+            elif voter in self.votes:
+                out.send((conn,), create_message("INFO", message="You have already voted."))
+            # Verify if the target is a valid player using the name index.
+            elif target in self.players_by_name:
+                self.votes[voter] = target  # Record the vote.
+                self.vote_counts[target] = self.vote_counts.get(target, 0) + 1
+                journal.record("vote", self.session_id, voter=voter, target=target)
+                self.last_vote_at = time.monotonic()
+                if self.first_vote_at is None:
+                    self.first_vote_at = self.last_vote_at
+                out.send((conn,), create_message("INFO", message=f"You voted for {target}."))
+                if len(self.votes) >= len(self.clients):
+                    self._advance(VOTING, RESULT, out)
+            else:
+                out.send((conn,), create_message("INFO", message="Invalid vote target."))
+        self.deliver(out)
+
+    def handle_roster_sync(self, conn, message):
+        """
+        Sends the whole player list to a client whose copy fell behind.
+        """
+        with self.data_lock:
+            roster = self.roster_message()
+        conn.send(roster)
+
+    # Message types a player may send to its session, and the method handling each.
+    HANDLERS = {
+        "JOIN_LOBBY": handle_join_lobby,
+        "READY": handle_ready,
+        "JOIN": handle_join,
+        "CHAT": handle_chat,
+        "VOTE": handle_vote,
+        "ROSTER_SYNC": handle_roster_sync,
+    }
+
+    def remove_client(self, conn, out):
+        """
+        Handles a client whose connection has ended. For RESUME_GRACE seconds the player keeps their
+        seat: a HeldSeat takes the connection's place and collects what is sent to them, and nobody
+        is told they left. If they do not resume in time (or holding is disabled), all state belonging
+        to them is cleaned up and the remaining players are told.
+        Returns True if the seat is being held; the registry then keeps counting it as a member.
+        Called by leave_session with sessions_lock held, so what the others are told goes into
+        'out' for it to deliver once the lock is released.
+        """
+        held = False
+        with self.data_lock:
+            player_name = self.clients.get(conn)
+            if player_name is not None and RESUME_GRACE > 0:
+                seat = HeldSeat(player_name)
+                self._replace(conn, seat)
+                self._unqueue(player_name)  # A player who is away cannot be put in a game; they ready up again.
+                seat.timer = scheduler.call_later(RESUME_GRACE, self.expire_seat, seat)
+                held = True
+                print(f"[SEAT HELD] [{self.session_id}] {player_name} has {RESUME_GRACE}s to resume.")
+            else:
+                self._player_gone(conn, out)
+        return held
+
+    def expire_seat(self, seat):
+        """
+        Gives up a held seat whose player did not resume in time (runs on the scheduler thread).
+        """
+        out = Outbox()
+        with self.data_lock:
+            if seat.resumed:
+                return
+            seat.resumed = True  # Settled either way; the seat may already be gone (e.g. voted out).
+            self._player_gone(seat, out)
+        self.deliver(out)
+        release_seat(self)
+
+    def _player_gone(self, conn, out):
+        """
+        Removes a departed player and tells the others (called with the lock held).
+        A departure can end the current phase (or the whole game) early.
+        """
+        left_name = self._forget(conn)
+        if left_name is not None:
+            # Notify all clients that a player has disconnected.
+            out.send(list(self.clients), self._roster_changed(removed=(left_name,)))
+            self.player_left(conn, out)
+        return left_name
+
+    def resume_client(self, conn, token):
+        """
+        Gives a reconnecting player their seat back on connection 'conn' and brings them up to date
+        with only what changed: a RESUMED message with the current phase, room, role, topic and
+        players, followed by the messages sent to the seat while they were away.
+        Returns what the connection replaced: the HeldSeat, or the player's old connection if the
+        server had not noticed it was lost yet (it is closed). Returns None for an unknown token.
+        """
+        with self.data_lock:
+            player_name = self.resume_tokens.get(token)
+            old = self.players_by_name.get(player_name)
+            if old is None:
+                missing = True
+            else:
+                missing = False
+                self._replace(old, conn)
+                missed = []
+                if isinstance(old, HeldSeat):
+                    old.resumed = True
+                    old.timer.cancel()
+                    missed = list(old.missed)
+                room = self.client_rooms.get(conn)
+                role = None
+                if self.game_running:
+                    role = "impostor" if conn is self.impostor_for_game else "crewmate"
+                state = create_message("RESUMED", player_name=player_name, phase=self.phase,
+                                       room_id=room.room_id if room is not None else None, role=role,
+                                       topic=self.topic if role == "crewmate" else None,
+                                       players=list(self.clients.values()), missed=len(missed),
+                                       version=self.roster_version)
+        if missing:
+            conn.send(create_message("INFO", message="That game no longer has a seat for you. Join again."))
+            return None
+        corked = cork_all((conn,))  # The state and everything missed go out together.
+        conn.send(state)
+        for message in missed:
+            conn.send(message)
+        uncork_all(corked)
+        if not isinstance(old, HeldSeat):
+            old.close()  # Its reader sees the connection end; the player is no longer attached to it.
+        print(f"[RESUMED] [{self.session_id}] {player_name}")
+        return old
+
+    def player_left(self, conn, out):
+        """
+        Re-checks the game after 'conn' left the session (called with the lock held).
+        """
+        if not self.game_running:
+            # Everyone still queued may have been waiting for the player who left.
+            if self.parent is None and len(self.queued) >= MATCH_MIN_PLAYERS:
+                scheduler.call_later(0, self.matchmake)  # It takes sessions_lock, so not from under data_lock.
+        elif conn is self.impostor_for_game:
+            self.end_game("crewmates", out)
+        elif len(self.clients) <= 2:
+            self.end_game("impostor", out)
+        elif self.phase == VOTING and len(self.votes) >= len(self.clients):
+            self._advance(VOTING, RESULT, out)
+
+    # --------------------------- Matchmaking --------------------------- #
+    # A lobby's queue is a deque in the order players readied up, plus a dictionary of who is really
+    # queued: leaving the queue only deletes the dictionary entry, and stale deque entries are skipped
+    # when they reach the front. Forming a game pops its players off the front, so the matchmaker's
+    # cost depends on the size of the games it forms and never on how many players are waiting.
+
+    def _enqueue(self, player_name):
+        now = time.monotonic()
+        self.queued[player_name] = now
+        self.queue.append((now, player_name))
+
+    def _unqueue(self, player_name):
+        if self.queued.pop(player_name, None) is not None and len(self.queue) > 2 * len(self.queued) + 64:
+            # Mostly stale entries: rebuild once, which keeps the amortized cost per player constant.
+            self.queue = deque(entry for entry in self.queue if self.queued.get(entry[1]) == entry[0])
+
+    def _oldest_queued(self):
+        """
+        Returns when the longest-waiting queued player readied up, or None if the queue is empty.
+        """
+        while self.queue and self.queued.get(self.queue[0][1]) != self.queue[0][0]:
+            self.queue.popleft()
+        return self.queue[0][0] if self.queue else None
+
+    def matchmake(self, timer_fired=False):
+        """
+        Forms games from the queue, longest-waiting players first:
+          - a game of MATCH_MAX_PLAYERS whenever that many players are queued,
+          - a game of everyone queued once at least MATCH_MIN_PLAYERS are and either the first of them
+            has waited MATCH_WAIT seconds or nobody else in the lobby is left to wait for.
+        Each game starts right away while the others keep queueing. Forming one takes sessions_lock,
+        then the data_lock, since the players' connections are routed to their new game; the global
+        sessions_lock is only taken when there is a game to form.
+        """
+        if self.parent is not None:
+            return
+        with self.data_lock:
+            if timer_fired:
+                self.match_timer = self.match_deadline = None
+            if not self._match_size():
+                self._schedule_match()
+                return
+        games = []
+        with sessions_lock:
+            with self.data_lock:
+                while True:
+                    size = self._match_size()
+                    if not size:
+                        break
+                    game = self._form_game(size)
+                    players = list(game.clients.values())
+                    games.append((game, list(game.clients), players, self._roster_changed(removed=players),
+                                  game.roster_message()))
+                self._schedule_match()
+        for game, members, players, update, roster in games:
+            print(f"[MATCH] [{game.session_id}] {len(players)} players: {', '.join(players)}")
+            self.broadcast(update)
+            self.broadcast(create_message("INFO", message=f"A game started with {', '.join(players)}."))
+            fan_out(roster, members)  # The game's own player list, before its first round starts.
+            game.advance(LOBBY, ROLES)
+
+    def _match_size(self):
+        """
+        Returns how many players the next game formed from the queue has, or 0 if it is not time for one.
+        """
+        waiting = len(self.queued)
+        if waiting >= MATCH_MAX_PLAYERS:
+            return MATCH_MAX_PLAYERS
+        if waiting >= MATCH_MIN_PLAYERS and (waiting == len(self.clients) or
+                                             time.monotonic() - self._oldest_queued() >= MATCH_WAIT):
+            return waiting
+        return 0
+
+    def _schedule_match(self):
+        """
+        Makes sure matchmake() runs when the longest-waiting player has waited MATCH_WAIT seconds
+        (called with the locks held).
+        """
+        deadline = None
+        if len(self.queued) >= MATCH_MIN_PLAYERS:
+            deadline = self._oldest_queued() + MATCH_WAIT
+        if deadline == self.match_deadline:
+            return
+        if self.match_timer is not None:
+            self.match_timer.cancel()
+        self.match_timer = None
+        self.match_deadline = deadline
+        if deadline is not None:
+            self.match_timer = scheduler.call_later(max(0.0, deadline - time.monotonic()), self.matchmake, True)
+
+    def _form_game(self, size):
+        """
+        Moves the first 'size' queued players into a new game (called with sessions_lock and data_lock
+        held). The game is not visible to anyone else yet, so it is filled in without its own lock.
+        """
+        self.games_formed += 1
+        game = GameSession(f"{self.session_id}#{self.games_formed}", parent=self)
+        now = time.monotonic()
+        while len(game.clients) < size:
+            queued_at, player_name = self.queue.popleft()
+            if self.queued.get(player_name) != queued_at:
+                continue  # Left the queue since.
+            del self.queued[player_name]
+            metrics.observe(metrics.MATCH_WAIT_SECONDS, None, now - queued_at)
+            conn = self.players_by_name.pop(player_name)
+            del self.clients[conn]
+            self.ready_clients.discard(conn)
+            self._leave_room(conn)
+            self.away[player_name] = game  # The name and the resume token stay reserved here.
+            token = self.player_tokens[player_name]
+            game.clients[conn] = player_name
+            game.players_by_name[player_name] = conn
+            game.resume_tokens[token] = player_name
+            game.player_tokens[player_name] = token
+            game.lobby.members.add(conn)
+            game.client_rooms[conn] = game.lobby
+            connection_sessions[conn] = game
+        journal.record("game", self.session_id, game=game.session_id, games=self.games_formed,
+                       players=list(game.clients.values()))
+        game.member_count = size
+        self.member_count -= size - 1  # The game counts as one member, keeping the lobby open until it closes.
+        return game
+
+    def release_name(self, player_name, game):
+        """
+        Frees the name and resume token of a player who left 'game' for good (called by the game
+        with its own data_lock held).
+        """
+        with self.data_lock:
+            if self.away.get(player_name) is game:
+                del self.away[player_name]
+                token = self.player_tokens.pop(player_name, None)
+                if token is not None:
+                    del self.resume_tokens[token]
+
+    def game_for_token(self, token):
+        """
+        Returns the game the player with resume token 'token' is in, or this lobby if they are not in one.
+        """
+        return self.away.get(self.resume_tokens.get(token), self)
+
+    def return_players(self):
+        """
+        Sends the players of a finished game back to the lobby they came from (runs on the scheduler
+        thread). Seats still held for disconnected players are given up with the game.
+        """
+        lobby = self.parent
+        returned = []
+        with sessions_lock:
+            with self.data_lock:
+                players = list(self.clients.items())
+                for conn, _player_name in players:
+                    if isinstance(conn, HeldSeat):
+                        conn.resumed = True
+                        conn.timer.cancel()
+                self.clients, self.players_by_name = {}, {}
+                self.resume_tokens, self.player_tokens = {}, {}
+                self.ready_clients = set()
+                self.lobby, self.room_pool, self.client_rooms = Room("lobby"), None, {}
+            with lobby.data_lock:
+                for conn, player_name in players:
+                    lobby.away.pop(player_name, None)
+                    if isinstance(conn, HeldSeat):
+                        token = lobby.player_tokens.pop(player_name, None)
+                        if token is not None:
+                            del lobby.resume_tokens[token]
+                        continue
+                    lobby.clients[conn] = player_name
+                    lobby.players_by_name[player_name] = conn
+                    connection_sessions[conn] = lobby  # Before the move, which only admits the session's own connections.
+                    history = lobby._move(conn, lobby.lobby)
+                    returned.append((conn, player_name, lobby.player_tokens.get(player_name), history))
+                names = [entry[1] for entry in returned]
+                journal.record("returned", self.session_id, players=names)
+                out = Outbox()  # Tells the players who stayed in the lobby.
+                if names:
+                    back = {entry[0] for entry in returned}
+                    out.send([conn for conn in lobby.clients if conn not in back], lobby._roster_changed(added=names))
+                roster = lobby.roster_message()  # For the returning players, at the version just reached.
+            lobby.member_count += len(returned)
+            _drop_members(self, len(players))
+        for conn, player_name, token, history in returned:
+            corked = cork_all((conn,))
+            conn.send(create_message("LOBBY_JOINED", message=f"Back in the lobby, {player_name}. Ready up to play again.",
+                                     token=token))
+            conn.send(roster)
+            lobby.send_history(conn, "lobby", history)
+            uncork_all(corked)
+        lobby.deliver(out)
+
+    # --------------------------- Journal --------------------------- #
+    def journal_state(self):
+        """
+        Describes this session for a journal snapshot (called with data_lock held), in the shape
+        journal.apply() replays records onto. 'seq' is the last journal record the description includes.
+        """
+        pool = self.room_pool
+        return {"id": self.session_id, "parent": self.parent.session_id if self.parent is not None else None,
+                "seq": journal.last_seq(), "phase": self.phase, "topic": self.topic,
+                "impostor": self.clients.get(self.impostor_for_game), "running": self.game_running,
+                "rooms": len(pool) if pool is not None else 0, "capacity": pool.capacity if pool is not None else 0,
+                "games": self.games_formed, "votes": dict(self.votes),
+                "players": {player_name: {"token": self.player_tokens.get(player_name),
+                                          "room": self.client_rooms[conn].room_id if conn in self.client_rooms else "lobby"}
+                            for conn, player_name in self.clients.items()}}
+
+    def restore(self, state):
+        """
+        Fills a new session in from its recovered journal state (before anyone can reach it, so
+        without locks). Every player gets a HeldSeat for RECOVERY_GRACE seconds to resume on, and
+        a timed phase starts over with its full duration.
+        """
+        self.phase, self.topic, self.game_running = state["phase"], state["topic"], state["running"]
+        self.games_formed = state["games"]
+        if state["rooms"]:
+            self.room_pool = RoomPool(state["rooms"], state["capacity"])
+        for player_name, player in state["players"].items():
+            seat = HeldSeat(player_name)
+            self.clients[seat] = player_name
+            self.players_by_name[player_name] = seat
+            self.resume_tokens[player["token"]] = player_name
+            self.player_tokens[player_name] = player["token"]
+            room = self.room_pool.get(player["room"]) if self.room_pool is not None and player["room"] != "lobby" else None
+            self._move(seat, room or self.lobby)
+            seat.timer = scheduler.call_later(RECOVERY_GRACE, self.expire_seat, seat)
+        self.member_count = len(self.clients)
+        self.impostor_for_game = self.players_by_name.get(state["impostor"])
+        for voter, target in state["votes"].items():
+            if voter in self.players_by_name and target in self.players_by_name:
+                self.votes[voter] = target
+                self.vote_counts[target] = self.vote_counts.get(target, 0) + 1
+        if self.phase == ROOMS:
+            self.schedule_advance(DISCUSSION_TIME, ROOMS, VOTING)
+        elif self.phase == VOTING:
+            self.voting_started = self.phase_started
+            self.schedule_advance(VOTING_DURATION, VOTING, RESULT)
+        elif self.phase == RESULT:
+            self.schedule_advance(ROUND_BREAK, RESULT, ROLES)
+        elif self.phase == LOBBY and self.parent is not None:
+            scheduler.call_later(0, self.return_players)  # The game had ended; send its players back.
+
+    # --------------------------- Game Phases --------------------------- #
+    def advance(self, expected, phase):
+        """
+        Moves the game from phase 'expected' to 'phase' (used by the phase timers).
+        Does nothing if the game already left 'expected', so a phase timer firing and an early
+        end racing each other (e.g. the last vote arriving just as voting time runs out) cause
+        exactly one transition.
+        """
+        out = Outbox()
+        with self.data_lock:
+            moved = self._advance(expected, phase, out)
+        self.deliver(out)
+        return moved
+
+    def _advance(self, expected, phase, out):
+        """
+        advance() with the lock already held: switches phase and runs the new phase's entry
+        action, which adds what it has to say to 'out'.
+        """
+        if self.phase != expected:
+            return False
+        if self.phase_timer is not None:
+            self.phase_timer.cancel()
+            self.phase_timer = None
+        now = time.monotonic()
+        metrics.observe(metrics.PHASE_SECONDS, self.phase, now - self.phase_started)
+        self.phase_started = now
+        self.phase = phase
+        entry = self.PHASE_ENTRY[phase]
+        # An entry action may advance again (e.g. ROLES straight into ROOMS); each action is charged
+        # only its own time, without that of the actions nested in it.
+        outer_nested, self.nested_entry_seconds = self.nested_entry_seconds, 0.0
+        start = time.perf_counter()
+        entry(self, out)
+        elapsed = time.perf_counter() - start
+        metrics.observe(metrics.HANDLER_SECONDS, entry.__name__, elapsed - self.nested_entry_seconds)
+        self.nested_entry_seconds = outer_nested + elapsed
+        if self.phase == phase:  # Unless the entry action moved on already (which journaled the later phase).
+            journal.record("phase", self.session_id, phase=phase, topic=self.topic,
+                           impostor=self.clients.get(self.impostor_for_game), running=self.game_running,
+                           rooms=len(self.room_pool) if self.room_pool is not None else 0,
+                           capacity=self.room_pool.capacity if self.room_pool is not None else 0)
+        return True
+
+    def schedule_advance(self, delay, expected, phase):
+        """
+        Ends phase 'expected' after 'delay' seconds unless it ended earlier (called with the lock held).
+        """
+        self.phase_timer = scheduler.call_later(delay, self.advance, expected, phase)
+
+    def end_game(self, winner, out):
+        """
+        Announces the winner and returns the session to the lobby (called with the lock held).
+        """
+        out.send(list(self.clients), create_message("END_GAME", winner=winner))
+        self._advance(self.phase, LOBBY, out)
+
+    def broadcast_except_one(self, common_msg, impostor, out):
+        """
+        Queues the ASSIGN_ROLE messages for all clients.
+        The impostor receives a different message (with no topic) than other players (who get a common topic).
+        """
+        impostor_name = self.clients.get(impostor)
+        if not impostor_name:
+            print(f"[ERROR] [{self.session_id}] Impostor not found in clients.")
+            return
+        # Notify the impostor of their role.
+        out.send((impostor,), create_message("ASSIGN_ROLE", role="impostor", topic="(none)"))
+        print(f"[ROLE ASSIGNMENT] [{self.session_id}] {impostor_name} is the impostor.")
+        # Notify normal players of their role and assign the discussion topic (one shared message).
+        out.send(list(self.clients), create_message("ASSIGN_ROLE", role="crewmate", topic=common_msg), exclude=impostor)
+        for client, player_name in self.clients.items():
+            if client is not impostor:
+                print(f"[ROLE ASSIGNMENT] [{self.session_id}] {player_name} is a crewmate.")
+
+    def enter_lobby(self, out):
+        """
+        LOBBY: the game is over (or never started); players have to ready up again.
+        """
+        self.game_running = False
+        self.impostor_for_game = None
+        self.ready_clients.clear()
+        self.votes.clear()
+        self.vote_counts.clear()
+        self.round = 0
+        if self.parent is not None:
+            # It takes sessions_lock, so it runs once this transition is over.
+            scheduler.call_later(0, self.return_players)
+
+    def enter_roles(self, out):
+        """
+        ROLES: starts a round. On the first round an impostor is selected randomly; every round
+        chooses a new discussion topic, assigns roles and explains how to join a room.
+        """
+        current_clients = list(self.clients.keys())
+        if not current_clients:
+            self._advance(ROLES, LOBBY, out)
+            return
+        # Select an impostor randomly if a game is not already in progress.
+        if not self.game_running:
+            self.impostor_for_game = random.choice(current_clients)
+        self.game_running = True  # Mark the game as running.
+        self.round += 1
+        topic = self.topic = random.choice(topicList)  # Choose a random discussion topic.
+        self.broadcast_except_one(topic, self.impostor_for_game, out)
+        # Notify all clients that the game has started; they know the players from the roster.
+        out.send(current_clients, create_message("GAME_STARTED", version=self.roster_version))
+        # Open just enough rooms for everyone this round.
+        self.room_pool = RoomPool(math.ceil(len(current_clients) / ROOM_CAPACITY), ROOM_CAPACITY)
+        # Inform players about how to join a discussion room.
+        if not AUTO_ASSIGN_ROOMS:
+            out.send(current_clients,
+                     create_message("INFO", message=f"Choose a room number (1 to {len(self.room_pool)}) with command: "
+                                                    "join <room_number>, or join any open room with: join"))
+        self._advance(ROLES, ROOMS, out)
+
+    def enter_rooms(self, out):
+        """
+        ROOMS: the timed discussion phase in the chat rooms. With AUTO_ASSIGN_ROOMS every player
+        is placed in an open room first (there is always one, as the pool has a place for everyone).
+        """
+        if AUTO_ASSIGN_ROOMS:
+            for conn in list(self.clients):
+                room = self.room_pool.any_open()
+                self._move(conn, room)
+                out.send((conn,), create_message("INFO", message=f"Joined room {room.room_id}"))
+        # Inform clients of the discussion phase and how long it lasts.
+        out.send(list(self.clients), create_message("INFO", message=f"Room discussion time: {DISCUSSION_TIME} seconds..."))
+        self.schedule_advance(DISCUSSION_TIME, ROOMS, VOTING)
+
+    def enter_voting(self, out):
+        """
+        VOTING: ends the discussion by moving all players back to the lobby, then asks for votes.
+        The phase ends when the voting time is up or as soon as every player has voted.
+        """
+        client_snapshot = list(self.clients.keys())
+        out.send(client_snapshot, create_message("INFO", message="Discussion time over. Returning to the lobby."))
+        # Clear all room assignments and move all clients to a fresh lobby.
+        lobby = Room("lobby", self.lobby.recent_chat())  # The lobby's chat history carries over.
+        lobby.members.update(client_snapshot)
+        self.lobby = lobby
+        self.room_pool = None  # The round's rooms close.
+        self.client_rooms = dict.fromkeys(client_snapshot, lobby)
+        # Notify clients that they have rejoined the lobby.
+        out.send(client_snapshot, create_message("JOIN_LOBBY"))
+        self.votes = {}  # Reset votes for the new voting round.
+        self.vote_counts = {}
+        self.voting_started = self.phase_started
+        self.first_vote_at = self.last_vote_at = None
+        out.send(client_snapshot, create_message("INFO", message="Please vote for who you think is the impostor. Use the command: vote <player_name>"))
+        self.schedule_advance(VOTING_DURATION, VOTING, RESULT)
+
+    def enter_result(self, out):
+        """
+        RESULT: tallies the votes and determines which player is eliminated, then checks whether
+        the game is over. If the impostor is eliminated or only two players remain, the game ends;
+        otherwise the next round starts after a short break.
+        """
+        vote_counts = self.vote_counts  # Counted as the votes came in.
+        players, votes_cast = len(self.clients), len(self.votes)
+        print(f"[DEBUG] [{self.session_id}] Votes received:")
+        # Output voting details for debugging purposes.
+        for voter, target in self.votes.items():
+            print(f"  {voter} voted for {target}")
+        # Clear votes for next round.
+        self.votes = {}
+        self.vote_counts = {}
+        if not vote_counts:
+            # If no votes were cast, notify all clients that no one is eliminated.
+            out.send(list(self.clients), create_message("INFO", message="No votes cast. Nobody is eliminated."))
+            print(f"[DEBUG] [{self.session_id}] No votes were cast.")
+            eliminated = None
+        else:
+            # Determine the player with the highest vote count.
+            eliminated = max(vote_counts.items(), key=lambda x: x[1])[0]
+            out.send(list(self.clients), create_message("VOTE_RESULT", voted_out=eliminated))
+            print(f"[DEBUG] [{self.session_id}] {eliminated} has been voted out.")
+            self.eliminate(eliminated, out)
+        if eliminated and self.impostor_for_game not in self.clients:
+            outcome = analytics.OUTCOME_CREWMATES
+        elif len(self.clients) <= 2:
+            outcome = analytics.OUTCOME_IMPOSTOR
+        else:
+            outcome = analytics.OUTCOME_NEXT_ROUND
+        self.record_round(players, votes_cast, eliminated, outcome)
+        if outcome == analytics.OUTCOME_CREWMATES:
+            # If the impostor is eliminated, declare crewmates as winners.
+            self.end_game("crewmates", out)
+        elif outcome == analytics.OUTCOME_IMPOSTOR:
+            # If only two players remain, declare the impostor as the winner.
+            self.end_game("impostor", out)
+        else:
+            # Otherwise, wait briefly and start a new round.
+            self.schedule_advance(ROUND_BREAK, RESULT, ROLES)
+
+    def record_round(self, players, votes_cast, eliminated, outcome):
+        """
+        Adds the round that just ended to the round analytics (called with the lock held, after the
+        voted-out player was removed).
+        """
+        if eliminated is None:
+            eliminated_role = analytics.ELIMINATED_NONE
+        elif self.impostor_for_game in self.clients:
+            eliminated_role = analytics.ELIMINATED_CREWMATE
+        else:
+            eliminated_role = analytics.ELIMINATED_IMPOSTOR
+        first_vote = last_vote = float("nan")
+        if self.first_vote_at is not None:
+            first_vote = self.first_vote_at - self.voting_started
+            last_vote = self.last_vote_at - self.voting_started
+        analytics.record_round(time=time.time(), round=self.round, players=players, votes=votes_cast,
+                               first_vote=first_vote, last_vote=last_vote,
+                               voting_seconds=self.phase_started - self.voting_started, eliminated=eliminated_role,
+                               outcome=outcome, topic=self.topic, discussion_time=DISCUSSION_TIME,
+                               voting_time=VOTING_DURATION)
+
+    def eliminate(self, eliminated_name, out):
+        """
+        Removes the voted-out player from the game; their connection is closed once the lock is released.
+        """
+        # Find the connection associated with the eliminated player.
+        eliminated_conn = self.players_by_name.get(eliminated_name)
+        if eliminated_conn:
+            self._forget(eliminated_conn)  # Remove the eliminated client.
+            out.close(eliminated_conn)     # Close the client's connection.
+            out.send(list(self.clients), self._roster_changed(removed=(eliminated_name,)))
+
+    # Entry action run by _advance() for each phase.
+    PHASE_ENTRY = {
+        LOBBY: enter_lobby,
+        ROLES: enter_roles,
+        ROOMS: enter_rooms,
+        VOTING: enter_voting,
+        RESULT: enter_result,
+    }
+
+# --------------------------- Session Registry --------------------------- #
+sessions = {}                      # Dictionary mapping a session_id to its GameSession.
+connection_sessions = {}           # Dictionary mapping a socket to the GameSession it joined.
+sessions_lock = threading.Lock()   # Guards the two registry dictionaries above (never held during I/O).
+
+def normalize_session_id(session_id):
+    """
+    Returns the registry key for a requested session id; a missing or empty id means the default session.
+    """
+    return str(session_id) if session_id not in (None, "") else DEFAULT_SESSION_ID
+
+def session_for(conn):
+    """
+    Returns the session a connection has joined, or None if it has not sent JOIN_ROOM yet.
+    This runs for every message, so it reads without sessions_lock: a single dictionary lookup is
+    atomic in CPython, and only the connection's own reader thread adds or removes its entry.
+    """
+    return connection_sessions.get(conn)
+
+def join_session(conn, session_id, player_name):
+    """
+    Routes a connection to the requested session and registers the player there.
+    A connection that already joined a session stays in it.
+    Returns the session, or None if the player name is already taken there.
+    """
+    session_id = normalize_session_id(session_id)
+    with sessions_lock:
+        session = connection_sessions.get(conn)
+        if session is None:
+            session = sessions.get(session_id)
+            if session is None:
+                session = GameSession(session_id)
+                sessions[session_id] = session
+                print(f"[SESSION CREATED] {session_id} ({len(sessions)} active)")
+            session.member_count += 1
+            connection_sessions[conn] = session
+    if not session.add_client(conn, player_name):
+        # The name is taken: the connection is not part of the session after all (it may try again).
+        leave_session(conn)
+        return None
+    return session
+
+def resume_session(conn, session_id, token):
+    """
+    Reattaches a reconnecting player (RESUME) to the seat their token belongs to.
+    Returns the session, or None if there is nothing to resume.
+    """
+    session_id = normalize_session_id(session_id)
+    with sessions_lock:
+        if conn in connection_sessions:
+            session = None
+            reason = "You already joined a game."
+        else:
+            session = sessions.get(session_id)
+            reason = "That game no longer has a seat for you. Join again."
+            if session is not None:
+                session = session.game_for_token(token)  # The player may be in a game formed from the lobby.
+                session.member_count += 1
+                connection_sessions[conn] = session
+    if session is None:
+        conn.send(create_message("INFO", message=reason))
+        return None
+    replaced = session.resume_client(conn, token)
+    if replaced is None:
+        leave_session(conn)
+        return None
+    if isinstance(replaced, HeldSeat):
+        release_seat(session)  # The seat is now counted through the new connection.
+    return session
+
+def leave_session(conn):
+    """
+    Removes a connection from its session and discards the session once it is empty.
+    A player whose seat is held for a resume keeps the session alive until it is given up.
+    """
+    out = Outbox()
+    # sessions_lock is held until the player is out of the session: released in between, a game
+    # forming (or ending) meanwhile could move the connection on to another session, which would
+    # then keep it while this one lost a member it still has.
+    with sessions_lock:
+        session = connection_sessions.pop(conn, None)
+        if session is None:
+            return
+        if not session.remove_client(conn, out):
+            _drop_members(session, 1)
+    session.deliver(out)
+
+def release_seat(session):
+    """
+    Stops counting one member (a connection or a held seat) of a session; the last one out closes it.
+    """
+    with sessions_lock:
+        _drop_members(session, 1)
+
+def _drop_members(session, count):
+    """
+    Stops counting 'count' members of a session (called with sessions_lock held). The last member out
+    closes the session (its departure also ends a running game); a closed game stops counting as a
+    member of its lobby.
+    """
+    if not count:
+        return
+    while session is not None:
+        session.member_count -= count
+        if session.member_count:
+            return
+        if sessions.get(session.session_id) is session:
+            del sessions[session.session_id]
+            print(f"[SESSION CLOSED] {session.session_id} ({len(sessions)} active)")
+        session, count = session.parent, 1
+
+# --------------------------- Journal Snapshots and Recovery --------------------------- #
+def snapshot_states():
+    """
+    Describes every session for a journal snapshot (runs on the journal's writer thread).
+    sessions_lock keeps players from moving between a lobby and its games meanwhile; each session
+    is then described under its own data_lock, one at a time.
+    """
+    states = []
+    with sessions_lock:
+        for lobby in list(sessions.values()):
+            with lobby.data_lock:
+                states.append(lobby.journal_state())
+                games = set(lobby.away.values())
+            for game in games:
+                with game.data_lock:
+                    states.append(game.journal_state())
+    return states
+
+def restore_sessions(states):
+    """
+    Rebuilds the sessions recovered from the journal (see journal.load), before the server accepts
+    connections. Players get their seats back by resuming with their old token; sessions nobody is
+    left in are not restored.
+    """
+    parents = {state["id"] for state in states if state["parent"] is None}
+    live = [state for state in states if state["players"] and (state["parent"] is None or state["parent"] in parents)]
+    keep = {state["id"] for state in live} | {state["parent"] for state in live}
+    restored = {}
+    for state in states:  # Lobbies come first.
+        if state["id"] not in keep:
+            continue
+        parent = restored.get(state["parent"])
+        session = GameSession(state["id"], parent=parent)
+        session.restore(state)
+        restored[session.session_id] = session
+        if parent is None:
+            sessions[session.session_id] = session
+            continue
+        parent.member_count += 1  # A game counts as one member of its lobby.
+        for player_name, token in session.player_tokens.items():
+            parent.away[player_name] = session
+            parent.resume_tokens[token] = player_name
+            parent.player_tokens[player_name] = token
+    if restored:
+        print(f"[SESSIONS RECOVERED] {', '.join(restored)} ({RECOVERY_GRACE}s for players to resume)")
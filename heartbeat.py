@@ -0,0 +1,94 @@
+import socket          # Sets the TCP keepalive options of client sockets.
+import threading       # Guards the set of watched connections.
+import time            # Measures how long a peer has been silent.
+
+import metrics
+from protocol import create_message
+from scheduler import scheduler
+
+# ------------------------- Heartbeat Settings ------------------------- #
+# A peer that vanished without closing its TCP connection (a crashed machine, a dropped Wi-Fi link)
+# never makes recv() return, so nothing would clean up after it. Every connection records when it
+# last received data (Connection.last_seen); a sweep on the scheduler thread PINGs connections that
+# have been quiet for HEARTBEAT_INTERVAL seconds (clients answer with a PONG) and aborts those silent
+# for HEARTBEAT_TIMEOUT seconds. Aborting wakes the connection's reader, which then runs the usual
+# disconnect cleanup. TCP keepalive is turned on too, so the kernel notices dead peers on its own.
+
+HEARTBEAT_INTERVAL = 10.0  # Seconds of silence before a connection is sent a PING (0 turns heartbeats off).
+HEARTBEAT_TIMEOUT = 30.0   # Seconds of silence after which a connection is considered dead.
+KEEPALIVE_IDLE = 15        # Seconds a connection is idle before the kernel sends the first keepalive probe.
+KEEPALIVE_INTERVAL = 5     # Seconds between keepalive probes.
+KEEPALIVE_PROBES = 3       # Unanswered probes before the kernel drops the connection.
+
+watched = set()            # Connections of this process checked by the sweep.
+watched_lock = threading.Lock()
+
+def configure_keepalive(sock):
+    """
+    Enables TCP keepalive on a client socket, plus a user timeout so that data the peer never
+    acknowledges fails the connection instead of being retransmitted for many minutes (Linux only).
+    """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                              ("TCP_KEEPCNT", KEEPALIVE_PROBES)):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        if hasattr(socket, "TCP_USER_TIMEOUT") and HEARTBEAT_TIMEOUT > 0:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(HEARTBEAT_TIMEOUT * 1000))
+    except OSError:
+        pass  # Not a TCP socket, or the platform lacks an option: heartbeats still apply.
+
+def watch(conn):
+    """
+    Starts checking 'conn' for silence.
+    """
+    conn.last_seen = time.monotonic()
+    with watched_lock:
+        watched.add(conn)
+
+def unwatch(conn):
+    with watched_lock:
+        watched.discard(conn)
+
+def sweep():
+    """
+    PINGs the connections that have been quiet for HEARTBEAT_INTERVAL seconds (at most once per
+    interval each) and aborts those silent for HEARTBEAT_TIMEOUT seconds.
+    """
+    now = time.monotonic()
+    with watched_lock:
+        connections = list(watched)
+    ping = create_message("PING")  # Encoded once for all the connections pinged in this sweep.
+    for conn in connections:
+        silent = now - conn.last_seen
+        if silent >= HEARTBEAT_TIMEOUT:
+            print(f"[HEARTBEAT] No data from {conn.describe()} for {silent:.1f}s, closing the connection.")
+            metrics.count(metrics.CONNECTIONS_REAPED)
+            unwatch(conn)
+            conn.abort()
+        elif silent >= HEARTBEAT_INTERVAL and now - conn.pinged_at >= HEARTBEAT_INTERVAL:
+            conn.pinged_at = now
+            conn.send(ping)
+
+def sweep_period():
+    # Often enough to notice a dead peer within a second of its timeout.
+    return min(1.0, HEARTBEAT_INTERVAL / 2, HEARTBEAT_TIMEOUT / 2)
+
+def _run_sweep():
+    try:
+        sweep()
+    finally:
+        scheduler.call_later(sweep_period(), _run_sweep)
+
+def start():
+    """
+    Starts the periodic sweep on the scheduler thread (unless heartbeats are off).
+    Call it once per process, after any fork.
+    """
+    if HEARTBEAT_INTERVAL <= 0 or HEARTBEAT_TIMEOUT <= 0:
+        print("[HEARTBEAT] Heartbeats are off; dead peers are only found by TCP keepalive.")
+        return
+    if HEARTBEAT_TIMEOUT <= HEARTBEAT_INTERVAL:
+        print("[HEARTBEAT] The timeout is not longer than the interval: quiet clients are closed before being pinged.")
+    scheduler.call_later(sweep_period(), _run_sweep)
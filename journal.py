@@ -0,0 +1,243 @@
+import json            # Encodes the journal records and snapshots.
+import os              # Writes, syncs, renames and removes the journal files.
+import threading       # Runs the writer thread and guards the pending records.
+import time            # Paces the group commits and the snapshots.
+
+# ------------------------- Game Journal ------------------------- #
+# Every change to a game's state (players joining and leaving, games being formed, phase changes,
+# room moves, votes) is appended to an in-memory list by the handler that made it, which only costs
+# a lock and a list append. A writer thread wakes up every COMMIT_INTERVAL seconds, writes everything
+# that piled up as JSON lines and syncs the file once for the whole batch (group commit), so no handler
+# ever waits on the disk; a crash loses at most the last interval. Every SNAPSHOT_INTERVAL seconds the
+# writer also starts a new log segment, writes a compact snapshot of all sessions and deletes the older
+# segments, so the journal stays about as large as the state it describes.
+#
+# Files in the journal directory:
+#   snapshot.json          - {"seq": N, "sessions": [state, ...]}, replaced atomically
+#   journal-<seq>.log      - records numbered from <seq> + 1, one JSON object per line
+# Each session's state in the snapshot carries the number of the last record it already includes,
+# because sessions are snapshotted one at a time while the game goes on (see game_session.snapshot_states).
+
+COMMIT_INTERVAL = 0.05     # Seconds between group commits.
+SNAPSHOT_INTERVAL = 60.0   # Seconds between snapshots.
+SNAPSHOT_FILE = "snapshot.json"
+
+lock = threading.Lock()    # Guards 'pending' and 'seq'; never held while waiting on anything else.
+pending = []               # Records waiting for the writer: (seq, event, session_id, fields).
+seq = 0                    # Number of the last record handed out.
+writer = None              # The JournalWriter, or None when journaling is off.
+
+def record(event, session_id, **fields):
+    """
+    Appends one state change to the journal (a no-op when journaling is off). Called with the
+    session's data_lock held, so the records of a session are numbered in the order they happened.
+    """
+    global seq
+    if writer is None:
+        return
+    with lock:
+        seq += 1
+        pending.append((seq, event, session_id, fields))
+
+def last_seq():
+    with lock:
+        return seq
+
+class JournalWriter:
+    """
+    Writes the pending records of this process to its journal directory from a background thread.
+    'snapshot_source' returns the state of every session (see game_session.snapshot_states).
+    """
+    def __init__(self, directory, snapshot_source):
+        self.directory = directory
+        self.snapshot_source = snapshot_source
+        self.segment = None
+        self.segment_start = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _open_segment(self, start):
+        if self.segment is not None:
+            self.segment.close()
+        self.segment_start = start
+        self.segment = open(os.path.join(self.directory, f"journal-{start}.log"), "a")
+
+    def _write(self, batch):
+        lines = []
+        for number, event, session_id, fields in batch:
+            fields = dict(fields, seq=number, event=event, session=session_id)
+            lines.append(json.dumps(fields, separators=(",", ":")))
+        self.segment.write("\n".join(lines) + "\n")
+        self.segment.flush()
+        os.fsync(self.segment.fileno())  # One sync for the whole batch.
+
+    def snapshot(self):
+        """
+        Starts a new segment, writes the snapshot and deletes the segments it makes obsolete.
+        Runs on the writer thread, after the batch holding every record up to 'base' was written.
+        """
+        with lock:
+            base = seq
+        self._open_segment(base)  # Records after 'base' go to the new segment.
+        states = self.snapshot_source()
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"seq": base, "sessions": states}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        _sync_directory(self.directory)
+        for start, name in _segments(self.directory):
+            if start < base:
+                os.remove(os.path.join(self.directory, name))
+
+    def _run(self):
+        next_snapshot = time.monotonic()  # The first snapshot compacts whatever was recovered.
+        while True:
+            time.sleep(COMMIT_INTERVAL)
+            with lock:
+                batch = pending[:]
+                del pending[:]
+            try:
+                if batch:
+                    self._write(batch)
+                if time.monotonic() >= next_snapshot:
+                    self.snapshot()
+                    next_snapshot = time.monotonic() + SNAPSHOT_INTERVAL
+            except Exception as e:
+                print(f"[JOURNAL] Write failed: {e}")
+
+def _segments(directory):
+    # (first record number - 1, file name) of every log segment, oldest first.
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith("journal-") and name.endswith(".log"):
+            try:
+                found.append((int(name[len("journal-"):-len(".log")]), name))
+            except ValueError:
+                pass
+    return sorted(found)
+
+def _sync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# ------------------------- Recovery ------------------------- #
+def new_state(session_id, parent=None):
+    """
+    The journal's description of an empty session (the same shape as the snapshot entries).
+    """
+    return {"id": session_id, "parent": parent, "seq": 0, "phase": "LOBBY", "topic": None, "impostor": None,
+            "running": False, "rooms": 0, "capacity": 0, "games": 0, "players": {}, "votes": {}}
+
+def apply(states, entry):
+    """
+    Replays one journal record onto the session states.
+    """
+    event, session_id = entry["event"], entry["session"]
+    state = states.get(session_id)
+    if event == "join":
+        if state is None:
+            state = states[session_id] = new_state(session_id)
+        state["players"][entry["player"]] = {"token": entry["token"], "room": "lobby"}
+    elif state is None:
+        return  # A session that closed before the snapshot.
+    elif event == "leave":
+        state["players"].pop(entry["player"], None)
+        state["votes"].pop(entry["player"], None)
+    elif event == "room":
+        player = state["players"].get(entry["player"])
+        if player is not None:
+            player["room"] = entry["room"]
+    elif event == "vote":
+        state["votes"][entry["voter"]] = entry["target"]
+    elif event == "phase":
+        for key in ("phase", "topic", "impostor", "running", "rooms", "capacity"):
+            state[key] = entry[key]
+        if entry["phase"] != "ROOMS":
+            state["votes"] = {}
+            for player in state["players"].values():
+                player["room"] = "lobby"
+    elif event == "game":
+        game = states[entry["game"]] = new_state(entry["game"], parent=session_id)
+        state["games"] = entry["games"]
+        for name in entry["players"]:
+            player = state["players"].pop(name, None)
+            if player is not None:
+                game["players"][name] = {"token": player["token"], "room": "lobby"}
+    elif event == "returned":
+        lobby = states.get(state["parent"])
+        for name in entry["players"]:
+            player = state["players"].get(name)
+            if lobby is not None and player is not None:
+                lobby["players"][name] = {"token": player["token"], "room": "lobby"}
+        state["players"] = {}
+
+def load(directory):
+    """
+    Rebuilds the state of every session from the snapshot and the log segments in 'directory'.
+    Returns (states, number of the last record), with states ordered lobbies first.
+    """
+    states = {}
+    base = 0
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            snapshot = json.load(f)
+        base = snapshot["seq"]
+        for state in snapshot["sessions"]:
+            states[state["id"]] = state
+    last = base
+    replayed = 0
+    for _start, name in _segments(directory):
+        with open(os.path.join(directory, name)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # A record cut short by the crash; nothing after it was synced.
+                number = entry["seq"]
+                last = max(last, number)
+                state = states.get(entry["session"])
+                if number <= base or (state is not None and number <= state["seq"]):
+                    continue  # Already part of the snapshot.
+                apply(states, entry)
+                replayed += 1
+    print(f"[JOURNAL] Recovered {len(states)} sessions from {directory} ({replayed} records after the snapshot).")
+    ordered = sorted(states.values(), key=lambda state: state["parent"] is not None)
+    return ordered, last
+
+def open_journal(directory, recover):
+    """
+    Prepares 'directory' for this process's journal. With 'recover', returns the session states found
+    there (see load); otherwise any previous journal is discarded and an empty list is returned.
+    """
+    global seq
+    os.makedirs(directory, exist_ok=True)
+    states = []
+    if recover:
+        states, seq = load(directory)
+    else:
+        for _start, name in _segments(directory):
+            os.remove(os.path.join(directory, name))
+        if os.path.exists(os.path.join(directory, SNAPSHOT_FILE)):
+            os.remove(os.path.join(directory, SNAPSHOT_FILE))
+    return states
+
+def start(directory, snapshot_source):
+    """
+    Starts journaling to 'directory' (after open_journal and after any recovered sessions were restored).
+    """
+    global writer
+    writer = JournalWriter(directory, snapshot_source)
+    with lock:
+        writer._open_segment(seq)
+    writer.thread.start()
+    print(f"[JOURNAL] Writing game state changes to {directory}")
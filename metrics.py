@@ -0,0 +1,241 @@
+import bisect          # Finds the histogram bucket of an observation.
+import threading       # Keeps one set of counters per thread and runs the HTTP endpoint.
+import time            # Times contended lock acquisitions.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Serves the metrics page.
+
+# ------------------------- Metric Definitions ------------------------- #
+# Every metric the server exports, in Prometheus text format. Counting is always on: each thread
+# updates its own dictionaries (see _shard), so a count is a dictionary update with no lock and no
+# contention between threads; the per-thread values are only added up when the page is scraped.
+
+CONNECTIONS_OPEN = "blendin_connections_open"
+MESSAGES_RECEIVED = "blendin_messages_received_total"
+MESSAGES_SENT = "blendin_messages_sent_total"
+BYTES_RECEIVED = "blendin_bytes_received_total"
+BYTES_SENT = "blendin_bytes_sent_total"
+FANOUT_SECONDS = "blendin_fanout_seconds"
+SEND_RETRIES = "blendin_send_retries_total"
+SEND_FAILURES = "blendin_send_failures_total"
+DATA_LOCK_WAIT_SECONDS = "blendin_data_lock_wait_seconds"
+PHASE_SECONDS = "blendin_phase_duration_seconds"
+HANDLER_SECONDS = "blendin_handler_seconds"
+CONNECTIONS_REAPED = "blendin_connections_reaped_total"
+FLOOD_DROPPED = "blendin_flood_dropped_total"
+FLOOD_MERGED = "blendin_flood_merged_total"
+MATCH_WAIT_SECONDS = "blendin_match_wait_seconds"
+SOCKET_WRITES = "blendin_socket_writes_total"
+FRAMES_PER_WRITE = "blendin_frames_per_write"
+
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+PHASE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 45, 60, 120, 300, 600)
+COUNT_BUCKETS = (1, 2, 3, 4, 6, 8, 16, 32, 64, 128, 256)
+
+# Metric name -> (type, help text, label name or None, histogram buckets or None).
+DEFINITIONS = {
+    CONNECTIONS_OPEN: ("gauge", "Client connections currently open.", None, None),
+    MESSAGES_RECEIVED: ("counter", "Messages received from clients, by type ('invalid' for rejected ones).", "type", None),
+    MESSAGES_SENT: ("counter", "Messages queued for clients, by type.", "type", None),
+    BYTES_RECEIVED: ("counter", "Bytes received from clients.", None, None),
+    BYTES_SENT: ("counter", "Bytes written to client sockets.", None, None),
+    FANOUT_SECONDS: ("histogram", "Time to queue one message for all its recipients, by kind of broadcast.",
+                     "kind", LATENCY_BUCKETS),
+    SEND_RETRIES: ("counter", "Socket writes retried by send_with_retry.", None, None),
+    SEND_FAILURES: ("counter", "Writes send_with_retry gave up on (the connection is then closed).", None, None),
+    DATA_LOCK_WAIT_SECONDS: ("histogram", "Time spent waiting for a session's data_lock when it was taken.",
+                             None, LATENCY_BUCKETS),
+    PHASE_SECONDS: ("histogram", "How long games stayed in each phase.", "phase", PHASE_BUCKETS),
+    HANDLER_SECONDS: ("histogram", "Time spent in each message handler, in decoding, in disconnect cleanup "
+                      "and in each phase's entry action.", "handler", LATENCY_BUCKETS),
+    CONNECTIONS_REAPED: ("counter", "Connections closed by the heartbeat after the client went silent.", None, None),
+    FLOOD_DROPPED: ("counter", "Messages dropped because their sender was over the rate limit, by type.", "type", None),
+    FLOOD_MERGED: ("counter", "CHAT lines over the rate limit held back and merged into one.", "type", None),
+    MATCH_WAIT_SECONDS: ("histogram", "How long players waited in the matchmaking queue for a game.", None, PHASE_BUCKETS),
+    SOCKET_WRITES: ("counter", "sendmsg() calls writing frames to client sockets.", None, None),
+    FRAMES_PER_WRITE: ("histogram", "Frames each writer wake-up sent together (see write coalescing).", None, COUNT_BUCKETS),
+}
+
+# ------------------------- Per-Thread Shards ------------------------- #
+_local = threading.local()
+_shards = []                   # (thread, counters, histograms) of every thread that recorded something.
+_retired = ({}, {})            # Totals of threads that have ended.
+_shards_lock = threading.Lock()
+_shards_created = 0
+
+def _shard():
+    """
+    Returns the calling thread's (counters, histograms) dictionaries, creating them on first use.
+    Counters map (name, label) to a number; histograms map (name, label) to per-bucket counts
+    followed by the sum and the number of observations.
+    """
+    global _shards_created
+    counters, histograms = {}, {}
+    _local.counters = counters
+    _local.histograms = histograms
+    with _shards_lock:
+        _shards.append((threading.current_thread(), counters, histograms))
+        _shards_created += 1
+        if _shards_created % 256 == 0:
+            _retire_finished()  # Threads come and go with connections in threaded mode.
+    return counters, histograms
+
+def _retire_finished():
+    # Folds the values of finished threads into _retired (called with _shards_lock held).
+    alive = []
+    for shard in _shards:
+        if shard[0].is_alive():
+            alive.append(shard)
+        else:
+            _merge(_retired, shard[1:])
+    _shards[:] = alive
+
+def _merge(into, shard):
+    counters, histograms = shard
+    # Copying with list() runs without releasing the GIL, so it is safe while the owner keeps counting.
+    for key, value in list(counters.items()):
+        into[0][key] = into[0].get(key, 0) + value
+    for key, values in list(histograms.items()):
+        total = into[1].get(key)
+        if total is None:
+            into[1][key] = list(values)
+        else:
+            for i, value in enumerate(list(values)):
+                total[i] += value
+
+def count(name, label=None, amount=1):
+    """
+    Adds 'amount' to a counter (or a gauge, which may go down) for the given label value.
+    """
+    try:
+        counters = _local.counters
+    except AttributeError:
+        counters = _shard()[0]
+    key = (name, label)
+    counters[key] = counters.get(key, 0) + amount
+
+def observe(name, label, value):
+    """
+    Records one observation (in seconds) in a histogram for the given label value.
+    """
+    try:
+        histograms = _local.histograms
+    except AttributeError:
+        histograms = _shard()[1]
+    key = (name, label)
+    values = histograms.get(key)
+    buckets = DEFINITIONS[name][3]
+    if values is None:
+        values = histograms[key] = [0] * (len(buckets) + 3)  # Buckets, +Inf, sum, count.
+    values[bisect.bisect_left(buckets, value)] += 1
+    values[-2] += value
+    values[-1] += 1
+
+class TimedLock:
+    """
+    Wraps a lock and records in the histogram 'name' how long acquiring it had to wait.
+    An uncontended acquire only costs one extra non-blocking attempt and records nothing.
+    """
+    __slots__ = ("name", "lock")
+
+    def __init__(self, name, lock):
+        self.name = name
+        self.lock = lock
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        observe(self.name, None, time.perf_counter() - start)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+# ------------------------- Exposition ------------------------- #
+def _labels(label_name, label, extra=""):
+    parts = []
+    if label_name is not None and label is not None:
+        value = str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{label_name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _totals():
+    # Adds up the values of every thread: (counters, histograms).
+    totals = ({}, {})
+    with _shards_lock:
+        _retire_finished()
+        _merge(totals, _retired)
+        for shard in _shards:
+            _merge(totals, shard[1:])
+    return totals
+
+def histogram_totals(name):
+    """
+    Returns label -> per-bucket counts, sum and count (see observe) of one histogram, over all threads.
+    """
+    return {label: values for (metric, label), values in _totals()[1].items() if metric == name}
+
+def render():
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    totals = _totals()
+    lines = []
+    for name, (kind, help_text, label_name, buckets) in DEFINITIONS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind != "histogram":
+            samples = sorted(((label, value) for (metric, label), value in totals[0].items() if metric == name),
+                             key=lambda item: str(item[0]))
+            if not samples and label_name is None:
+                samples = [(None, 0)]
+            for label, value in samples:
+                lines.append(f"{name}{_labels(label_name, label)} {value}")
+            continue
+        for (metric, label), values in sorted(totals[1].items(), key=lambda item: str(item[0][1])):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, value in zip(buckets + ("+Inf",), values):
+                cumulative += value
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(label_name, label, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(label_name, label)} {values[-2]:.6f}")
+            lines.append(f"{name}_count{_labels(label_name, label)} {values[-1]}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Answers every GET with the current metrics.
+    """
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a line in the server log.
+
+def start_endpoint(host, port):
+    """
+    Serves the metrics over HTTP on host:port from a background thread (e.g. for Prometheus to scrape).
+    """
+    endpoint = ThreadingHTTPServer((host, port), MetricsHandler)
+    endpoint.daemon_threads = True
+    threading.Thread(target=endpoint.serve_forever, daemon=True).start()
+    print(f"[METRICS] Serving Prometheus metrics on http://{host or '0.0.0.0'}:{port}/metrics")
+    return endpoint
@@ -0,0 +1,144 @@
+import os              # Names the profile files after the process id.
+import signal          # Lets an operator ask a running server for timings or a profile.
+import sys             # Provides the stacks of all running threads.
+import threading       # Runs the sampler in the background.
+import time            # Paces the samples and names the profile files.
+
+import metrics
+
+# ------------------------- Handler Timings ------------------------- #
+# Message handlers, decoding, disconnect cleanup and phase entry actions record their run time in
+# the metrics.HANDLER_SECONDS histogram (always on, see metrics.py). SIGUSR1 prints a summary.
+
+def handler_report():
+    """
+    Returns a table of the recorded handler timings, slowest total first. Percentiles are the upper
+    bound of the histogram bucket they fall in.
+    """
+    buckets = metrics.DEFINITIONS[metrics.HANDLER_SECONDS][3]
+    rows = []
+    for handler, values in metrics.histogram_totals(metrics.HANDLER_SECONDS).items():
+        count, total = values[-1], values[-2]
+        if not count:
+            continue
+        percentiles = []
+        for fraction in (0.5, 0.99, 0.999):
+            remaining = fraction * count
+            for bound, value in zip(buckets + (float("inf"),), values):
+                remaining -= value
+                if remaining <= 0:
+                    percentiles.append(bound)
+                    break
+        rows.append((total, handler, count, percentiles))
+    lines = [f"[PROFILE] Handler timings of process {os.getpid()}:",
+             f"{'handler':<16} {'count':>9} {'total ms':>10} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'p999 us':>9}"]
+    for total, handler, count, percentiles in sorted(rows, key=lambda row: -row[0]):
+        cells = " ".join(f"{'>1s' if bound == float('inf') else f'<{bound * 1e6:g}':>9}" for bound in percentiles)
+        lines.append(f"{handler:<16} {count:>9} {total * 1e3:>10.1f} {total / count * 1e6:>9.1f} {cells}")
+    return "\n".join(lines)
+
+def dump_handler_timings(signum=None, frame=None):
+    print(handler_report(), flush=True)
+
+# ------------------------- Sampling Profiler ------------------------- #
+# Every SAMPLE_INTERVAL seconds the sampler looks at the Python stack of every other thread and counts
+# each distinct stack. The result is written in the collapsed-stack format read by flamegraph.pl,
+# speedscope and similar tools: one line per stack, root frame first, frames separated by ';',
+# followed by the number of samples. Threads waiting for work (see IDLE_FRAMES) are skipped, so the
+# profile shows where the server spends CPU time rather than where its threads sleep.
+
+PROFILE_SECONDS = 10       # Length of a profile started by SIGUSR2.
+SAMPLE_INTERVAL = 0.005    # Seconds between samples (200 per second).
+profile_dir = "."          # Where profile files are written.
+
+# (file name, function) of the innermost frame of a thread that is blocked waiting.
+IDLE_FRAMES = {
+    ("threading.py", "wait"),         # Connection writers and the scheduler waiting on their condition.
+    ("framing.py", "recv_into"),      # Threaded readers waiting for data.
+    ("socket.py", "accept"),          # The threaded server's accept loop.
+    ("selectors.py", "select"),       # An idle asyncio event loop.
+    ("socketserver.py", "serve_forever"),  # The metrics endpoint.
+}
+
+profiler_lock = threading.RLock()  # Reentrant: a second SIGUSR2 may arrive while the handler holds it.
+profiler = None  # The running SamplingProfiler, if any.
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads for a fixed time in a background thread and then writes them out.
+    """
+    def __init__(self, seconds, interval=SAMPLE_INTERVAL, directory=None):
+        self.seconds = seconds
+        self.interval = interval
+        self.path = os.path.join(directory or profile_dir,
+                                 f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        self.stacks = {}   # Collapsed stack -> samples.
+        self.labels = {}   # Code object -> frame label (formatted once per function).
+        self.samples = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self):
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack = ";".join(reversed(labels))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        global profiler
+        deadline = time.monotonic() + self.seconds
+        next_sample = time.monotonic()
+        while next_sample < deadline:
+            self._sample()
+            next_sample += self.interval
+            time.sleep(max(0.0, next_sample - time.monotonic()))
+        try:
+            with open(self.path, "w") as f:
+                for stack, count in sorted(self.stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            print(f"[PROFILE] Wrote {self.samples} samples ({len(self.stacks)} stacks) to {self.path}", flush=True)
+        except OSError as e:
+            print(f"[PROFILE] Could not write {self.path}: {e}", flush=True)
+        finally:
+            with profiler_lock:
+                profiler = None
+
+def start_profile(seconds=None):
+    """
+    Starts a sampling profile of 'seconds' (PROFILE_SECONDS by default) unless one is already running.
+    Returns the SamplingProfiler, or None if one was running.
+    """
+    global profiler
+    with profiler_lock:
+        if profiler is not None:
+            print(f"[PROFILE] A profile is already being written to {profiler.path}", flush=True)
+            return None
+        started = profiler = SamplingProfiler(seconds or PROFILE_SECONDS)
+        started.thread.start()
+    print(f"[PROFILE] Sampling every thread for {started.seconds:g}s", flush=True)
+    return started
+
+def install_signal_handlers():
+    """
+    SIGUSR1 prints the handler timings; SIGUSR2 starts a sampling profile (POSIX only).
+    Must be called from the main thread.
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    signal.signal(signal.SIGUSR1, dump_handler_timings)
+    signal.signal(signal.SIGUSR2, lambda signum, frame: start_profile())
@@ -0,0 +1,334 @@
+import json            # Used for encoding and decoding JSON messages.
+import os              # Used to locate the protocol file next to this module.
+import struct          # Packs the length prefix and floats of binary frames.
+from json.encoder import encode_basestring_ascii as _json_string  # Writes a JSON string exactly like json.dumps.
+
+# Load the messaging protocol definition from a JSON file.
+# This file contains message types and their expected fields.
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "message_protocol.json"), "r") as f:
+    MESSAGE_TYPES = json.load(f)
+
+# ------------------------- Wire Formats ------------------------- #
+# WIRE_JSON is the default: one JSON object per line.
+# WIRE_BINARY is negotiated with a HELLO message and uses length-prefixed frames:
+#   4-byte big-endian payload length, then the payload:
+#   1 byte message type id (its position in message_protocol.json),
+#   then one tagged value per field, in the order the protocol file lists them.
+
+WIRE_JSON = "json"
+WIRE_BINARY = "binary"
+WIRE_FORMATS = (WIRE_JSON, WIRE_BINARY)
+
+FRAME_HEADER = struct.Struct("!I")   # Length prefix of a binary frame.
+MAX_FRAME_SIZE = 1024 * 1024         # Larger binary frames are treated as a protocol error.
+FLOAT = struct.Struct("!d")
+
+# Tags identifying the type of each value in a binary payload.
+TAG_NONE, TAG_INT, TAG_STR, TAG_LIST, TAG_TRUE, TAG_FALSE, TAG_FLOAT, TAG_JSON = range(8)
+
+# Python types accepted for each field type a message type may declare in message_protocol.json
+# ("any" accepts everything). Any field may be null unless the type lists it as required.
+FIELD_TYPES = {"str": (str,), "int": (int,), "list": (list,), "bool": (bool,), "any": None}
+
+class ProtocolError(Exception):
+    """
+    Raised when a peer sends data that cannot be framed (e.g. an oversized binary frame).
+    """
+
+class InvalidMessage(ValueError):
+    """
+    Raised for a well-formed frame that breaks the protocol: no known type, a missing required
+    field or a field of the wrong type. The connection stays usable.
+    """
+
+# --------------------------- Message Helper Functions --------------------------- #
+class Message:
+    """
+    A message waiting to be sent: its codec plus the field values from create_message, in wire order.
+    It is serialized lazily, at most once per wire format, and the encoded frame is cached,
+    so one Message broadcast to many clients costs one encoding per format in use.
+    """
+    __slots__ = ("type", "codec", "values", "frames")
+
+    def __init__(self, codec, values):
+        self.type = codec.name
+        self.codec = codec
+        self.values = values
+        self.frames = {}  # Wire format -> encoded frame.
+
+    def encode(self, wire_format=WIRE_JSON):
+        frame = self.frames.get(wire_format)
+        if frame is None:
+            if wire_format == WIRE_BINARY:
+                frame = self.codec.encode_binary(self.values)
+            else:
+                frame = self.codec.encode_json(self.values)
+            self.frames[wire_format] = frame
+        return frame
+
+def create_message(message_type, **kwargs):
+    """
+    Creates a message based on a message type and additional keyword arguments.
+    The fields expected for the type come from message_protocol.json and are filled from kwargs
+    (missing ones are null) by the type's codec.
+    Call encode() on the result for the bytes to put on the wire: a newline-terminated
+    JSON object by default, or a length-prefixed binary frame.
+    """
+    return CODECS[message_type].create(kwargs)
+
+def decode_frame(frame, wire_format=WIRE_JSON):
+    """
+    Decodes one frame (bytes or a memoryview from framing.FrameReader) into a validated message
+    dictionary holding every field of its type (missing optional fields are None).
+    Returns None for blank lines or frames that cannot be decoded at all, and raises InvalidMessage
+    for a decodable message that breaks the protocol (see validate_message).
+    """
+    try:
+        if wire_format == WIRE_BINARY:
+            message = decode_binary(frame)
+        else:
+            text = str(frame, "utf-8")
+            if not text.strip():
+                return None
+            message = json.loads(text)
+    except InvalidMessage:
+        raise
+    except Exception:
+        return None
+    return validate_message(message)
+
+def validate_message(message):
+    """
+    Checks a decoded message against its type's entry in message_protocol.json and fills in
+    the optional fields it left out. Returns the message, or raises InvalidMessage.
+    """
+    if not isinstance(message, dict):
+        raise InvalidMessage("a message must be a JSON object")
+    if "type" not in message:
+        raise InvalidMessage("missing message type")
+    if not isinstance(message["type"], str):
+        raise InvalidMessage("the message type must be a string")  # Lists and objects cannot even be looked up.
+    codec = CODECS.get(message["type"])
+    if codec is None:
+        raise InvalidMessage(f"unknown message type {message['type']!r}")
+    return codec.check(message)
+
+# --------------------------- Binary Encoding --------------------------- #
+def _write_varint(out, value):
+    # Unsigned LEB128: 7 bits per byte, high bit set on every byte but the last.
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+MAX_VARINT_BYTES = 10  # Enough for 64 bits; longer varints are rejected rather than decoded.
+
+def _read_varint(data, pos):
+    value = data[pos]
+    pos += 1
+    if value < 0x80:
+        return value, pos
+    value &= 0x7F
+    shift = 7
+    while shift < 7 * MAX_VARINT_BYTES:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+    raise InvalidMessage(f"varint longer than {MAX_VARINT_BYTES} bytes")
+
+def _read_length(data, pos):
+    # A string or JSON length, or a list's item count; each item takes at least one byte,
+    # so none of them can be larger than what is left of the payload.
+    length, pos = _read_varint(data, pos)
+    if length > len(data) - pos:
+        raise InvalidMessage("length larger than the rest of the frame")
+    return length, pos
+
+def _write_value(out, value):
+    if value is None:
+        out.append(TAG_NONE)
+    elif value is True:
+        out.append(TAG_TRUE)
+    elif value is False:
+        out.append(TAG_FALSE)
+    elif isinstance(value, str):
+        encoded = value.encode()
+        out.append(TAG_STR)
+        _write_varint(out, len(encoded))
+        out += encoded
+    elif isinstance(value, int) and -(1 << 63) <= value < (1 << 63):
+        out.append(TAG_INT)
+        _write_varint(out, (value << 1) ^ (value >> 63))  # Zigzag, so small negative numbers stay short.
+    elif isinstance(value, (list, tuple)):
+        out.append(TAG_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _write_value(out, item)
+    elif isinstance(value, float):
+        out.append(TAG_FLOAT)
+        out += FLOAT.pack(value)
+    else:
+        # Anything else (e.g. a dictionary or a huge integer) travels as embedded JSON.
+        encoded = json.dumps(value).encode()
+        out.append(TAG_JSON)
+        _write_varint(out, len(encoded))
+        out += encoded
+
+def _read_value(data, pos):
+    tag = data[pos]
+    pos += 1
+    if tag == TAG_STR:
+        length, pos = _read_length(data, pos)
+        return str(data[pos:pos + length], "utf-8"), pos + length
+    if tag == TAG_NONE:
+        return None, pos
+    if tag == TAG_INT:
+        zigzag, pos = _read_varint(data, pos)
+        return (zigzag >> 1) ^ -(zigzag & 1), pos
+    if tag == TAG_LIST:
+        count, pos = _read_length(data, pos)
+        items = []
+        for _ in range(count):
+            item, pos = _read_value(data, pos)
+            items.append(item)
+        return items, pos
+    if tag == TAG_TRUE:
+        return True, pos
+    if tag == TAG_FALSE:
+        return False, pos
+    if tag == TAG_FLOAT:
+        return FLOAT.unpack_from(data, pos)[0], pos + FLOAT.size
+    if tag == TAG_JSON:
+        length, pos = _read_length(data, pos)
+        return json.loads(bytes(data[pos:pos + length])), pos + length
+    raise ValueError(f"unknown value tag {tag}")
+
+def _write_str(out, value):
+    # Fast path for fields declared as strings; anything else is written as usual.
+    if value.__class__ is str:
+        encoded = value.encode()
+        out.append(TAG_STR)
+        _write_varint(out, len(encoded))
+        out += encoded
+    else:
+        _write_value(out, value)
+
+def encode_binary(message_type, fields):
+    """
+    Encodes a message as a length-prefixed binary frame (see the Wire Formats notes above).
+    """
+    codec = CODECS[message_type]
+    return codec.encode_binary(tuple(map(fields.get, codec.fields)))
+
+def decode_binary(payload):
+    """
+    Decodes the payload of a binary frame (without its length prefix) into a message dictionary.
+    """
+    if payload[0] >= len(CODECS_BY_ID):
+        raise InvalidMessage(f"unknown message type id {payload[0]}")
+    return CODECS_BY_ID[payload[0]].decode_binary(payload)
+
+# --------------------------- Message Codecs --------------------------- #
+# Each entry of message_protocol.json describes one message type:
+#   fields   - field names, in the order they appear in binary frames
+#   types    - optional field -> type name (a key of FIELD_TYPES; "any" when left out)
+#   required - optional list of fields that must be present and not null
+# At startup every entry is turned into a MessageCodec whose functions are specialized for that
+# type (its field tuple, JSON key text and value writers are bound in), so building, encoding,
+# decoding and validating a message never looks anything up in the protocol file again.
+
+def _json_value_encoder(type_name):
+    """
+    Returns the function writing one JSON value of a field declared as 'type_name'.
+    The fast paths produce exactly what json.dumps would.
+    """
+    if type_name == "str":
+        return lambda value: _json_string(value) if value.__class__ is str else json.dumps(value)
+    if type_name == "int":
+        return lambda value: repr(value) if value.__class__ is int else json.dumps(value)
+    return json.dumps
+
+class MessageCodec:
+    """
+    Builder, encoders, decoder and validator for one message type, generated from its protocol entry.
+    """
+    __slots__ = ("name", "type_id", "fields", "create", "encode_json", "encode_binary", "decode_binary", "check")
+
+    def __init__(self, name, type_id, spec):
+        self.name = name
+        self.type_id = type_id
+        self.fields = fields = tuple(spec["fields"])
+        types = spec.get("types", {})
+        required = set(spec.get("required", []))
+        for field in set(types) | required:
+            if field not in fields:
+                raise ValueError(f"{name}: '{field}' is not one of its fields")
+        for type_name in types.values():
+            if type_name not in FIELD_TYPES:
+                raise ValueError(f"{name}: unknown field type '{type_name}'")
+        codec = self
+
+        def create(kwargs):
+            return Message(codec, tuple(map(kwargs.get, fields)))
+
+        # JSON: the text before each value is fixed, e.g. ', "message": '.
+        json_head = '{"type": ' + json.dumps(name)
+        json_parts = tuple((f", {json.dumps(field)}: ", _json_value_encoder(types.get(field)))
+                           for field in fields)
+
+        def encode_json(values):
+            text = json_head
+            for (key, write_value), value in zip(json_parts, values):
+                text += key + write_value(value)
+            return (text + "}\n").encode()
+
+        # Binary: a placeholder for the length prefix and the type id, then one value per field.
+        binary_head = bytes(FRAME_HEADER.size) + bytes([type_id])
+        writers = tuple(_write_str if types.get(field) == "str" else _write_value for field in fields)
+
+        def encode_binary(values):
+            out = bytearray(binary_head)
+            for write_value, value in zip(writers, values):
+                write_value(out, value)
+            FRAME_HEADER.pack_into(out, 0, len(out) - FRAME_HEADER.size)
+            return bytes(out)
+
+        def decode_binary(payload):
+            message = {"type": name}
+            pos = 1
+            for field in fields:
+                message[field], pos = _read_value(payload, pos)
+            return message
+
+        # Only fields with a declared type or marked required need looking at:
+        # (field, accepted Python types or None for any, required, declared type name)
+        checks = tuple((field, FIELD_TYPES[types.get(field, "any")], field in required, types.get(field, "any"))
+                       for field in fields if field in required or types.get(field, "any") != "any")
+        field_count = len(fields) + 1  # A complete message also holds its "type".
+
+        def check(message):
+            for field, accepted, is_required, type_name in checks:
+                value = message.get(field)
+                if value is None:
+                    if is_required:
+                        raise InvalidMessage(f"{name} needs '{field}'")
+                elif accepted is not None and value.__class__ not in accepted:
+                    raise InvalidMessage(f"{name} field '{field}' must be of type {type_name}")
+            if len(message) != field_count:
+                # A JSON message may leave optional fields out; handlers always find every field.
+                for field in fields:
+                    message.setdefault(field, None)
+            return message
+
+        self.create = create
+        self.encode_json = encode_json
+        self.encode_binary = encode_binary
+        self.decode_binary = decode_binary
+        self.check = check
+
+# Message type ids are positions in message_protocol.json, so new types go at the end of the file.
+CODECS_BY_ID = [MessageCodec(name, type_id, spec) for type_id, (name, spec) in enumerate(MESSAGE_TYPES.items())]
+CODECS = {codec.name: codec for codec in CODECS_BY_ID}  # Message type name -> codec.
@@ -0,0 +1,110 @@
+"""
+Aggregate statistics over the rounds recorded with server.py --analytics-file, for tuning the
+discussion time, the voting time and the topic list.
+
+Each column of each block is loaded with one numpy.frombuffer call and every statistic is computed
+with whole-array operations (masks, bincount, percentiles), so millions of rounds take a fraction
+of a second and memory stays at a few dozen bytes per round.
+
+Usage: python round_stats.py FILE [FILE ...] [--min-rounds N]
+(several files, e.g. the FILE.worker-N files of a multi-process server, are combined.)
+"""
+import argparse        # Parses the tool's options.
+import sys             # Exits with a hint when NumPy is missing.
+
+try:
+    import numpy as np  # Vectorized column operations.
+except ImportError:
+    sys.exit("round_stats.py needs NumPy: pip install numpy")
+
+import analytics
+
+def load(paths):
+    """
+    Reads the rounds of every file into one array per column. Topic indexes are remapped
+    from each block's topic list to the returned list of all topics.
+    """
+    parts = {name: [] for name, _typecode in analytics.COLUMNS}
+    all_topics = {}
+    for path in paths:
+        for header, data in analytics.read_blocks(path):
+            for name, typecode, _length in header["columns"]:
+                parts[name].append(np.frombuffer(data[name], dtype=np.dtype(typecode).newbyteorder("<")))
+            remap = np.array([all_topics.setdefault(topic, len(all_topics)) for topic in header["topics"]], dtype=np.uint16)
+            parts["topic"][-1] = remap[parts["topic"][-1]]
+    columns = {name: np.concatenate(chunks) if chunks else np.zeros(0) for name, chunks in parts.items()}
+    return columns, sorted(all_topics, key=all_topics.get)
+
+def rate(hits, total):
+    # Element-wise hits / total, NaN where there is nothing to divide.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, hits / np.maximum(total, 1), np.nan)
+
+def grouped(groups, size, rounds):
+    """
+    Per group (groups[i] is round i's group, from 0 to size - 1): rounds, impostor caught (voted out),
+    rounds without votes, share of players voting, impostor wins among games ending that round and
+    median seconds to the last vote.
+    """
+    def per_group(weights):
+        return np.bincount(groups, weights=weights, minlength=size)
+    count = np.bincount(groups, minlength=size)
+    caught = per_group(rounds["eliminated"] == analytics.ELIMINATED_IMPOSTOR)
+    silent = per_group(rounds["votes"] == 0)
+    turnout = rate(per_group(rounds["votes"]), per_group(rounds["players"]))
+    ended = per_group(rounds["outcome"] != analytics.OUTCOME_NEXT_ROUND)
+    wins = rate(per_group(rounds["outcome"] == analytics.OUTCOME_IMPOSTOR), ended)
+    # Medians: sort by (group, seconds) once, then take the middle of each group's run.
+    voted = ~np.isnan(rounds["last_vote"])
+    seconds, voted_groups = rounds["last_vote"][voted], groups[voted]
+    order = np.lexsort((seconds, voted_groups))
+    voted_count = np.bincount(voted_groups, minlength=size)
+    middle = np.cumsum(voted_count) - voted_count + voted_count // 2
+    median = np.full(size, np.nan)
+    has_votes = voted_count > 0
+    median[has_votes] = seconds[order][middle[has_votes]]
+    return count, rate(caught, count), rate(silent, count), turnout, wins, median
+
+def print_table(title, labels, groups, rounds, min_rounds):
+    count, caught, silent, turnout, wins, median = grouped(groups, len(labels), rounds)
+    print(f"\n{title:<28} {'rounds':>9} {'caught':>8} {'no vote':>8} {'turnout':>8} {'imp win':>8} {'last vote':>10}")
+    for index in np.argsort(-count, kind="stable"):
+        if count[index] < min_rounds:
+            continue
+        cells = (caught[index], silent[index], turnout[index], wins[index])
+        print(f"{labels[index]:<28.28} {count[index]:>9} " +
+              " ".join(f"{cell:>8.1%}" if not np.isnan(cell) else f"{'-':>8}" for cell in cells) +
+              (f" {median[index]:>9.1f}s" if not np.isnan(median[index]) else f" {'-':>10}"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate statistics over recorded game rounds")
+    parser.add_argument("files", nargs="+", help="files written by server.py --analytics-file")
+    parser.add_argument("--min-rounds", type=int, default=1, help="hide groups with fewer rounds (default: 1)")
+    args = parser.parse_args()
+    rounds, topics = load(args.files)
+    total = len(rounds["time"])
+    if not total:
+        print("No rounds recorded.")
+        return
+    ended = rounds["outcome"] != analytics.OUTCOME_NEXT_ROUND
+    first_vote, last_vote = rounds["first_vote"], rounds["last_vote"]
+    early = rounds["voting_seconds"] < rounds["voting_time"] - 0.05
+    print(f"{total} rounds, {int(ended.sum())} games ended; "
+          f"impostor caught in {np.mean(rounds['eliminated'] == analytics.ELIMINATED_IMPOSTOR):.1%} of rounds, "
+          f"impostor won {rate(np.sum(rounds['outcome'] == analytics.OUTCOME_IMPOSTOR), ended.sum()):.1%} of games")
+    print(f"voting closed early (everyone voted) in {early.mean():.1%} of rounds; no votes in {np.mean(rounds['votes'] == 0):.1%}")
+    if not np.isnan(first_vote).all():
+        percentiles = (50, 90, 99)
+        print("seconds from voting start   " + "  ".join(f"{f'p{p}':>6}" for p in percentiles))
+        for label, column in (("first vote", first_vote), ("last vote", last_vote)):
+            print(f"  {label:<26}" + "  ".join(f"{value:>6.1f}" for value in np.nanpercentile(column, percentiles)))
+    print_table("topic", topics, rounds["topic"].astype(np.intp), rounds, args.min_rounds)
+    players, groups = np.unique(rounds["players"], return_inverse=True)
+    print_table("players", [str(value) for value in players], groups, rounds, args.min_rounds)
+    settings, groups = np.unique(np.stack((rounds["discussion_time"], rounds["voting_time"]), axis=1),
+                                 axis=0, return_inverse=True)
+    print_table("discussion / voting time", [f"{discussion:g}s / {voting:g}s" for discussion, voting in settings],
+                groups.ravel(), rounds, args.min_rounds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import heapq           # Keeps the pending timers ordered by deadline.
+import itertools       # Provides a counter that breaks ties between timers with the same deadline.
+import threading       # Runs the single timer thread and guards the heap.
+import time            # Provides the monotonic clock the deadlines are measured on.
+
+class Timer:
+    """
+    A callback scheduled with Scheduler.call_later. cancel() stops it from running;
+    a cancelled timer simply stays in the heap until its deadline comes up and is skipped.
+    """
+    __slots__ = ("deadline", "callback", "args", "cancelled")
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    """
+    One thread running the timers of every game session in this process, kept in a heap by deadline.
+    Waiting for a timer costs a heap entry instead of a sleeping thread, so any number of games
+    can be in a timed phase at once. Callbacks run on the scheduler thread one after another and
+    must not block; sends only queue frames for the connection writers, so they never do.
+    """
+    def __init__(self):
+        self.heap = []                       # (deadline, sequence number, Timer) entries.
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None                   # Started by the first call_later (after any fork).
+
+    def call_later(self, delay, callback, *args):
+        """
+        Runs callback(*args) on the scheduler thread after 'delay' seconds. Returns the Timer.
+        """
+        timer = Timer(time.monotonic() + delay, callback, args)
+        with self.condition:
+            heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            # Wake the thread in case the new timer is due before the one it is waiting for.
+            self.condition.notify()
+        return timer
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    now = time.monotonic()
+                    if self.heap and self.heap[0][0] <= now:
+                        _deadline, _sequence, timer = heapq.heappop(self.heap)
+                        break
+                    self.condition.wait(self.heap[0][0] - now if self.heap else None)
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                print(f"[ERROR] Timer callback {getattr(timer.callback, '__qualname__', timer.callback)} failed: {e}")
+
+# Shared by every session of this process.
+scheduler = Scheduler()
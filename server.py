@@ -1,466 +1,472 @@
 import socket          # Provides access to the BSD socket interface for networking.
 import threading       # Enables concurrent execution via threads.
-import json            # Used for encoding and decoding JSON messages.
-import random          # Used for random selections (e.g., choosing the impostor or a chat topic).
-import math            # Used to perform mathematical operations (e.g., calculating the number of rooms).
-import time            # Provides time-related functions (e.g., sleep for delays).
+import asyncio         # Event loop used by the single-threaded asyncio server mode.
+import argparse        # Parses the command line options (server mode, host and port).
+import os              # Used to report the worker process id in multi-process mode.
+import time            # Times the message handlers (see profiling.py).
 
-# Load the messaging protocol definition from a JSON file.
-# This file contains message types and their expected fields.
-with open("message_protocol.json", "r") as f:
-    MESSAGE_TYPES = json.load(f)
+import sharding
+import analytics
+import game_session
+import heartbeat
+import flood
+import journal
+import metrics
+import profiling
 
-# ------------------------- Shared Data Structures ------------------------- #
-# Global data structures to keep track of clients, game state, and chat rooms.
+from protocol import create_message, decode_frame, InvalidMessage, WIRE_FORMATS, WIRE_JSON
+from framing import FrameReader
+from connection import ThreadedConnection, AsyncConnection, configure_outbound, configure_writes, SLOW_CONSUMER_POLICIES
+from game_session import join_session, resume_session, leave_session, session_for
 
-clients = {}           # Dictionary mapping a socket to its associated player_name.
-ready_clients = set()  # Set of sockets that have indicated they are ready to play.
-clients_room_ids = {}  # Dictionary mapping a socket to its current room identifier 
-                       # (could be "lobby" or an integer representing a specific room).
+# --------------------------- Client Handler Functions --------------------------- #
+def handle_message(conn, message):
+    """
+    Performs the action for a single decoded message received from 'conn'.
+    This is shared by the threaded and the asyncio server modes; 'conn' is a Connection whose
+    send() only queues the frame for that client's writer, so handling never waits on the network.
+    Messages over their sender's rate limit are dropped or merged first (see flood.py).
+    """
+    metrics.count(metrics.MESSAGES_RECEIVED, message["type"])
+    if flood.allow(conn, message, dispatch_message):
+        dispatch_message(conn, message)
 
-lobby_clients = []     # List of sockets that are currently in the lobby waiting for game start.
-rooms = {}             # Dictionary mapping room_id (integer) to a list of sockets assigned to that room.
+def dispatch_message(conn, message):
+    """
+    Types in SERVER_HANDLERS are handled here (JOIN_ROOM and RESUME route the connection to a game session);
+    everything else is handled by the connection's session. The time taken is recorded per message type.
+    """
+    start = time.perf_counter()
+    try:
+        handler = SERVER_HANDLERS.get(message["type"])
+        if handler is not None:
+            handler(conn, message)
+            return
+        session = session_for(conn)
+        if session is None:
+            conn.send(create_message("INFO", message="Join a game first."))
+            return
+        session.handle_message(conn, message)
+    finally:
+        metrics.observe(metrics.HANDLER_SECONDS, message["type"], time.perf_counter() - start)
 
-impostor_for_game = None  # Variable to store the socket chosen to be the impostor.
-game_stage = 0            # Variable representing the current stage of the game.
-DISCUSSION_TIME = 30      # Discussion time in seconds for each chat room phase.
-votes = {}                # Dictionary mapping a voter (player_name) to the vote target (player_name).
-round_active = False      # Boolean flag indicating if a discussion round is currently active.
-game_running = False      # Boolean flag indicating if the game is currently running.
+def handle_join_room(conn, message):
+    """
+    Registers a new client in the lobby of the requested session.
+    """
+    join_session(conn, message["session_id"], message["player_name"])
 
-# A re-entrant lock is used for nested lock acquisitions in multi-threaded sections
-data_lock = threading.RLock()
+def handle_resume(conn, message):
+    """
+    Gives a reconnecting client its seat back (see GameSession.resume_client).
+    """
+    resume_session(conn, message["session_id"], message["token"])
 
-# List of possible discussion topics to assign to normal players.
-topicList = [
-    "food", "cars", "anime", "movies", "school", "trains", "shervin", "IEEE",
-    "the state of vancouver's economy in chinese", "clothing", "canada", "computer parts", "games", "art"
-]
+def handle_ping(conn, message):
+    """
+    Responds with a PONG (works before joining a session too).
+    """
+    conn.send(create_message("PONG"))
+
+def handle_pong(conn, message):
+    """
+    Answer to a heartbeat PING; receiving it already refreshed the connection's last_seen.
+    """
+
+def handle_hello(conn, message):
+    """
+    Agrees on the wire format before the client joins a game.
+    """
+    negotiate_wire_format(conn, message["encoding"])
+
+def negotiate_wire_format(conn, requested):
+    """
+    Answers a client's HELLO with the wire format both sides will use from now on.
+    The reply still goes out in the old format; everything after it uses the new one.
+    Negotiation is only allowed before JOIN_ROOM, while nothing else can be sending to the client.
+    """
+    if session_for(conn) is not None:
+        conn.send(create_message("INFO", message="The wire format can only be changed before joining a game."))
+        return
+    chosen = requested if requested in WIRE_FORMATS else WIRE_JSON
+    conn.send(create_message("HELLO", encoding=chosen))
+    conn.wire_format = chosen
 
-# --------------------------- Message Helper Functions --------------------------- #
-def create_message(message_type, **kwargs):
-    """
-    Creates a JSON message based on a message type and additional keyword arguments.
-    The message dictionary is constructed by taking the predefined fields
-    for a given type from the MESSAGE_TYPES dictionary, and filling them using kwargs.
-    A newline delimiter is appended to help with message framing.
-    """
-    message = {"type": message_type}
-    # Iterate over each field expected in the message type and populate it.
-    for field in MESSAGE_TYPES[message_type]["fields"]:
-        message[field] = kwargs.get(field)
-    # Convert the dictionary into a JSON formatted string, append a newline, and encode to bytes.
-    return (json.dumps(message) + "\n").encode()
+# Message types handled by the server itself, whatever session (if any) the connection joined.
+SERVER_HANDLERS = {
+    "JOIN_ROOM": handle_join_room,
+    "RESUME": handle_resume,
+    "PING": handle_ping,
+    "PONG": handle_pong,
+    "HELLO": handle_hello,
+}
 
-def parse_message(data):
+def decode_message(conn, frame):
     """
-    Attempts to decode a received data block (bytes) into a JSON object.
-    Returns None if decoding fails.
+    Decodes a frame received from 'conn'. A message that breaks the protocol (unknown type,
+    missing or mistyped field) is answered with an INFO explaining why, and None is returned.
     """
+    start = time.perf_counter()
     try:
-        return json.loads(data.decode())
-    except Exception:
+        return decode_frame(frame, conn.wire_format)
+    except InvalidMessage as e:
+        metrics.count(metrics.MESSAGES_RECEIVED, "invalid")
+        conn.send(create_message("INFO", message=f"Invalid message: {e}."))
         return None
+    finally:
+        metrics.observe(metrics.HANDLER_SECONDS, "decode", time.perf_counter() - start)
 
-def send_with_retry(client, message, retries=3):
+def handle_disconnect(conn):
     """
-    Attempts to send a message to the provided client socket.
-    If the send fails, it retries up to 'retries' times with a small delay in between.
-    Returns True on a successful send and False if all retries fail.
+    Cleans up after a client whose connection has ended: its session holds the player's seat
+    for a resume, or removes them and tells the remaining players that they left.
     """
-    for attempt in range(retries):
-        try:
-            client.send(message)
-            return True
-        except Exception:
-            # If not the last attempt, wait briefly before retrying.
-            if attempt < retries - 1:
-                time.sleep(0.1)
-            else:
-                return False
-
-# --------------------------- Broadcasting Functions --------------------------- #
-def broadcast(message, exclude=None):
-    """
-    Broadcasts a message to every client connected in the 'clients' dictionary, except the 'exclude' socket.
-    If a client fails to receive the message, that client is removed from the list and its socket is closed.
-    """
-    with data_lock:
-        client_snapshot = list(clients.keys())
-    failed_clients = []
-    # Attempt to send the message to each client not equal to 'exclude'
-    for client in client_snapshot:
-        if client != exclude and not send_with_retry(client, message):
-            failed_clients.append(client)
-    with data_lock:
-        # Clean up any clients that failed to receive the message.
-        for client in failed_clients:
-            try:
-                client.close()
-            except Exception:
-                pass
-            clients.pop(client, None)
+    start = time.perf_counter()
+    leave_session(conn)
+    metrics.observe(metrics.HANDLER_SECONDS, "disconnect", time.perf_counter() - start)
+    try:
+        conn.close()  # Close the socket connection.
+    except Exception:
+        pass
 
-def lobby_broadcast(message, exclude=None):
-    """
-    Broadcasts a message to every client in the lobby (lobby_clients list), excluding the specified client if provided.
-    If a client in the lobby fails to receive the message, it gets removed from the lobby list.
-    """
-    with data_lock:
-        lobby_snapshot = list(lobby_clients)
-    failed_clients = []
-    for client in lobby_snapshot:
-        if client != exclude and not send_with_retry(client, message):
-            failed_clients.append(client)
-    with data_lock:
-        # Remove any clients that failed from the lobby_clients list.
-        for client in failed_clients:
-            try:
-                client.close()
-            except Exception:
-                pass
-            if client in lobby_clients:
-                lobby_clients.remove(client)
+def is_foreign(conn, message):
+    """
+    In a multi-process server, tells whether a connection that has not joined a session yet asks
+    (with JOIN_ROOM or RESUME) for a session owned by another worker.
+    """
+    if not sharding.is_sharded() or message.get("type") not in ("JOIN_ROOM", "RESUME") or session_for(conn) is not None:
+        return False
+    return sharding.owner_of(message.get("session_id")) != sharding.worker_index
 
-def room_broadcast(msg, room_id, sender):
-    """
-    Broadcasts a message to all clients in a specified room (rooms[room_id]), excluding the sender.
-    If sending fails for any client, that client is closed and removed from the room.
-    """
-    with data_lock:
-        room_snapshot = list(rooms.get(room_id, []))
-    failed_clients = []
-    for client in room_snapshot:
-        if client != sender and not send_with_retry(client, msg):
-            failed_clients.append(client)
-    with data_lock:
-        for client in failed_clients:
-            try:
-                client.close()
-            except Exception:
-                pass
-            if room_id in rooms and client in rooms[room_id]:
-                rooms[room_id].remove(client)
+def hand_off_connection(conn, message, pending):
+    """
+    Passes a foreign connection (see is_foreign) to the worker owning its session. 'pending' holds
+    the bytes read from the client starting with 'message'. Returns True if the connection now
+    belongs to the other worker. If the handoff fails the client is told so and this worker drops
+    the connection, rather than serving a session that lives on another worker.
+    """
+    if sharding.hand_off(conn, message.get("session_id"), pending):
+        return True
+    conn.send(create_message("INFO", message="That game cannot be reached right now. Try again."))
+    return False
 
-# --------------------------- Client Handler Function --------------------------- #
-def handle_client(conn, addr):
+def handle_client(sock, addr, buffer=b"", wire_format=WIRE_JSON):
     """
-    Function to handle all communication with a connected client.
-    This continuously receives data, processes complete newline-delimited JSON messages,
-    and performs actions based on the message type (e.g., JOIN_ROOM, CHAT, VOTE).
+    Function to handle all communication with a connected client (threaded mode).
+    This continuously receives data into a FrameReader, takes complete frames off it (newline-delimited
+    JSON, or length-prefixed binary once negotiated) and hands each decoded message to handle_message.
+    'buffer' and 'wire_format' carry over what another worker already read and negotiated.
+    Outgoing frames are written by the connection's own writer thread.
     """
-    global game_running
-    player_name = None
-    buffer = ""
+    conn = ThreadedConnection(sock)
+    conn.wire_format = wire_format
+    reader = FrameReader(buffer)
+    handed_off = False
+    metrics.count(metrics.CONNECTIONS_OPEN)
+    heartbeat.configure_keepalive(sock)
+    heartbeat.watch(conn)  # Aborted (waking up recv below) if the client goes silent.
     try:
         while True:
-            # Receive a data chunk from the client.
-            data = conn.recv(1024)
-            # If no data is received, the client has disconnected.
-            if not data:
-                break
-            # Append received data to the buffer (may contain partial messages).
-            buffer += data.decode()
-            # Process each complete JSON message (messages are newline-delimited).
-            while "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                if not line.strip():
-                    continue
-                message = parse_message(line.encode())
+            # Process each complete message received so far.
+            while True:
+                frame = reader.next_frame(conn.wire_format)
+                if frame is None:
+                    break
+                message = decode_message(conn, frame)
                 if not message:
                     continue
-
-                # Identify the type of the message.
-                msg_type = message["type"]
-
-                # Handle JOIN_ROOM messages: Register a new client in the lobby.
-                if msg_type == "JOIN_ROOM":
-                    with data_lock:
-                        if conn not in clients:
-                            player_name = message["player_name"]
-                            clients[conn] = player_name  # Associate connection with player name.
-                            lobby_clients.append(conn)   # Add client to lobby.
-                            clients_room_ids[conn] = "lobby"  # Set client's current room as lobby.
-                    # Send a welcome message to the client.
-                    send_with_retry(conn, create_message("LOBBY_JOINED",
-                                                         message=f"Welcome to the lobby, {player_name}!"))
-                    # Notify all other clients that a new player has joined.
-                    broadcast(create_message("INFO", message=f"{player_name} joined."), exclude=conn)
-
-                # Handle messages to rejoin the lobby.
-                elif msg_type == "JOIN_LOBBY":
-                    with data_lock:
-                        current_room = clients_room_ids.get(conn)
-                        # If the client was in a room, remove them from that room.
-                        if isinstance(current_room, int) and current_room in rooms and conn in rooms[current_room]:
-                            rooms[current_room].remove(conn)
-                        # Ensure client is in the lobby list.
-                        if conn not in lobby_clients:
-                            lobby_clients.append(conn)
-                        clients_room_ids[conn] = "lobby"  # Mark client's room as lobby.
-                    send_with_retry(conn, create_message("LOBBY_JOINED", message="You have rejoined the lobby."))
-
-                # Handle READY messages: Mark clients as ready to start the game.
-                elif msg_type == "READY":
-                    with data_lock:
-                        if game_running:
-                            send_with_retry(conn, create_message("INFO", message="The game is already running."))
-                            continue
-                        ready_clients.add(conn)  # Mark this client as ready.
-                    # Inform all clients that this player is ready.
-                    broadcast(create_message("INFO", message=f"{clients[conn]} is ready."))
-                    with data_lock:
-                        # If all clients are ready, start the game in a new thread.
-                        if len(ready_clients) == len(clients):
-                            threading.Thread(target=start_game, daemon=True).start()
-
-                # Handle JOIN messages for joining a specific room.
-                elif msg_type == "JOIN":
-                    room_id = message.get("room_id")
-                    # Validate that room_id is an integer.
-                    if not isinstance(room_id, int):
-                        send_with_retry(conn, create_message("INFO", message="Invalid room number."))
-                        continue
-                    with data_lock:
-                        if conn in lobby_clients:
-                            lobby_clients.remove(conn)  # Remove client from lobby if present.
-                        if room_id not in rooms:
-                            rooms[room_id] = []  # Initialize the room if it does not exist.
-                        # Check if room is already full (max 2 players per room).
-                        if len(rooms[room_id]) >= 2:
-                            send_with_retry(conn, create_message("INFO", message="Room is full. Choose another."))
-                            continue
-                        rooms[room_id].append(conn)          # Add client to the room.
-                        clients_room_ids[conn] = room_id       # Update client's current room identifier.
-                    send_with_retry(conn, create_message("INFO", message=f"Joined room {room_id}"))
-
-                # Handle CHAT messages: Send the chat to the appropriate room or lobby.
-                elif msg_type == "CHAT":
-                    with data_lock:
-                        room_id = clients_room_ids.get(conn)
-                    content = message.get("message")
-                    sender = clients.get(conn, "Unknown")
-                    if room_id == "lobby":
-                        # Broadcast to everyone in the lobby except the sender.
-                        lobby_broadcast(create_message("INFO", message=f"{sender}: {content}"), exclude=conn)
-                    elif isinstance(room_id, int):
-                        # Broadcast to all members of the room except the sender.
-                        room_broadcast(create_message("INFO", message=f"{sender}: {content}"), room_id, conn)
-                    else:
-                        # Inform client if they are in an invalid room.
-                        send_with_retry(conn, create_message("INFO", message="You're not in a valid room."))
-
-                # Handle PING messages: Respond with a PONG.
-                elif msg_type == "PING":
-                    send_with_retry(conn, create_message("PONG"))
-
-                # Handle VOTE messages: Process a client's vote for a player.
-                elif msg_type == "VOTE":
-                    voter = clients.get(conn)
-                    with data_lock:
-                        # Check if the client has already voted.
-                        if voter in votes:
-                            send_with_retry(conn, create_message("INFO", message="You have already voted."))
-                        else:
-                            target = message.get("target")
-                            # Verify if the target is a valid player by checking the clients dictionary.
-                            if target in list(clients.values()):
-                                votes[voter] = target  # Record the vote.
-                                send_with_retry(conn, create_message("INFO", message=f"You voted for {target}."))
-                            else:
-                                send_with_retry(conn, create_message("INFO", message="Invalid vote target."))
+                if is_foreign(conn, message):
+                    # Served by its owner from now on, or closed below if the handoff failed.
+                    handed_off = hand_off_connection(conn, message, reader.pending())
+                    return
+                handle_message(conn, message)
+            # Receive the next chunk from the client straight into the reader's buffer.
+            # If no data is received, the client has disconnected.
+            received = reader.recv_into(sock)
+            if not received:
+                break
+            conn.last_seen = time.monotonic()
+            metrics.count(metrics.BYTES_RECEIVED, None, received)
     except Exception as e:
         print(f"[ERROR] {e}")
     finally:
-        # Cleanup on client disconnection.
-        with data_lock:
-            if conn in clients:
-                left_name = clients.pop(conn)
-                ready_clients.discard(conn)
-                if conn in lobby_clients:
-                    lobby_clients.remove(conn)
-                current_room = clients_room_ids.get(conn)
-                # Remove client from any room they belong to.
-                if isinstance(current_room, int) and current_room in rooms and conn in rooms[current_room]:
-                    rooms[current_room].remove(conn)
-                # Notify all clients that a player has disconnected.
-                broadcast(create_message("INFO", message=f"{left_name} has disconnected."), exclude=conn)
+        metrics.count(metrics.CONNECTIONS_OPEN, None, -1)
+        heartbeat.unwatch(conn)
+        if handed_off:
+            conn.release()  # The owning worker holds its own copy of the socket.
+        else:
+            # Cleanup on client disconnection.
+            handle_disconnect(conn)
+
+def receive_handoffs():
+    """
+    Threaded mode: adopts connections handed over by other workers, one thread each as usual.
+    """
+    while True:
+        handoff = sharding.receive_handoff()
+        if handoff is None:
+            continue  # A datagram that carried no socket.
+        sock, pending, wire_format = handoff
         try:
-            conn.close()  # Close the socket connection.
-        except Exception:
-            pass
+            addr = sock.getpeername()
+        except OSError:
+            sock.close()  # The client went away while it was being handed over.
+            continue
+        threading.Thread(target=handle_client, args=(sock, addr, pending, wire_format), daemon=True).start()
 
-# --------------------------- Game Functions --------------------------- #
-def broadcast_except_one(common_msg, impostor):
+# --------------------------- Asyncio Server Mode --------------------------- #
+async def handle_async_client(sock, addr, buffer=b"", wire_format=WIRE_JSON):
     """
-    Sends the ASSIGN_ROLE messages to all clients.
-    The impostor receives a different message (with no topic) than other players (who get a common topic).
+    Coroutine counterpart of handle_client used by the asyncio server mode.
+    One of these runs per connection on a single event loop thread instead of one OS thread each.
     """
-    with data_lock:
-        impostor_name = clients.get(impostor)
-        client_snapshot = list(clients.items())
-    if not impostor_name:
-        print("[ERROR] Impostor not found in clients.")
-        return
-    for client, player_name in client_snapshot:
-        if client == impostor:
-            # Notify the impostor of their role.
-            send_with_retry(client, create_message("ASSIGN_ROLE", role="impostor", topic="(none)"))
-            print(f"[ROLE ASSIGNMENT] {player_name} is the impostor.")
+    loop = asyncio.get_running_loop()
+    conn = AsyncConnection(sock, loop)
+    conn.wire_format = wire_format
+    reader = FrameReader(buffer)
+    handed_off = False
+    metrics.count(metrics.CONNECTIONS_OPEN)
+    heartbeat.configure_keepalive(sock)
+    heartbeat.watch(conn)
+    try:
+        while True:
+            while True:
+                frame = reader.next_frame(conn.wire_format)
+                if frame is None:
+                    break
+                message = decode_message(conn, frame)
+                if not message:
+                    continue
+                if is_foreign(conn, message):
+                    # Served by its owner from now on, or closed below if the handoff failed.
+                    handed_off = hand_off_connection(conn, message, reader.pending())
+                    return
+                handle_message(conn, message)
+            # sock_recv_into returns without yielding while data is waiting, so give the
+            # flush tasks of the recipients a turn before reading the next chunk.
+            await asyncio.sleep(0)
+            received = await reader.sock_recv_into(loop, sock)
+            if not received:
+                break
+            conn.last_seen = time.monotonic()
+            metrics.count(metrics.BYTES_RECEIVED, None, received)
+    except Exception as e:
+        print(f"[ERROR] {e}")
+    finally:
+        metrics.count(metrics.CONNECTIONS_OPEN, None, -1)
+        heartbeat.unwatch(conn)
+        if handed_off:
+            conn.release()
         else:
-            # Notify normal players of their role and assign the discussion topic.
-            send_with_retry(client, create_message("ASSIGN_ROLE", role="crewmate", topic=common_msg))
-            print(f"[ROLE ASSIGNMENT] {player_name} is a crewmate.")
+            handle_disconnect(conn)
+        conn.reader_finished()
 
-def start_game():
+def create_listener(host, port):
     """
-    Initiates the game once all players are ready.
-    It randomly selects an impostor, chooses a discussion topic, assigns roles, and begins the discussion phase.
+    Creates the listening socket; workers of a multi-process server share the port through SO_REUSEPORT.
     """
-    global impostor_for_game, game_stage, game_running, round_active
-    with data_lock:
-        current_clients = list(clients.keys())
-        if not current_clients:
-            return
-        # Select an impostor randomly if a game is not already in progress.
-        if not game_running:
-            impostor_for_game = random.choice(current_clients)
-        game_stage = 1  # Set the game stage to the beginning.
-        game_running = True  # Mark the game as running.
-        topic = random.choice(topicList)  # Choose a random discussion topic.
-    broadcast_except_one(topic, impostor_for_game)
-    with data_lock:
-        player_names = list(clients.values())
-    # Notify all clients that the game has started and list the players.
-    broadcast(create_message("GAME_STARTED", players=player_names))
-    max_rooms = math.ceil(len(current_clients) / 2)  # Calculate maximum available rooms.
-    for conn in current_clients:
-        # Inform players about how to join a discussion room.
-        send_with_retry(conn, create_message("INFO", message=f"Choose a room number (1 to {max_rooms}) with command: join <room_number>"))
-    with data_lock:
-        round_active = True  # Mark the discussion round as active.
-    # Inform clients of the discussion phase and how long it lasts.
-    broadcast(create_message("INFO", message=f"Room discussion time: {DISCUSSION_TIME} seconds..."))
-    time.sleep(DISCUSSION_TIME)  # Wait for the discussion phase to complete.
-    end_room_phase()  # End the discussion phase and transition to voting.
-
-def end_room_phase():
-    """
-    Ends the discussion phase by moving all players back to the lobby.
-    Clears current room assignments and notifies clients to rejoin the lobby,
-    then proceeds to collect votes.
-    """
-    global rooms, clients_room_ids, round_active
-    broadcast(create_message("INFO", message="Discussion time over. Returning to the lobby."))
-    with data_lock:
-        # Clear all room assignments.
-        rooms.clear()
-        clients_room_ids.clear()
-        client_snapshot = list(clients.keys())
-        lobby_clients.clear()
-        # Move all clients to the lobby.
-        for conn in client_snapshot:
-            lobby_clients.append(conn)
-            clients_room_ids[conn] = "lobby"
-        round_active = False  # Mark round as inactive.
-    # Notify clients that they have rejoined the lobby.
-    for conn in client_snapshot:
-        send_with_retry(conn, create_message("JOIN_LOBBY"))
-    collect_votes()  # Begin the voting phase.
-
-def collect_votes():
-    """
-    Initiates the voting phase after discussion.
-    Notifies clients to vote, waits for a fixed duration, tallies votes,
-    and then determines which player is eliminated.
-    """
-    global votes
-    with data_lock:
-        votes = {}  # Reset votes for the new voting round.
-    broadcast(create_message("INFO", message="Please vote for who you think is the impostor. Use the command: vote <player_name>"))
-    start_time = time.time()
-    VOTING_DURATION = 20  # Voting phase duration in seconds.
-    while time.time() - start_time < VOTING_DURATION:
-        time.sleep(1)
-    with data_lock:
-        vote_counts = {}
-        # Count the votes received for each target.
-        for target in votes.values():
-            vote_counts[target] = vote_counts.get(target, 0) + 1
-    print("[DEBUG] Votes received:")
-    with data_lock:
-        # Output voting details for debugging purposes.
-        for voter, target in votes.items():
-            print(f"  {voter} voted for {target}")
-    if not vote_counts:
-        # If no votes were cast, notify all clients that no one is eliminated.
-        broadcast(create_message("INFO", message="No votes cast. Nobody is eliminated."))
-        print("[DEBUG] No votes were cast.")
-        check_game_end(None)
-    else:
-        # Determine the player with the highest vote count.
-        eliminated = max(vote_counts.items(), key=lambda x: x[1])[0]
-        broadcast(create_message("VOTE_RESULT", voted_out=eliminated))
-        print(f"[DEBUG] {eliminated} has been voted out.")
-        check_game_end(eliminated)
-    with data_lock:
-        votes.clear()  # Clear votes for next round.
-
-def check_game_end(eliminated_name):
-    """
-    Checks if the game should end based on the eliminated player or the number of remaining players.
-    If the impostor is eliminated or if only two players remain, the game ends.
-    Otherwise, the game continues with another round.
-    """
-    global impostor_for_game, game_running
-    if eliminated_name:
-        eliminated_conn = None
-        with data_lock:
-            # Find the connection associated with the eliminated player.
-            for conn, name in clients.items():
-                if name == eliminated_name:
-                    eliminated_conn = conn
-                    break
-            if eliminated_conn:
-                clients.pop(eliminated_conn, None)  # Remove the eliminated client.
-                try:
-                    eliminated_conn.close()  # Close the client's connection.
-                except Exception:
-                    pass
-    with data_lock:
-        # Check if the impostor is still connected.
-        impostor_still_alive = (impostor_for_game in clients)
-        num_players = len(clients)
-    if eliminated_name and not impostor_still_alive:
-        # If the impostor is eliminated, declare crewmates as winners.
-        broadcast(create_message("END_GAME", winner="crewmates"))
-        with data_lock:
-            game_running = False
-    elif num_players <= 2:
-        # If only two players remain, declare the impostor as the winner.
-        broadcast(create_message("END_GAME", winner="impostor"))
-        with data_lock:
-            game_running = False
-    else:
-        # Otherwise, wait briefly and start a new round.
-        time.sleep(2)
-        start_game()
+    return sharding.create_listener(host, port, reuse_port=sharding.is_sharded())
 
-def run_server():
+def run_server(host="", port=5555):
     """
-    Sets up and starts the server.
+    Sets up and starts the server in threaded mode.
     Binds to a specified port, listens for incoming connections, and spawns a new thread for each client.
     """
     print("Clients use this to join:", socket.gethostbyname(socket.gethostname()))
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(("", 5555))  # Bind the server socket to all available interfaces on port 5555.
-    server.listen()         # Start listening for incoming connections.
-    print("[SERVER STARTED] Listening on port 5555")
+    server = create_listener(host, port)  # Bind to all available interfaces on the port and listen.
+    if sharding.is_sharded():
+        threading.Thread(target=receive_handoffs, daemon=True).start()
+    print(f"[SERVER STARTED] Listening on port {port} (threaded mode{worker_label()})")
     while True:
         conn, addr = server.accept()  # Accept new incoming connection.
         # Spawn a new thread to handle the client communication.
         threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
 
+async def serve_async(host="", port=5555):
+    """
+    Starts the asyncio server: every connection is a coroutine on a single event loop thread.
+    """
+    print("Clients use this to join:", socket.gethostbyname(socket.gethostname()))
+    loop = asyncio.get_running_loop()
+    server = create_listener(host, port)
+    server.setblocking(False)
+    tasks = set()  # Strong references so running client coroutines are not garbage collected.
+
+    def start_client(conn, addr, buffer=b"", wire_format=WIRE_JSON):
+        conn.setblocking(False)
+        task = loop.create_task(handle_async_client(conn, addr, buffer, wire_format))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    def adopt_handoffs():
+        # Called by the loop whenever the inbox is readable; drain every queued handoff.
+        while True:
+            handoff = sharding.receive_handoff()
+            if handoff is None:
+                return
+            conn, pending, wire_format = handoff
+            start_client(conn, conn.getpeername(), pending, wire_format)
+
+    if sharding.is_sharded():
+        sharding.inbox.setblocking(False)
+        loop.add_reader(sharding.inbox.fileno(), adopt_handoffs)
+    print(f"[SERVER STARTED] Listening on port {port} (asyncio mode{worker_label()})")
+    while True:
+        conn, addr = await loop.sock_accept(server)
+        start_client(conn, addr)
+
+def run_async_server(host="", port=5555):
+    """
+    Runs the asyncio server mode until interrupted.
+    """
+    try:
+        asyncio.run(serve_async(host, port))
+    except KeyboardInterrupt:
+        print("\n[SHUTTING DOWN] Server is shutting down.")
+
+def worker_label():
+    """
+    Returns a suffix identifying the worker in log lines of a multi-process server.
+    """
+    if sharding.is_sharded():
+        return f", worker {sharding.worker_index + 1}/{sharding.worker_count}, pid {os.getpid()}"
+    return ""
+
 # --------------------------- Main Execution --------------------------- #
+def parse_rate_limit(text):
+    try:
+        return flood.parse_limit(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def parse_args(argv=None):
+    """
+    Parses the command line options used to pick the server mode and address.
+    """
+    parser = argparse.ArgumentParser(description="Blend In game server")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded",
+                        help="threaded: one thread per connection (default); asyncio: single-threaded event loop")
+    parser.add_argument("--host", default="", help="address to bind (default: all interfaces)")
+    parser.add_argument("--port", type=int, default=5555, help="port to listen on (default: 5555)")
+    parser.add_argument("--queue-size", type=int, default=1024,
+                        help="frames each client may have waiting to be sent (default: 1024)")
+    parser.add_argument("--slow-consumer", choices=SLOW_CONSUMER_POLICIES, default="drop_oldest",
+                        help="what to do when a client's queue is full (default: drop_oldest)")
+    parser.add_argument("--write-window", type=float, default=2.0, metavar="MS",
+                        help="milliseconds a client's writer waits after a write for more frames to send together; "
+                             "clients quiet for longer are written at once, 0 turns it off (default: 2)")
+    parser.add_argument("--cork", choices=("on", "off"), default="on",
+                        help="hold each recipient's writer until a burst of messages (e.g. a phase transition) "
+                             "is fully queued, so it goes out in one write (default: on)")
+    parser.add_argument("--tcp-nodelay", choices=("on", "off"), default="on",
+                        help="set TCP_NODELAY on client sockets so small writes are not delayed by Nagle's "
+                             "algorithm (default: on)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes sharing the port with SO_REUSEPORT; "
+                             "each hosts a disjoint set of game sessions (default: 1)")
+    parser.add_argument("--discussion-time", type=float, default=game_session.DISCUSSION_TIME,
+                        help=f"seconds of chat room discussion per round (default: {game_session.DISCUSSION_TIME})")
+    parser.add_argument("--voting-time", type=float, default=game_session.VOTING_DURATION,
+                        help=f"seconds players have to vote (default: {game_session.VOTING_DURATION})")
+    parser.add_argument("--min-players", type=int, default=game_session.MATCH_MIN_PLAYERS,
+                        help=f"smallest game the matchmaker forms (default: {game_session.MATCH_MIN_PLAYERS})")
+    parser.add_argument("--max-players", type=int, default=game_session.MATCH_MAX_PLAYERS,
+                        help="largest game; this many ready players start one right away "
+                             f"(default: {game_session.MATCH_MAX_PLAYERS})")
+    parser.add_argument("--match-wait", type=float, default=game_session.MATCH_WAIT,
+                        help="seconds the longest-waiting ready player waits before a game smaller than "
+                             f"--max-players starts anyway (default: {game_session.MATCH_WAIT})")
+    parser.add_argument("--room-capacity", type=int, default=game_session.ROOM_CAPACITY,
+                        help=f"players per chat room; each round opens just enough rooms (default: {game_session.ROOM_CAPACITY})")
+    parser.add_argument("--auto-rooms", action="store_true",
+                        help="put every player in an open chat room when the discussion starts")
+    parser.add_argument("--resume-grace", type=float, default=game_session.RESUME_GRACE,
+                        help="seconds a disconnected player's seat is held for them to resume; 0 removes them "
+                             f"at once (default: {game_session.RESUME_GRACE})")
+    parser.add_argument("--heartbeat-interval", type=float, default=heartbeat.HEARTBEAT_INTERVAL,
+                        help="seconds a client may be quiet before the server PINGs it; 0 turns heartbeats off "
+                             f"(default: {heartbeat.HEARTBEAT_INTERVAL:g})")
+    parser.add_argument("--heartbeat-timeout", type=float, default=heartbeat.HEARTBEAT_TIMEOUT,
+                        help="seconds without any data from a client before its connection is closed "
+                             f"(default: {heartbeat.HEARTBEAT_TIMEOUT:g})")
+    parser.add_argument("--keepalive-idle", type=int, default=heartbeat.KEEPALIVE_IDLE,
+                        help=f"seconds before TCP keepalive starts probing an idle connection (default: {heartbeat.KEEPALIVE_IDLE})")
+    parser.add_argument("--rate-limit", action="append", type=parse_rate_limit, default=[], metavar="TYPE=RATE[/BURST]",
+                        help="messages of TYPE each client may send per second, with bursts of up to BURST "
+                             "(default burst: twice the rate); TYPE '*' covers every type without its own limit "
+                             "and a rate of 0 removes the limit; may be repeated (default: CHAT=5/10, JOIN, READY "
+                             "and VOTE=2/5, PING=5/10, *=20/40)")
+    parser.add_argument("--flood-policy", choices=flood.FLOOD_POLICIES, default="drop",
+                        help="what to do with CHAT lines over the limit: drop them, or merge them into one line "
+                             "sent when the client is within its limit again (default: drop)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus metrics over HTTP on this port (worker N of a multi-process "
+                             "server uses the port + N); off by default")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="address the metrics endpoint binds to (default: 127.0.0.1, local only)")
+    parser.add_argument("--profile-seconds", type=float, default=profiling.PROFILE_SECONDS,
+                        help="length of the sampling profile started by SIGUSR2 (SIGUSR1 prints handler "
+                             f"timings) (default: {profiling.PROFILE_SECONDS})")
+    parser.add_argument("--profile-dir", default=".", help="directory for the profile files (default: .)")
+    parser.add_argument("--analytics-file",
+                        help="append facts about every finished round to this columnar file for round_stats.py "
+                             "(worker N of a multi-process server appends .worker-N to the name); off by default")
+    parser.add_argument("--journal-dir",
+                        help="journal game state changes to this directory (worker N of a multi-process server "
+                             "uses its worker-N subdirectory); off by default")
+    parser.add_argument("--snapshot-interval", type=float, default=journal.SNAPSHOT_INTERVAL,
+                        help=f"seconds between journal snapshots (default: {journal.SNAPSHOT_INTERVAL:g})")
+    parser.add_argument("--recover", action="store_true",
+                        help="rebuild the sessions found in --journal-dir on startup (restart with the same "
+                             "--workers); players resume their seats with their old token. Without it an "
+                             "existing journal is discarded")
+    args = parser.parse_args(argv)
+    if args.room_capacity < 1:
+        parser.error("--room-capacity must be at least 1")
+    if not 1 <= args.min_players <= args.max_players:
+        parser.error("--min-players must be at least 1 and no more than --max-players")
+    if args.recover and not args.journal_dir:
+        parser.error("--recover needs --journal-dir")
+    return args
+
 if __name__ == "__main__":
-    run_server()
+    args = parse_args()
+    configure_outbound(args.queue_size, args.slow_consumer)
+    configure_writes(args.write_window / 1000, args.cork == "on", args.tcp_nodelay == "on")
+    flood.configure_limits(dict(args.rate_limit), args.flood_policy)
+    # Shorter rounds are mainly useful for load tests (see benchmarks/loadtest.py).
+    game_session.DISCUSSION_TIME = args.discussion_time
+    game_session.VOTING_DURATION = args.voting_time
+    game_session.RESUME_GRACE = args.resume_grace
+    game_session.MATCH_MIN_PLAYERS = args.min_players
+    game_session.MATCH_MAX_PLAYERS = args.max_players
+    game_session.MATCH_WAIT = args.match_wait
+    game_session.ROOM_CAPACITY = args.room_capacity
+    game_session.AUTO_ASSIGN_ROOMS = args.auto_rooms
+    profiling.PROFILE_SECONDS = args.profile_seconds
+    heartbeat.HEARTBEAT_INTERVAL = args.heartbeat_interval
+    heartbeat.HEARTBEAT_TIMEOUT = args.heartbeat_timeout
+    heartbeat.KEEPALIVE_IDLE = args.keepalive_idle
+    profiling.profile_dir = args.profile_dir
+    journal.SNAPSHOT_INTERVAL = args.snapshot_interval
+    if args.workers > 1:
+        sharding.start_workers(args.workers)  # Returns only inside the forked workers.
+    profiling.install_signal_handlers()
+    heartbeat.start()
+    if args.analytics_file:
+        analytics_file = args.analytics_file
+        if args.workers > 1:
+            analytics_file += f".worker-{sharding.worker_index}"
+        analytics.start(analytics_file)
+    if args.journal_dir:
+        journal_dir = args.journal_dir
+        if args.workers > 1:
+            journal_dir = os.path.join(journal_dir, f"worker-{sharding.worker_index}")
+        game_session.restore_sessions(journal.open_journal(journal_dir, args.recover))
+        journal.start(journal_dir, game_session.snapshot_states)
+    if args.metrics_port is not None:
+        metrics.start_endpoint(args.metrics_host, args.metrics_port + sharding.worker_index)
+    if args.mode == "asyncio":
+        run_async_server(args.host, args.port)
+    else:
+        run_server(args.host, args.port)
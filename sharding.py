@@ -0,0 +1,125 @@
+import os              # Used to fork the worker processes and wait for them.
+import json            # Used to encode the small header that travels with a handed-off socket.
+import signal          # Stops every worker when the launcher is interrupted and forwards profiling signals.
+import socket          # Provides the Unix datagram sockets used to pass connections between workers.
+import zlib            # Provides crc32, a hash of session ids that is stable across processes.
+
+from game_session import normalize_session_id
+
+# ------------------------- Worker State ------------------------- #
+# These are filled in by start_workers() inside each forked worker process.
+# In a single-process server worker_count stays 1 and every session is local.
+
+worker_count = 1       # Total number of worker processes sharing the listening port.
+worker_index = 0       # Index of the current worker (0 .. worker_count - 1).
+inbox = None           # Unix datagram socket on which this worker receives handed-off connections.
+outboxes = []          # Sending ends of every worker's inbox, indexed by worker number.
+
+def is_sharded():
+    """
+    Returns True inside a worker of a multi-process server.
+    """
+    return worker_count > 1
+
+def owner_of(session_id):
+    """
+    Returns the index of the worker that hosts a session.
+    Every worker computes the same answer, so the sessions are split into disjoint sets without coordination.
+    """
+    return zlib.crc32(normalize_session_id(session_id).encode()) % worker_count
+
+def create_listener(host, port, reuse_port=False):
+    """
+    Creates the listening TCP socket. With reuse_port every worker binds its own socket
+    to the same port and the kernel spreads incoming connections across them.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((host, port))
+    server.listen(socket.SOMAXCONN)
+    return server
+
+def hand_off(conn, session_id, pending):
+    """
+    Passes a connection to the worker that owns 'session_id'.
+    The socket's file descriptor travels over the owner's inbox together with 'pending',
+    the bytes already read from the client (starting with its JOIN_ROOM), and the wire format
+    the client negotiated, so the owner carries on exactly where this worker stopped.
+    Returns True if the handoff succeeded.
+    """
+    owner = owner_of(session_id)
+    header = json.dumps({"pending": pending.decode("latin-1"), "wire_format": conn.wire_format,
+                         "from": worker_index}).encode()
+    try:
+        socket.send_fds(outboxes[owner], [header], [conn.fileno()])
+        return True
+    except OSError as e:
+        print(f"[ERROR] [worker {worker_index}] Handoff to worker {owner} failed: {e}")
+        return False
+
+def receive_handoff():
+    """
+    Receives one handed-off connection from this worker's inbox.
+    Returns a (socket, pending_bytes, wire_format) tuple, or None if nothing is waiting on a non-blocking inbox.
+    """
+    try:
+        header, fds, _flags, _addr = socket.recv_fds(inbox, 1 << 20, 1)
+    except BlockingIOError:
+        return None
+    if not fds:
+        return None
+    conn = socket.socket(fileno=fds[0])
+    info = json.loads(header.decode())
+    return conn, info["pending"].encode("latin-1"), info["wire_format"]
+
+def start_workers(count):
+    """
+    Forks 'count' worker processes and returns in each of them with its worker_index set.
+    The launching process never returns: it waits for the workers and stops them all on exit.
+    """
+    global worker_count, worker_index, inbox, outboxes
+    # One inbox per worker; every worker keeps the sending end of all of them.
+    pairs = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(count)]
+    children = []
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            worker_count = count
+            worker_index = index
+            inbox = pairs[index][0]
+            outboxes = [send_end for _recv_end, send_end in pairs]
+            # Inboxes belonging to other workers are not ours to read.
+            for other, (recv_end, _send_end) in enumerate(pairs):
+                if other != index:
+                    recv_end.close()
+            return
+        children.append(pid)
+
+    print(f"[LAUNCHER] Started {count} workers: {children}")
+    # The profiling signals (see profiling.py) are meant for the workers, which do the actual work.
+    if hasattr(signal, "SIGUSR1"):
+        def forward(signum, frame):
+            for pid in children:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+        signal.signal(signal.SIGUSR1, forward)
+        signal.signal(signal.SIGUSR2, forward)
+    try:
+        while children:
+            pid, _status = os.wait()
+            if pid in children:
+                children.remove(pid)
+                print(f"[LAUNCHER] Worker {pid} exited.")
+    except KeyboardInterrupt:
+        print("\n[SHUTTING DOWN] Stopping workers.")
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    os._exit(0)
@@ -0,0 +1,23 @@
+import json            # Builds the JSON frames under test.
+
+import pytest          # Runs the tests: python -m pytest
+
+from protocol import decode_frame, InvalidMessage
+
+# A malformed message must raise InvalidMessage (which the server answers with an INFO message)
+# and never any other exception, which would end the client's connection.
+
+@pytest.mark.parametrize("message_type", [["CHAT"], {"name": "CHAT"}, 7, None, True])
+def test_non_string_type_is_invalid(message_type):
+    frame = json.dumps({"type": message_type, "message": "hi"}).encode()
+    with pytest.raises(InvalidMessage):
+        decode_frame(frame)
+
+def test_missing_and_unknown_types_are_invalid():
+    with pytest.raises(InvalidMessage):
+        decode_frame(b'{"message": "hi"}')
+    with pytest.raises(InvalidMessage):
+        decode_frame(b'{"type": "NO_SUCH_TYPE"}')
+
+def test_valid_message_still_decodes():
+    assert decode_frame(b'{"type": "CHAT", "message": "hi"}')["message"] == "hi"